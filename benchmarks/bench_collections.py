@@ -0,0 +1,24 @@
+from django.test import Client
+
+from benchmarks.fixtures import LOCAL_DOMAIN, followers, local_actor, notes
+from benchmarks.runner import benchmark
+
+
+def collection_sizes(options):
+    return options.get('sizes', [10, 1000])
+
+
+@benchmark('collections.outbox_page', params=collection_sizes, rounds=100)
+def bench_outbox_page(size):
+    actor = local_actor()
+    notes(actor, size)
+    client = Client(HTTP_HOST=LOCAL_DOMAIN)
+    return lambda: client.get(f'/pub/{actor.preferred_username}/outbox', {'page': 1})
+
+
+@benchmark('collections.followers_page', params=collection_sizes, rounds=100)
+def bench_followers_page(size):
+    actor = local_actor()
+    followers(actor, size)
+    client = Client(HTTP_HOST=LOCAL_DOMAIN)
+    return lambda: client.get(f'/pub/{actor.preferred_username}/followers', {'page': 1})
@@ -0,0 +1,44 @@
+import json
+
+from django_activitypub.delivery import deliver_pending, enqueue, fanout_plan, follower_inboxes
+from django_activitypub.models import Delivery, send_create_note_to_followers
+
+from benchmarks.fixtures import followers, local_actor, notes
+from benchmarks.runner import benchmark
+
+
+def fanout_sizes(options):
+    return options.get('fanout_sizes', [10, 100])
+
+
+@benchmark('fanout.send_create_note', params=fanout_sizes, rounds=10, max_time=20)
+def bench_send_create_note(count):
+    actor = local_actor()
+    followers(actor, count)
+    note = notes(actor, 1)[0]
+
+    def fanout():
+        note.outbox.clear()
+        send_create_note_to_followers(note)
+    return fanout
+
+
+@benchmark('fanout.delivery_queue', params=fanout_sizes, rounds=10, max_time=20)
+def bench_delivery_queue(count):
+    actor = local_actor()
+    followers(actor, count, domains=count)
+    note = notes(actor, 1)[0]
+    body = json.dumps(note.as_json(mode='activity'))
+
+    def fanout():
+        Delivery.objects.all().delete()
+        enqueue(actor, body, follower_inboxes(actor))
+        deliver_pending()
+    return fanout
+
+
+@benchmark('fanout.plan', params=fanout_sizes, rounds=10, max_time=20)
+def bench_fanout_plan(count):
+    actor = local_actor()
+    followers(actor, count, domains=max(count // 10, 1))
+    return lambda: fanout_plan(actor)
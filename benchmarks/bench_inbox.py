@@ -0,0 +1,55 @@
+import json
+
+from django.test import Client
+
+from django_activitypub.signed_requests import replay_cache
+
+from benchmarks.fixtures import LOCAL_DOMAIN, local_actor, notes, remote_profile, signed_headers
+from benchmarks.runner import benchmark
+
+REMOTE_ACTOR = 'https://remote0.test/users/author'
+ACTIVITY_TYPES = ['Follow', 'Like', 'Announce', 'Undo', 'Create', 'Update', 'Delete']
+
+
+def activities(actor, note):
+    actor_url = f'http://{LOCAL_DOMAIN}/pub/{actor.preferred_username}'
+    note_url = f'http://{LOCAL_DOMAIN}/pub/{actor.preferred_username}/statuses/{note.content_id}'
+    return {
+        'Follow': {'type': 'Follow', 'actor': REMOTE_ACTOR, 'object': actor_url},
+        'Like': {'type': 'Like', 'actor': REMOTE_ACTOR, 'object': note_url},
+        'Announce': {'type': 'Announce', 'actor': REMOTE_ACTOR, 'object': note_url},
+        'Undo': {
+            'type': 'Undo', 'actor': REMOTE_ACTOR,
+            'object': {'type': 'Like', 'actor': REMOTE_ACTOR, 'object': note_url},
+        },
+        'Create': {
+            'type': 'Create', 'actor': REMOTE_ACTOR,
+            'object': {'id': 'https://remote0.test/notes/1', 'type': 'Note', 'inReplyTo': note_url},
+        },
+        'Update': {'type': 'Update', 'actor': REMOTE_ACTOR, 'object': remote_profile('author', 'remote0.test')},
+        'Delete': {'type': 'Delete', 'actor': REMOTE_ACTOR, 'object': 'https://remote0.test/notes/2'},
+    }
+
+
+@benchmark('inbox.activity', params=ACTIVITY_TYPES, rounds=100)
+def bench_inbox(activity_type):
+    actor = local_actor()
+    note = notes(actor, 1)[0]
+    path = f'/pub/{actor.preferred_username}/inbox'
+    body = json.dumps({
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        **activities(actor, note)[activity_type],
+    })
+    key_id = f'{REMOTE_ACTOR}#main-key'
+    client = Client(HTTP_HOST=LOCAL_DOMAIN)
+
+    def post():
+        # identical bodies signed within the same second have identical signatures, which would count as replays
+        replay_cache.clear()
+        headers = signed_headers(f'http://{LOCAL_DOMAIN}{path}', body, key_id)
+        resp = client.post(
+            path, data=body, content_type=headers['content-type'],
+            HTTP_DATE=headers['date'], HTTP_DIGEST=headers['digest'], HTTP_SIGNATURE=headers['signature'],
+        )
+        assert resp.status_code < 300, (activity_type, resp.status_code, resp.content)
+    return post
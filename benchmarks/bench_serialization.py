@@ -0,0 +1,47 @@
+import io
+
+from django.core.files.base import ContentFile
+from django.test import override_settings
+from PIL import Image
+
+from django_activitypub import encoding
+from django_activitypub.models import ImageAttachment
+
+from benchmarks.fixtures import local_actor, notes
+from benchmarks.runner import benchmark
+
+
+@benchmark('serialization.note_as_json', rounds=500)
+def bench_note_as_json():
+    note = notes(local_actor(), 1)[0]
+    return lambda: note.as_json(mode='activity')
+
+
+@benchmark('serialization.note_as_json_attachments', params=[1, 4], rounds=200)
+def bench_note_as_json_attachments(count):
+    note = notes(local_actor(), 1)[0]
+    for i in range(count):
+        buffer = io.BytesIO()
+        Image.new('RGB', (800, 600), color=(i * 40, 80, 160)).save(buffer, format='JPEG')
+        attachment = ImageAttachment(note=note, caption=f'image {i}')
+        attachment.attachment.save(f'bench-{note.id}-{i}.jpg', ContentFile(buffer.getvalue()))
+    return lambda: note.as_json(mode='activity')
+
+
+def json_backends(options):
+    return ['json', 'orjson'] if encoding.orjson is not None else ['json']
+
+
+@benchmark('serialization.outbox_page_encode', params=json_backends, rounds=200)
+def bench_outbox_page_encode(backend):
+    actor = local_actor()
+    page = {
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        'type': 'OrderedCollectionPage',
+        'orderedItems': [note.as_json(mode='activity') for note in notes(actor, 10)],
+    }
+
+    def encode():
+        with override_settings(ACTIVITYPUB_JSON_BACKEND=backend):
+            encoding.dumps(page)
+    return encode
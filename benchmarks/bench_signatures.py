@@ -0,0 +1,77 @@
+import json
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from django_activitypub import keys
+from django_activitypub.signed_requests import RFC9421, SignatureChecker, replay_cache, signed_post, verify_prepared
+
+from benchmarks.fixtures import remote_key, remote_profile, signed_headers
+from benchmarks.runner import benchmark
+
+INBOX = 'https://remote0.test/users/bench/inbox'
+KEY_ID = 'https://local.test/pub/bench#main-key'
+BODY = json.dumps({
+    '@context': 'https://www.w3.org/ns/activitystreams',
+    'type': 'Create',
+    'actor': 'https://local.test/pub/bench',
+    'object': {'type': 'Note', 'content': '<p>' + 'benchmark ' * 50 + '</p>'},
+})
+
+
+@benchmark('signatures.signed_post', rounds=200)
+def bench_signed_post():
+    private_key = remote_key()[0]
+    return lambda: signed_post(INBOX, private_key, KEY_ID, body=BODY)
+
+
+@benchmark('signatures.signed_post_ed25519', rounds=200)
+def bench_signed_post_ed25519():
+    private_key = keys.generate_key_pair(keys.ED25519)[0].encode('utf-8')
+    return lambda: signed_post(INBOX, private_key, KEY_ID, body=BODY, scheme=RFC9421)
+
+
+@benchmark('signatures.validate', rounds=200)
+def bench_validate():
+    profile = remote_profile('author', 'remote0.test')
+    headers = signed_headers(INBOX, BODY, profile['publicKey']['id'])
+
+    def validate():
+        # each round stands for a new request, not a replay of the first one
+        replay_cache.clear()
+        return SignatureChecker(profile['publicKey']).validate('post', INBOX, headers, BODY.encode('utf-8'))
+    return validate
+
+
+@benchmark('signatures.validate_replay', rounds=200)
+def bench_validate_replay():
+    profile = remote_profile('author', 'remote0.test')
+    headers = signed_headers(INBOX, BODY, profile['publicKey']['id'])
+    checker = SignatureChecker(profile['publicKey'])
+    checker.validate('post', INBOX, headers, BODY.encode('utf-8'))
+    return lambda: checker.validate('post', INBOX, headers, BODY.encode('utf-8'))
+
+
+@benchmark('signatures.verify_batch', params=[1, 2, 4], rounds=5)
+def bench_verify_batch(processes):
+    """
+    200 queued signatures from 20 keys, verified in chunks over a pool of worker processes.
+    """
+    jobs = []
+    for i in range(20):
+        profile = remote_profile(f'author{i}', 'remote0.test')
+        checker = SignatureChecker(profile['publicKey'])
+        for j in range(10):
+            body = BODY.replace('benchmark', f'benchmark {j}')
+            headers = signed_headers(INBOX, body, profile['publicKey']['id'])
+            jobs.append((profile, (j, checker.prepare('post', INBOX, headers, body.encode('utf-8')))))
+    executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+    # start the workers before timing
+    list(executor.map(abs, range(processes)))
+
+    def verify():
+        futures = [
+            executor.submit(verify_prepared, jobs[start][0], [job for _, job in jobs[start:start + 10]])
+            for start in range(0, len(jobs), 10)
+        ]
+        return [future.result() for future in futures]
+    return verify
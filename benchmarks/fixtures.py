@@ -0,0 +1,144 @@
+import itertools
+import json
+import re
+from functools import lru_cache
+from urllib.parse import urlparse
+
+import responses
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from django.contrib.auth import get_user_model
+
+from django_activitypub.models import LocalActor, RemoteActor, Follower, Note
+from django_activitypub.signed_requests import build_signature, content_digest_sha256, get_gmt_now
+
+LOCAL_DOMAIN = 'local.test'
+BATCH_SIZE = 1000
+
+_counter = itertools.count()
+
+
+@lru_cache(maxsize=None)
+def remote_key():
+    """
+    One key pair shared by every stand-in remote actor, so fixtures do not pay for key generation.
+    """
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    private_pem = key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PrivateFormat.TraditionalOpenSSL,
+        encryption_algorithm=serialization.NoEncryption(),
+    )
+    public_pem = key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo,
+    ).decode('utf-8')
+    return private_pem, public_pem
+
+
+def remote_profile(username, domain):
+    url = f'https://{domain}/users/{username}'
+    return {
+        '@context': ['https://www.w3.org/ns/activitystreams', 'https://w3id.org/security/v1'],
+        'id': url,
+        'type': 'Person',
+        'preferredUsername': username,
+        'name': username.title(),
+        'inbox': f'{url}/inbox',
+        'endpoints': {'sharedInbox': f'https://{domain}/inbox'},
+        'icon': {'type': 'Image', 'url': f'https://{domain}/avatars/{username}.png'},
+        'publicKey': {'id': f'{url}#main-key', 'owner': url, 'publicKeyPem': remote_key()[1]},
+    }
+
+
+def local_actor(username=None):
+    username = username or f'bench{next(_counter)}'
+    user = get_user_model().objects.create(username=username)
+    return LocalActor.objects.create(user=user, preferred_username=username, domain=LOCAL_DOMAIN, name=username)
+
+
+def remote_actors(count, domains=10):
+    prefix = next(_counter)
+    actors = []
+    for i in range(count):
+        username = f'r{prefix}x{i}'
+        domain = f'remote{i % domains}.test'
+        profile = remote_profile(username, domain)
+        actor = RemoteActor(username=username, domain=domain, url=profile['id'], profile=profile)
+        actor.sync_profile_fields()
+        actors.append(actor)
+    return RemoteActor.objects.bulk_create(actors, batch_size=BATCH_SIZE)
+
+
+def followers(actor, count, domains=10):
+    Follower.objects.bulk_create(
+        [Follower(remote_actor=r, following=actor) for r in remote_actors(count, domains)],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def notes(actor, count, content='A note about #benchmarks with a link to https://example.com/page'):
+    prefix = next(_counter)
+    return Note.objects.bulk_create(
+        [
+            Note(local_actor=actor, content=content, content_url=f'https://{LOCAL_DOMAIN}/posts/{prefix}-{i}')
+            for i in range(count)
+        ],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def remote_servers():
+    """
+    Stand-in for every remote server: actor documents are served for GETs and every inbox accepts POSTs.
+    """
+    mock = responses.RequestsMock(assert_all_requests_are_fired=False)
+    mock.add_callback(
+        responses.GET, re.compile(r'https://remote\d*\.test/users/[^/]+$'),
+        callback=lambda request: (200, {}, _profile_body(request.url)),
+        content_type='application/activity+json',
+    )
+    mock.add_callback(
+        responses.GET, re.compile(r'https://remote\d*\.test/notes/[^/]+$'),
+        callback=lambda request: (200, {}, _note_body(request.url)),
+        content_type='application/activity+json',
+    )
+    mock.add(responses.POST, re.compile(r'https://remote\d*\.test/.*inbox$'), status=202)
+    return mock
+
+
+def _profile_body(url):
+    match = re.match(r'https://(?P<domain>[^/]+)/users/(?P<username>[^/]+)$', url)
+    return json.dumps(remote_profile(match.group('username'), match.group('domain')))
+
+
+def _note_body(url):
+    domain = url.split('/')[2]
+    return json.dumps({
+        'id': url,
+        'type': 'Note',
+        'attributedTo': f'https://{domain}/users/author',
+        'published': '2024-01-13T05:59:20Z',
+        'content': '<p>A remote reply</p>',
+    })
+
+
+def signed_headers(url, body, key_id, private_key=None):
+    """
+    The headers signed_post would send for body, as a dict with lower-case names.
+    """
+    parsed = urlparse(url)
+    headers = {
+        'host': parsed.netloc,
+        'date': get_gmt_now(),
+        'digest': content_digest_sha256(body),
+        'content-type': 'application/activity+json',
+    }
+    headers['signature'] = (
+        build_signature(parsed.netloc, 'post', parsed.path)
+        .with_field('date', headers['date'])
+        .with_field('digest', headers['digest'])
+        .with_field('content-type', headers['content-type'])
+        .build_signature(key_id, private_key or remote_key()[0])
+    )
+    return headers
@@ -0,0 +1,89 @@
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+_registry = []
+
+
+def benchmark(name, params=None, rounds=50, max_time=5.0):
+    """
+    Register a benchmark. The decorated function does its setup for one parameter value and returns the
+    zero-argument callable to be timed. params is a list of values, or a callable returning one from the
+    command line options.
+    """
+    def decorator(fn):
+        _registry.append({'name': name, 'params': params, 'rounds': rounds, 'max_time': max_time, 'setup': fn})
+        return fn
+    return decorator
+
+
+def time_callable(fn, rounds, max_time):
+    fn()  # warm up caches, connections and lazy imports
+    timings = []
+    started = time.perf_counter()
+    while len(timings) < rounds and (len(timings) < 3 or time.perf_counter() - started < max_time):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return {
+        'rounds': len(timings),
+        'min': min(timings),
+        'max': max(timings),
+        'mean': statistics.mean(timings),
+        'median': statistics.median(timings),
+        'stddev': statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        'ops': len(timings) / sum(timings),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(selected=None, options=None, out=sys.stdout):
+    results = []
+    for bench in _registry:
+        if selected and not any(s in bench['name'] for s in selected):
+            continue
+        params = bench['params']
+        if callable(params):
+            params = params(options or {})
+        for param in params or [None]:
+            fn = bench['setup'](param) if param is not None else bench['setup']()
+            result = {'name': bench['name'], 'param': param, **time_callable(fn, bench['rounds'], bench['max_time'])}
+            results.append(result)
+            label = bench['name'] if param is None else f'{bench["name"]}[{param}]'
+            out.write(f'{label:<50} {result["median"] * 1000:>10.3f} ms  {result["ops"]:>10.1f} ops/s  ({result["rounds"]} rounds)\n')
+    return {
+        'revision': git_revision(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': results,
+    }
+
+
+def compare(current, previous, out=sys.stdout):
+    before = {(r['name'], r['param']): r for r in previous['results']}
+    out.write(f'\ncompared with {previous.get("revision")}:\n')
+    for result in current['results']:
+        key = (result['name'], result['param'])
+        if key not in before:
+            continue
+        ratio = result['median'] / before[key]['median']
+        label = result['name'] if result['param'] is None else f'{result["name"]}[{result["param"]}]'
+        out.write(f'{label:<50} {ratio:>8.2f}x\n')
+
+
+def write(results, path):
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2)
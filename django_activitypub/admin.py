@@ -5,7 +5,7 @@ from django.db.models.functions import Substr
 from django.forms import Textarea
 from django.utils.safestring import mark_safe
 
-from django_activitypub.models import LocalActor, RemoteActor, Follower, Following, Note, ImageAttachment, NoteTemplate
+from django_activitypub.models import LocalActor, RemoteActor, Follower, FollowerDigest, Following, Note, Hashtag, ImageAttachment, NoteTemplate, Backfill, Delivery, DeliveryWorker, InboxItem, RemoteObject
 
 class ImageAttachmentInline(admin.TabularInline):
     model = ImageAttachment
@@ -15,7 +15,14 @@ class ImageAttachmentInline(admin.TabularInline):
         css = {"all": ("admin/css/hide_clear_link.css",)} 
 
 admin.site.register(Follower)
+admin.site.register(FollowerDigest)
 admin.site.register(Following)
+admin.site.register(Hashtag)
+admin.site.register(Backfill)
+admin.site.register(Delivery)
+admin.site.register(DeliveryWorker)
+admin.site.register(InboxItem)
+admin.site.register(RemoteObject)
 
 @admin.register(Note)
 class NoteAdmin(admin.ModelAdmin):
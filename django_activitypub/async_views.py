@@ -0,0 +1,244 @@
+import json
+import math
+
+from asgiref.sync import sync_to_async
+from django.db import close_old_connections
+from django.http import HttpResponse
+from django.urls import reverse
+from django.views.decorators.csrf import csrf_exempt
+
+from django_activitypub import metrics
+from django_activitypub.encoding import ActivityJsonResponse, dumps_with_items
+from django_activitypub.hashtags import featured_tags
+from django_activitypub.models import LocalActor, RemoteActor, Follower, Note
+from django_activitypub.ratelimit import admit_verified, throttle_inbox
+from django_activitypub.verification import inbox_item, queue_inbox
+from django_activitypub.views import (
+    cached_webfinger_response, handle_activity, logger, outbox_items, outbox_queryset, profile_response,
+    verify_signature, webfinger_account, webfinger_cache_entry, webfinger_response,
+)
+from django_activitypub.webfinger import (
+    WEBFINGER_GENERATION_KEY, WebfingerException, afetch_remote_profile, webfinger_cache, webfinger_cache_key,
+    webfinger_cache_timeout,
+)
+
+PAGE_SIZE = 10
+
+
+def off_thread(fn):
+    """
+    sync_to_async on an executor thread of its own rather than the thread shared by every sync_to_async call, so a
+    slow call holds up only its own request. Nothing runs the request cycle's connection cleanup on those threads,
+    so it is done around each call instead.
+    """
+    def run(*args, **kwargs):
+        close_old_connections()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            close_old_connections()
+    return sync_to_async(run, thread_sensitive=False)
+
+
+async def collection_page(request, query, collection_url):
+    """
+    Builds an OrderedCollection for query, or the OrderedCollectionPage asked for by the page parameter.
+    Returns (data, objects), with objects None for the collection itself and data None for an invalid page.
+    """
+    total = await query.acount()
+    data = {
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        'type': 'OrderedCollection',
+        'totalItems': total,
+        'id': collection_url,
+    }
+
+    page_num_arg = request.GET.get('page', None)
+    if page_num_arg is None:
+        data['first'] = collection_url + '?page=1'
+        return data, None
+
+    page_num = int(page_num_arg)
+    num_pages = max(1, math.ceil(total / PAGE_SIZE))
+    if not 1 <= page_num <= num_pages:
+        return None, None
+
+    offset = (page_num - 1) * PAGE_SIZE
+    objects = [obj async for obj in query[offset:offset + PAGE_SIZE]]
+    if page_num < num_pages:
+        data['next'] = collection_url + f'?page={page_num + 1}'
+    data['id'] = collection_url + f'?page={page_num}'
+    data['type'] = 'OrderedCollectionPage'
+    data['partOf'] = collection_url
+    return data, objects
+
+
+async def webfinger(request):
+    cache = webfinger_cache()
+    key = webfinger_cache_key(request, await cache.aget(WEBFINGER_GENERATION_KEY, 0))
+    cached = await cache.aget(key)
+    metrics.cache_lookup('webfinger', cached is not None)
+    if cached is not None:
+        return cached_webfinger_response(cached)
+
+    response = await find_actor(request)
+    if response.status_code in (200, 404):
+        await cache.aset(key, webfinger_cache_entry(response), webfinger_cache_timeout(response.status_code))
+    return response
+
+
+async def find_actor(request):
+    account = webfinger_account(request)
+    if isinstance(account, HttpResponse):
+        return account
+    username, domain = account
+
+    try:
+        actor = await LocalActor.objects.aget(preferred_username=username, domain=domain)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({'error': 'no actor by that name'}, status=404)
+
+    return webfinger_response(request, actor)
+
+
+async def profile(request, username):
+    try:
+        actor = await LocalActor.objects.aget(preferred_username=username)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({}, status=404)
+
+    featured = [name async for name in featured_tags(actor)]
+    return profile_response(request, actor, featured)
+
+
+async def notes(request, username, id, mode='statuses'):
+    data = {"@context": "https://www.w3.org/ns/activitystreams"}
+    try:
+        note = await Note.objects.select_related('local_actor', 'remote_actor', 'parent').aget(content_id=id)
+    except Note.DoesNotExist:
+        return ActivityJsonResponse({'error': 'Not Found'}, status=404)
+    if mode in ('statuses', 'activity'):
+        data.update(await off_thread(note.as_json)(mode=mode))
+    elif mode == 'likes':
+        data.update({
+            "id": request.build_absolute_uri(reverse('activitypub-notes-likes', kwargs={'username': username, 'id': id})),
+            "type": "Collection",
+            "totalItems": await note.likes.acount()
+        })
+    elif mode == 'shares':
+        data.update({
+            'id': request.build_absolute_uri(reverse('activitypub-notes-shares', kwargs={'username': username, 'id': id})),
+            'type': 'Collection',
+            'totalItems': await note.announces.acount()
+        })
+    elif mode == 'delete':
+        data = {}
+    elif mode == 'replies':
+        replies_url = request.build_absolute_uri(reverse('activitypub-notes-replies', kwargs={'username': username, 'id': id}))
+        if request.GET.get('page', None) is None:
+            data.update({
+                'id': replies_url,
+                'type': 'Collection',
+                'first': {
+                    'id': replies_url + '?page=1',
+                    'type': 'CollectionPage',
+                    'next': replies_url + '?page=1',
+                    'partOf': replies_url,
+                    'items': []
+                },
+            })
+        else:
+            query = note.children.select_related('local_actor').order_by('-published_at')
+            page, replies = await collection_page(request, query, replies_url)
+            if page is None:
+                return ActivityJsonResponse({'error': f'invalid page number {request.GET["page"]}'}, status=404)
+            data.update({
+                'id': page['id'],
+                'type': 'CollectionPage',
+                'partOf': replies_url,
+                'items': [reply.get_absolute_url() for reply in replies],
+            })
+            if 'next' in page:
+                data['next'] = page['next']
+    return ActivityJsonResponse(data, content_type="application/activity+json")
+
+
+async def followers(request, username):
+    try:
+        actor = await LocalActor.objects.aget(preferred_username=username)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({}, status=404)
+
+    query = Follower.objects.order_by('-follow_date').filter(following=actor).values_list('remote_actor__url', flat=True)
+    followers_url = request.build_absolute_uri(reverse('activitypub-followers', kwargs={'username': actor.preferred_username}))
+    data, page = await collection_page(request, query, followers_url)
+    if data is None:
+        return ActivityJsonResponse({'error': f'invalid page number {request.GET["page"]}'}, status=404)
+    if page is not None:
+        data['orderedItems'] = list(page)
+    return ActivityJsonResponse(data, content_type="application/activity+json")
+
+
+async def outbox(request, username):
+    try:
+        actor = await LocalActor.objects.aget(preferred_username=username)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({}, status=404)
+
+    outbox_url = request.build_absolute_uri(reverse('activitypub-outbox', kwargs={'username': actor.preferred_username}))
+    data, page = await collection_page(request, outbox_queryset(actor), outbox_url)
+    if data is None:
+        return ActivityJsonResponse({'error': f'invalid page number: {request.GET["page"]}'}, status=404)
+    if page is None:
+        return ActivityJsonResponse(data, content_type="application/activity+json")
+    items = await off_thread(outbox_items)(page)
+    return ActivityJsonResponse(dumps_with_items(data, 'orderedItems', items), content_type="application/activity+json")
+
+
+@csrf_exempt
+@metrics.instrument_inbox
+@throttle_inbox
+async def inbox(request, username):
+    if request.method != 'POST':
+        return ActivityJsonResponse({}, status=405)
+
+    activity = json.loads(request.body)
+    request.activitypub_activity_type = activity.get('type', 'unknown')
+
+    try:
+        actor = await LocalActor.objects.aget(preferred_username=username)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({}, status=404)
+
+    if queue_inbox():
+        item = inbox_item(request, actor)
+        if not item.key_id:
+            return ActivityJsonResponse({'error': 'missing signature'}, status=401)
+        await item.asave()
+        return ActivityJsonResponse({}, status=202)
+
+    if validate_resp := await validate_post_request(request, activity, actor):
+        return validate_resp
+    if rejection := await sync_to_async(admit_verified, thread_sensitive=False)(request):
+        return rejection
+
+    # handling fetches remote actors and objects, so a slow remote server holds up only this request
+    return await off_thread(handle_activity)(request, activity, actor)
+
+
+async def validate_post_request(request, activity, actor=None):
+    if 'actor' not in activity:
+        return ActivityJsonResponse({'error': f'no actor in activity: {activity}'}, status=400)
+
+    try:
+        actor_data = await afetch_remote_profile(activity['actor'], actor)
+    except WebfingerException as e:
+        logger.info('could not fetch actor %s: %s', activity['actor'], e.error)
+        # only actors that are gone fall back to the key we already know, as in signing_actor_profile
+        remote_actor = await RemoteActor.objects.filter(url=activity['actor']).afirst() if e.gone else None
+        actor_data = remote_actor.key_document() if remote_actor else None
+        if actor_data is None:
+            return ActivityJsonResponse({'error': 'validate - error fetching remote profile'}, status=400)
+
+    # the replay cache and the public key operation would block the event loop
+    return await off_thread(verify_signature)(request, activity, actor_data)
@@ -0,0 +1,210 @@
+import asyncio
+import os
+import weakref
+from dataclasses import dataclass, field
+from typing import Mapping
+from urllib.parse import urlencode, urlparse
+
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+from django_activitypub import metrics
+from django_activitypub.encoding import loads
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+# (connect, read) seconds
+DEFAULT_TIMEOUT = (5, 10)
+DEFAULT_MAX_RESPONSE_SIZE = 1024 * 1024
+DEFAULT_POOL_SIZE = 20
+CHUNK_SIZE = 64 * 1024
+ACTIVITY_JSON = 'application/activity+json'
+
+_session = None
+_session_pid = None
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class FetchError(requests.RequestException):
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class ResponseTooLarge(FetchError):
+    pass
+
+
+@dataclass
+class RemoteJson:
+    """
+    A fetched response with its body parsed once. data is None if the body was not JSON.
+    """
+    url: str
+    status_code: int
+    headers: Mapping = field(repr=False)
+    data: object = field(repr=False)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise FetchError(f'{self.status_code} response from {self.url}', self.status_code)
+
+    def json(self):
+        if self.data is None:
+            raise FetchError(f'response from {self.url} is not JSON', self.status_code)
+        return self.data
+
+
+def timeout():
+    """
+    Returns (connect, read) timeouts. ACTIVITYPUB_HTTP_TIMEOUT may be a pair or a single number for both.
+    """
+    value = getattr(settings, 'ACTIVITYPUB_HTTP_TIMEOUT', DEFAULT_TIMEOUT)
+    if isinstance(value, (int, float)):
+        return value, value
+    return tuple(value)
+
+
+def max_response_size():
+    return getattr(settings, 'ACTIVITYPUB_HTTP_MAX_RESPONSE_SIZE', DEFAULT_MAX_RESPONSE_SIZE)
+
+
+def session():
+    """
+    The process-wide requests session, so connections to remote servers are pooled and reused.
+    """
+    global _session, _session_pid
+    # pooled connections must not be shared with a forked child
+    if _session is None or _session_pid != os.getpid():
+        pool_size = getattr(settings, 'ACTIVITYPUB_HTTP_POOL_SIZE', DEFAULT_POOL_SIZE)
+        _session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        _session.mount('https://', adapter)
+        _session.mount('http://', adapter)
+        _session_pid = os.getpid()
+    return _session
+
+
+class PinnedAdapter(HTTPAdapter):
+    """
+    Connects to address rather than resolving the request's host again, so a name checked before the request
+    can't be pointed elsewhere in between. The Host header, SNI and certificate checks still use the host name.
+    """
+    def __init__(self, hostname, address, **kwargs):
+        self.hostname = hostname
+        self.address = address
+        super().__init__(**kwargs)
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        host_params, pool_kwargs = self.build_connection_pool_key_attributes(request, verify, cert)
+        host_params['host'] = self.address
+        if host_params['scheme'] == 'https':
+            pool_kwargs.update(server_hostname=self.hostname, assert_hostname=self.hostname)
+        return self.poolmanager.connection_from_host(**host_params, pool_kwargs=pool_kwargs)
+
+    def send(self, request, **kwargs):
+        request.headers['Host'] = urlparse(request.url).netloc
+        return super().send(request, **kwargs)
+
+
+def pinned_session(hostname, address):
+    """
+    A session whose connections all go to address, for a single request to hostname. Proxies from the
+    environment are ignored, since they would resolve the name themselves.
+    """
+    pinned = requests.Session()
+    pinned.trust_env = False
+    adapter = PinnedAdapter(hostname, address)
+    pinned.mount('https://', adapter)
+    pinned.mount('http://', adapter)
+    return pinned
+
+
+def check_length(url, headers, limit=None):
+    length = headers.get('content-length')
+    if length and length.isdigit() and int(length) > (limit or max_response_size()):
+        raise ResponseTooLarge(f'response from {url} is {length} bytes')
+
+
+def request(method, url, http=None, max_size=None, **kwargs):
+    """
+    Make a request with the shared session, or http, and the configured timeout. The body is read up front, and
+    responses larger than max_size (ACTIVITYPUB_HTTP_MAX_RESPONSE_SIZE) raise ResponseTooLarge.
+    """
+    kwargs.setdefault('timeout', timeout())
+    response = (http or session()).request(method, url, stream=True, **kwargs)
+    with response:
+        limit = max_size or max_response_size()
+        check_length(url, response.headers, limit)
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(CHUNK_SIZE):
+            size += len(chunk)
+            if size > limit:
+                raise ResponseTooLarge(f'response from {url} is over {limit} bytes')
+            chunks.append(chunk)
+    response._content = b''.join(chunks)
+    return response
+
+
+def parse(content):
+    try:
+        return loads(content) if content else None
+    except ValueError:
+        return None
+
+
+def get_json(url, kind='object', headers=None, params=None):
+    """
+    GET a JSON document, recording the fetch under kind in the metrics. Transport errors and oversized
+    responses raise FetchError or another requests.RequestException; HTTP errors are left to the caller.
+    """
+    if params:
+        url = f'{url}?{urlencode(params)}'
+    with metrics.remote_fetch(kind) as fetch:
+        response = request('get', url, headers={'Accept': ACTIVITY_JSON, **(headers or {})})
+        fetch['status'] = response.status_code
+    return RemoteJson(url, response.status_code, response.headers, parse(response.content))
+
+
+def async_client():
+    """
+    The httpx client of the running event loop, so connections are pooled across requests.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _async_clients:
+        connect, read = timeout()
+        _async_clients[loop] = httpx.AsyncClient(timeout=httpx.Timeout(read, connect=connect))
+    return _async_clients[loop]
+
+
+async def aget_json(url, kind='object', headers=None, params=None):
+    """
+    Async get_json. Uses httpx when it is installed, otherwise runs get_json in a worker thread.
+    """
+    if httpx is None:
+        return await sync_to_async(get_json, thread_sensitive=False)(url, kind, headers, params)
+
+    if params:
+        url = f'{url}?{urlencode(params)}'
+    limit = max_response_size()
+    try:
+        with metrics.remote_fetch(kind) as fetch:
+            async with async_client().stream('GET', url, headers={'Accept': ACTIVITY_JSON, **(headers or {})}) as response:
+                fetch['status'] = response.status_code
+                check_length(url, response.headers)
+                chunks = []
+                size = 0
+                async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                    size += len(chunk)
+                    if size > limit:
+                        raise ResponseTooLarge(f'response from {url} is over {limit} bytes')
+                    chunks.append(chunk)
+    except httpx.HTTPError as e:
+        raise FetchError(str(e))
+    return RemoteJson(url, response.status_code, response.headers, parse(b''.join(chunks)))
@@ -0,0 +1,274 @@
+import hashlib
+import logging
+import re
+from urllib.parse import urlencode, urlparse
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import Q
+from django.urls import Resolver404, reverse
+
+HEADER = 'collection-synchronization'
+EMPTY_DIGEST = '0' * 64
+# pages of a remote partial followers collection read while reconciling
+MAX_SYNC_PAGES = 10
+# seconds after scheduling a reconcile of a remote actor's follows on a host before another can be scheduled
+DEFAULT_RECONCILE_INTERVAL = 60 * 60
+
+HEADER_PARAM_RE = re.compile(r'([A-Za-z]+)="([^"]*)"')
+
+logger = logging.getLogger(__name__)
+
+
+def collection_sync_enabled():
+    return getattr(settings, 'ACTIVITYPUB_COLLECTION_SYNC', True)
+
+
+def reconcile_interval():
+    return getattr(settings, 'ACTIVITYPUB_COLLECTION_SYNC_INTERVAL', DEFAULT_RECONCILE_INTERVAL)
+
+
+def sync_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_COLLECTION_SYNC_CACHE', 'default')]
+
+
+def reconcile_key(remote_actor_id, host):
+    return f'ap-reconcile:{host}:{remote_actor_id}'
+
+
+def uri_host(uri):
+    return urlparse(uri).netloc.lower()
+
+
+def uri_hash(uri):
+    return int.from_bytes(hashlib.sha256(uri.encode('utf-8')).digest(), 'big')
+
+
+def followers_digest(uris):
+    """
+    The FEP-8fcf digest of a set of URIs: the XOR of their SHA-256 hashes, as hex.
+    """
+    value = 0
+    for uri in uris:
+        value ^= uri_hash(uri)
+    return f'{value:064x}'
+
+
+def toggle(digest, uri):
+    """
+    Add uri to digest, or remove it if it is already part of it.
+    """
+    return f'{int(digest, 16) ^ uri_hash(uri):064x}'
+
+
+def header_value(collection_id, url, digest):
+    return f'collectionId="{collection_id}", url="{url}", digest="{digest}"'
+
+
+def parse_header(value):
+    return dict(HEADER_PARAM_RE.findall(value))
+
+
+def host_followers(actor, host):
+    """
+    URIs of actor's followers on host.
+    """
+    from django_activitypub.models import Follower
+
+    uris = Follower.objects.filter(following=actor).filter(
+        Q(remote_actor__url__istartswith=f'https://{host}/') | Q(remote_actor__url__istartswith=f'http://{host}/')
+    ).values_list('remote_actor__url', flat=True)
+    return [uri for uri in uris if uri_host(uri) == host]
+
+
+def build_digest(actor, host):
+    """
+    Compute the digest of actor's followers on host from scratch and store it.
+    """
+    from django_activitypub.models import FollowerDigest
+
+    uris = host_followers(actor, host)
+    digest, _ = FollowerDigest.objects.update_or_create(
+        local_actor=actor, host=host, defaults={'digest': followers_digest(uris), 'count': len(uris)},
+    )
+    return digest
+
+
+def follower_changed(follower, added):
+    """
+    Fold a follower that was added or removed into the digest of its host. Digests that haven't been built yet
+    are built on the first follow rather than updated.
+    """
+    from django_activitypub.models import FollowerDigest
+
+    uri = follower.remote_actor.url
+    host = uri_host(uri)
+    with transaction.atomic():
+        digest = FollowerDigest.objects.select_for_update().filter(local_actor_id=follower.following_id, host=host).first()
+        if digest is None:
+            if added:
+                build_digest(follower.following, host)
+            return
+        digest.digest = toggle(digest.digest, uri)
+        digest.count = digest.count + 1 if added else max(digest.count - 1, 0)
+        digest.save(update_fields=['digest', 'count'])
+
+
+def rebuild_digests(local_actor=None, progress=None):
+    """
+    Recompute every follower digest, or only local_actor's. Returns the number of digests stored.
+    """
+    from django_activitypub.models import Follower, FollowerDigest, LocalActor
+
+    actors = LocalActor.objects.all() if local_actor is None else LocalActor.objects.filter(id=local_actor.id)
+    total = actors.count()
+    stored = 0
+    for done, actor in enumerate(actors.order_by('id'), 1):
+        hosts = {
+            uri_host(uri) for uri in
+            Follower.objects.filter(following=actor).values_list('remote_actor__url', flat=True)
+        }
+        FollowerDigest.objects.filter(local_actor=actor).exclude(host__in=hosts).delete()
+        for host in sorted(hosts):
+            build_digest(actor, host)
+            stored += 1
+        if progress:
+            progress(done, total)
+    return stored
+
+
+def synchronization_header(actor, host):
+    """
+    The Collection-Synchronization header for deliveries of actor's activities to host, or {} if actor has no
+    followers there.
+    """
+    from django_activitypub.models import FollowerDigest
+
+    if not collection_sync_enabled():
+        return {}
+    digest = FollowerDigest.objects.filter(local_actor=actor, host=host).values_list('digest', 'count').first()
+    if digest is None:
+        # not stored yet, e.g. followers from before digests were kept; deliveries only read, so compute it here
+        uris = host_followers(actor, host)
+        digest = followers_digest(uris), len(uris)
+    digest, count = digest
+    if not count:
+        return {}
+
+    base_url = f'https://{actor.domain}'
+    collection_id = base_url + reverse('activitypub-followers', kwargs={'username': actor.preferred_username})
+    url = base_url + reverse('activitypub-followers-sync', kwargs={'username': actor.preferred_username})
+    url += '?' + urlencode({'host': host})
+    return {HEADER: header_value(collection_id, url, digest)}
+
+
+class SynchronizationHeaders:
+    """
+    Collection-Synchronization headers for a run of deliveries, computed once per actor and destination host.
+    """
+    def __init__(self):
+        self.headers = {}
+
+    def get(self, actor, inbox):
+        key = (actor.id, uri_host(inbox))
+        if key not in self.headers:
+            self.headers[key] = synchronization_header(actor, key[1])
+        return self.headers[key]
+
+
+def following_uris(remote_actor, host):
+    """
+    URIs of the local actors on host that follow remote_actor, mapped to the Following rows.
+    """
+    from django_activitypub.models import Following
+
+    rows = Following.objects.filter(remote_actor=remote_actor, following__domain=host).select_related('following')
+    return {row.following.get_absolute_url(): row for row in rows}
+
+
+def check_synchronization(actor_url, value, host):
+    """
+    Compare the Collection-Synchronization header sent by actor_url with who on host follows them here, and
+    reconcile in the background when the two have drifted apart. Returns True if they had. A remote actor's
+    follows on host are reconciled at most once per reconcile_interval(), however many of its deliveries disagree.
+    """
+    from django_activitypub.models import RemoteActor
+    from django_activitypub.tasks import run_in_background
+
+    params = parse_header(value)
+    collection_id, url, digest = params.get('collectionId'), params.get('url'), params.get('digest')
+    if not (collection_id and url and digest):
+        return False
+    # the collection must be the sender's followers, served from the sender's server
+    if not uri_host(collection_id) == uri_host(url) == uri_host(actor_url):
+        return False
+    remote_actor = RemoteActor.objects.filter(url=actor_url).defer(None).first()
+    if remote_actor is None or remote_actor.profile.get('followers') != collection_id:
+        return False
+
+    if followers_digest(following_uris(remote_actor, host)) == digest.lower():
+        return False
+    logger.info('followers of %s on %s are out of sync', actor_url, host)
+    if not sync_cache().add(reconcile_key(remote_actor.id, host), True, reconcile_interval()):
+        return True
+    run_in_background(reconcile_following, remote_actor.id, url, host)
+    return True
+
+
+def partial_collection_items(actor, url):
+    """
+    The items of the partial followers collection at url, following its pages. Returns (items, complete), with
+    complete False when the walk stopped at MAX_SYNC_PAGES before the last page.
+    """
+    from django_activitypub.signed_requests import actor_signed_post
+
+    items = []
+    for _ in range(MAX_SYNC_PAGES):
+        response = actor_signed_post(actor, url, method='get')
+        response.raise_for_status()
+        page = response.json()
+        items.extend(page.get('orderedItems') or page.get('items') or [])
+        url = page.get('first') or page.get('next')
+        if isinstance(url, dict):
+            items.extend(url.get('orderedItems') or url.get('items') or [])
+            url = url.get('next')
+        if not url:
+            break
+    return {item if isinstance(item, str) else item.get('id') for item in items}, not url
+
+
+def reconcile_following(remote_actor_id, url, host):
+    """
+    Make the local follows of a remote actor agree with its partial followers collection at url: follows it no
+    longer knows about are dropped, and local actors it lists that don't follow it here send an Undo. Nothing is
+    dropped when the collection was too long to read to the end.
+    """
+    from django_activitypub.models import LocalActor, RemoteActor, send_unfollow
+
+    remote_actor = RemoteActor.objects.get(id=remote_actor_id)
+    local = following_uris(remote_actor, host)
+    signer = next(iter(local.values())).following if local else LocalActor.objects.filter(domain=host).first()
+    if signer is None:
+        return
+
+    remote, complete = partial_collection_items(signer, url)
+    if not complete:
+        logger.warning(
+            'followers of %s at %s run past %d pages, keeping follows it does not list', remote_actor, url, MAX_SYNC_PAGES,
+        )
+    for uri, row in local.items():
+        if complete and uri not in remote:
+            logger.info('%s no longer has %s as a follower', remote_actor, uri)
+            row.delete()
+    for uri in remote - set(local):
+        if uri_host(uri) != host:
+            continue
+        try:
+            local_actor = LocalActor.objects.get_by_url(uri)
+        except (LocalActor.DoesNotExist, Resolver404):
+            continue
+        if local_actor is None:
+            continue
+        logger.info('%s lists %s as a follower, undoing the follow', remote_actor, uri)
+        send_unfollow(local_actor, remote_actor)
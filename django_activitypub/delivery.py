@@ -0,0 +1,289 @@
+import logging
+import os
+import socket
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Count, Min, Q, Value
+from django.db.models.functions import Coalesce, NullIf
+from django.utils import timezone
+
+from django_activitypub.collection_sync import SynchronizationHeaders
+from django_activitypub.models import Delivery, DeliveryPriority, DeliveryWorker, Follower, RemoteActor
+from django_activitypub.signed_requests import actor_signed_post
+from django_activitypub.tasks import run_in_background
+from django_activitypub.utils.hashring import HashRing
+
+DELIVERY_BATCH_SIZE = 100
+MAX_ATTEMPTS = 5
+# seconds without a heartbeat before a worker's hosts are handed to the others
+WORKER_TIMEOUT = 30
+# seconds a claimed delivery is reserved for its worker; claims of a crashed worker expire after this
+CLAIM_LEASE = 5 * 60
+# deliveries per host per round, so one busy host can't hold up the rest
+PER_HOST_BATCH = 10
+HOSTS_PER_ROUND = 50
+DEFAULT_CONCURRENCY = 8
+# seconds before the first retry, doubled for each further attempt
+RETRY_BACKOFF = 30
+# claimed_by of deliveries sent straight from the process that queued them
+BACKGROUND_CLAIM = 'background'
+
+logger = logging.getLogger(__name__)
+
+
+def fanout_plan(actor):
+    """
+    Returns [(inbox, followers)] for delivering to all of actor's followers, using the shared inbox of a
+    follower's server when it advertises one, with a single aggregate query.
+    """
+    RemoteActor.objects.sync_missing_inboxes(actor.followers.all())
+    target = Coalesce(
+        NullIf('remote_actor__shared_inbox_url', Value('')), NullIf('remote_actor__inbox_url', Value('')),
+    )
+    return list(
+        Follower.objects.filter(following=actor)
+        .annotate(target=target).filter(target__isnull=False)
+        .values('target').annotate(followers=Count('id'))
+        .order_by('target').values_list('target', 'followers')
+    )
+
+
+def follower_inboxes(actor):
+    """
+    Returns the distinct inboxes to deliver to for all of actor's followers.
+    """
+    return [inbox for inbox, _ in fanout_plan(actor)]
+
+
+def enqueue(actor, body, inboxes, batch_size=DELIVERY_BATCH_SIZE, priority=DeliveryPriority.ACTIVITY):
+    return Delivery.objects.bulk_create(
+        [
+            Delivery(local_actor=actor, inbox=inbox, host=urlparse(inbox).netloc.lower(), body=body, priority=priority)
+            for inbox in inboxes
+        ],
+        batch_size=batch_size,
+    )
+
+
+def delivery_workers():
+    return getattr(settings, 'ACTIVITYPUB_DELIVERY_WORKERS', False)
+
+
+def queue_delivery(actor, body, inboxes, priority=DeliveryPriority.ACTIVITY):
+    """
+    Queue body for inboxes in priority's lane. Without delivery workers (ACTIVITYPUB_DELIVERY_WORKERS) the new
+    deliveries are sent in the background once the transaction commits; with them they are left to the workers.
+    """
+    deliveries = enqueue(actor, body, inboxes, priority=priority)
+    if deliveries and not delivery_workers():
+        run_in_background(send_queued, [delivery.id for delivery in deliveries])
+    return deliveries
+
+
+def pending():
+    return Delivery.objects.filter(delivered_at__isnull=True, failed=False)
+
+
+def available(now=None):
+    """
+    Pending deliveries that no worker has claimed and that aren't backing off.
+    """
+    now = now or timezone.now()
+    return pending().filter(Q(available_at__isnull=True) | Q(available_at__lte=now))
+
+
+def deliver(delivery, sync_headers=None):
+    """
+    Attempt a single delivery, recording the outcome on the instance without saving it.
+    """
+    actor = delivery.local_actor
+    headers = (sync_headers or SynchronizationHeaders()).get(actor, delivery.inbox)
+    delivery.attempts += 1
+    try:
+        resp = actor_signed_post(actor, delivery.inbox, body=delivery.body, headers=headers)
+        resp.raise_for_status()
+        delivery.delivered_at = timezone.now()
+        delivery.last_error = ''
+    except requests.HTTPError as e:
+        delivery.last_error = str(e)
+        # the inbox is gone or refuses the activity; retrying will not help
+        if e.response.status_code in (400, 401, 403, 404, 410):
+            delivery.failed = True
+    except requests.RequestException as e:
+        delivery.last_error = str(e)
+    if not delivery.delivered_at and delivery.attempts >= MAX_ATTEMPTS:
+        delivery.failed = True
+    if delivery.last_error:
+        logger.warning(
+            'delivery %s to %s failed: %s', delivery.id, delivery.inbox, delivery.last_error,
+            extra={'attempts': delivery.attempts, 'failed': delivery.failed},
+        )
+    return delivery
+
+
+def deliver_pending(batch_size=DELIVERY_BATCH_SIZE, progress=None, name=None):
+    """
+    Deliver queued activities in batches of batch_size, most urgent lane first. Each batch is claimed like a
+    worker claims its hosts, so deliveries sent elsewhere meanwhile are skipped, and released with one bulk update
+    that backs off the ones to retry. Each delivery is attempted at most once per call. Returns (delivered, failed).
+    """
+    name = name or f'deliver-{default_worker_name()}'
+    ids = list(available().order_by('priority', 'id').values_list('id', flat=True))
+    total = len(ids)
+    delivered = failed = done = 0
+    sync_headers = SynchronizationHeaders()
+    for start in range(0, total, batch_size):
+        chunk = ids[start:start + batch_size]
+        batch = list(claim_ids(chunk, name, timezone.now()).select_related('local_actor').order_by('priority', 'id'))
+        for delivery in batch:
+            deliver(delivery, sync_headers)
+            if delivery.delivered_at:
+                delivered += 1
+            elif delivery.failed:
+                failed += 1
+        release(batch, timezone.now())
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+    return delivered, failed
+
+
+def retry_at(delivery, now):
+    return now + timedelta(seconds=RETRY_BACKOFF * 2 ** max(delivery.attempts - 1, 0))
+
+
+def claim_ids(ids, name, now):
+    """
+    Reserve the deliveries in ids that are still available for name. The update only matches available rows, so
+    no two claimants ever get the same delivery.
+    """
+    until = now + timedelta(seconds=CLAIM_LEASE)
+    available(now).filter(id__in=ids).update(claimed_by=name, available_at=until)
+    return Delivery.objects.filter(claimed_by=name, available_at=until, id__in=ids)
+
+
+def release(attempted, now):
+    """
+    Save the outcome of claimed deliveries and release them, backing off the ones to retry.
+    """
+    for delivery in attempted:
+        delivery.claimed_by = ''
+        delivery.available_at = None
+        if not delivery.delivered_at and not delivery.failed:
+            delivery.available_at = retry_at(delivery, now)
+    Delivery.objects.bulk_update(
+        attempted, ['attempts', 'last_error', 'delivered_at', 'failed', 'claimed_by', 'available_at'],
+    )
+
+
+def send_queued(ids):
+    """
+    Attempt the queued deliveries in ids once, most urgent lane first. Those that fail back off and are retried by
+    activitypub_deliver or the delivery workers. Returns the number attempted.
+    """
+    deliveries = list(
+        claim_ids(ids, BACKGROUND_CLAIM, timezone.now()).select_related('local_actor').order_by('priority', 'id')
+    )
+    sync_headers = SynchronizationHeaders()
+    for delivery in deliveries:
+        deliver(delivery, sync_headers)
+    release(deliveries, timezone.now())
+    return len(deliveries)
+
+
+def default_worker_name():
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class ShardWorker:
+    """
+    Delivers the queued activities of the destination hosts that hash to this worker. Workers find each other
+    through heartbeats in the DeliveryWorker table, so starting or stopping one only moves its share of hosts, and
+    each host is only sent one request at a time.
+    """
+    def __init__(self, name=None, concurrency=None, per_host=PER_HOST_BATCH, hosts_per_round=HOSTS_PER_ROUND):
+        self.name = name or default_worker_name()
+        self.concurrency = concurrency or getattr(settings, 'ACTIVITYPUB_DELIVERY_CONCURRENCY', DEFAULT_CONCURRENCY)
+        self.per_host = per_host
+        self.hosts_per_round = hosts_per_round
+
+    def heartbeat(self, now):
+        DeliveryWorker.objects.update_or_create(name=self.name, defaults={'heartbeat_at': now})
+
+    def ring(self, now):
+        cutoff = now - timedelta(seconds=getattr(settings, 'ACTIVITYPUB_DELIVERY_WORKER_TIMEOUT', WORKER_TIMEOUT))
+        return HashRing(DeliveryWorker.objects.filter(heartbeat_at__gte=cutoff).values_list('name', flat=True))
+
+    def schedule(self, ring, now):
+        """
+        Returns the hosts owned by this worker with work in the most urgent lane, oldest first, and that lane.
+        """
+        queued = available(now).values('host', 'priority').annotate(oldest=Min('id'))
+        owned = [row for row in queued if ring.owner(row['host']) == self.name]
+        if not owned:
+            return [], None
+        lane = min(row['priority'] for row in owned)
+        hosts = [row['host'] for row in sorted(owned, key=lambda row: row['oldest']) if row['priority'] == lane]
+        return hosts[:self.hosts_per_round], lane
+
+    def claim(self, hosts, lane, now):
+        """
+        Reserve up to per_host deliveries of each host. The update only matches rows that are still available,
+        so two workers with different views of the ring never claim the same delivery.
+        """
+        claimed = []
+        for host in hosts:
+            ids = list(
+                available(now).filter(host=host, priority=lane).order_by('id').values_list('id', flat=True)[:self.per_host]
+            )
+            claimed.extend(claim_ids(ids, self.name, now).select_related('local_actor').order_by('id'))
+        return claimed
+
+    def deliver_host(self, deliveries):
+        close_old_connections()
+        sync_headers = SynchronizationHeaders()
+        for delivery in deliveries:
+            deliver(delivery, sync_headers)
+        return deliveries
+
+    def run_once(self):
+        """
+        One scheduling round. Returns the number of deliveries attempted.
+        """
+        now = timezone.now()
+        self.heartbeat(now)
+        hosts, lane = self.schedule(self.ring(now), now)
+        if not hosts:
+            return 0
+
+        by_host = defaultdict(list)
+        for delivery in self.claim(hosts, lane, now):
+            by_host[delivery.host].append(delivery)
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='activitypub-delivery') as executor:
+            batches = list(executor.map(self.deliver_host, by_host.values()))
+
+        attempted = [delivery for batch in batches for delivery in batch]
+        release(attempted, timezone.now())
+        return len(attempted)
+
+    def stop(self):
+        """
+        Leave the ring and hand back unsent claims, so the other workers take over at once.
+        """
+        DeliveryWorker.objects.filter(name=self.name).delete()
+        Delivery.objects.filter(claimed_by=self.name, delivered_at__isnull=True).update(claimed_by='', available_at=None)
+
+    def run(self, poll_interval=1.0, should_stop=lambda: False):
+        try:
+            while not should_stop():
+                if not self.run_once():
+                    time.sleep(poll_interval)
+        finally:
+            self.stop()
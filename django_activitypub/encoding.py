@@ -0,0 +1,85 @@
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import HttpResponse
+
+from django_activitypub import metrics, profiling
+from django_activitypub.utils.lru import LRUCache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+ENCODED_CACHE_SIZE = 1024
+
+_django_encoder = DjangoJSONEncoder()
+
+
+def use_orjson():
+    backend = getattr(settings, 'ACTIVITYPUB_JSON_BACKEND', None)
+    if backend is None:
+        return orjson is not None
+    return backend == 'orjson'
+
+
+def dumps(data):
+    """
+    Encode data as compact UTF-8 JSON bytes, with orjson when it is installed and the standard library otherwise.
+    """
+    if use_orjson():
+        return orjson.dumps(data, default=_django_encoder.default)
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def loads(data):
+    if use_orjson():
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps_with_items(data, key, items):
+    """
+    Encode data with key set to a JSON array of already encoded items, without decoding them again.
+    """
+    encoded = dumps(data)
+    separator = b',' if len(encoded) > 2 else b''
+    return encoded[:-1] + separator + dumps(key) + b':[' + b','.join(items) + b']}'
+
+
+class EncodedCache(LRUCache):
+    """
+    Bounded LRU of encoded payloads. Keys must change whenever the payload would, which makes the cached
+    bytes safe to reuse.
+    """
+    def __init__(self, maxsize=ENCODED_CACHE_SIZE):
+        super().__init__(maxsize)
+
+    def get_or_encode(self, key, build):
+        encoded = self.get(key)
+        metrics.cache_lookup('encoded', encoded is not None)
+        if encoded is None:
+            encoded = dumps(build())
+            self.set(key, encoded)
+        return encoded
+
+
+encoded_cache = EncodedCache()
+
+
+def cached_dumps(key, build):
+    return encoded_cache.get_or_encode(key, build)
+
+
+class ActivityJsonResponse(HttpResponse):
+    """
+    A JsonResponse that encodes through dumps(), and also accepts an already encoded payload.
+    """
+    def __init__(self, data, safe=True, **kwargs):
+        if safe and not isinstance(data, (dict, bytes)):
+            raise TypeError('In order to allow non-dict objects to be serialized set the safe parameter to False.')
+        kwargs.setdefault('content_type', 'application/json')
+        with profiling.serializing():
+            content = data if isinstance(data, bytes) else dumps(data)
+        super().__init__(content=content, **kwargs)
@@ -0,0 +1,121 @@
+import re
+from html import unescape
+
+from django.conf import settings
+from django.db.models import Count
+from django.urls import reverse
+from django.utils.html import strip_tags
+
+# a # that doesn't follow a word character or start an HTML entity such as &#39;
+HASHTAG_RE = re.compile(r'(?<![&\w])#(\w+)')
+MAX_HASHTAG_LENGTH = 255
+FEATURED_TAGS = 10
+REINDEX_BATCH_SIZE = 500
+
+
+def featured_tags_limit():
+    return getattr(settings, 'ACTIVITYPUB_FEATURED_TAGS', FEATURED_TAGS)
+
+
+def hashtag_key(name):
+    return name.lower()
+
+
+def is_hashtag(name):
+    # like Mastodon, #1 is a number rather than a tag
+    return len(name) <= MAX_HASHTAG_LENGTH and not name.isdigit()
+
+
+def extract_hashtags(content, html=False):
+    """
+    The hashtags in content without their #, in order of first use and once however they are capitalised. html
+    content, as remote notes carry, is reduced to its text first.
+    """
+    if html:
+        content = unescape(strip_tags(content))
+    found = {}
+    for match in HASHTAG_RE.finditer(content or ''):
+        name = match.group(1)
+        if is_hashtag(name):
+            found.setdefault(hashtag_key(name), name)
+    return list(found.values())
+
+
+def tag_url(base_url, name):
+    return base_url + reverse('activitypub-tag', kwargs={'tag': hashtag_key(name)})
+
+
+def link_hashtags(content, base_url):
+    """
+    Replace the hashtags in escaped plain text with links to their tag timelines.
+    """
+    def link(match):
+        name = match.group(1)
+        if not is_hashtag(name):
+            return match.group(0)
+        return f'<a href="{tag_url(base_url, name)}" class="mention hashtag status-link" rel="tag">#{name}</a>'
+
+    return HASHTAG_RE.sub(link, content)
+
+
+def hashtag_object(name, base_url):
+    return {'type': 'Hashtag', 'href': tag_url(base_url, name), 'name': f'#{name}'}
+
+
+def index_note(note):
+    """
+    Bring note's rows in the hashtag index in line with its content. Tombstoned notes are taken out of it.
+    """
+    from django_activitypub.models import Hashtag, NoteHashtag
+
+    names = set() if note.tombstone else {
+        hashtag_key(name) for name in extract_hashtags(note.content, html=note.remote_actor_id is not None)
+    }
+    rows = NoteHashtag.objects.filter(note=note)
+    current = dict(rows.values_list('hashtag__name', 'published_at'))
+    if stale := set(current) - names:
+        rows.filter(hashtag__name__in=stale).delete()
+    if any(published_at != note.published_at for name, published_at in current.items() if name in names):
+        rows.update(published_at=note.published_at)
+    if added := names - set(current):
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in added], ignore_conflicts=True)
+        NoteHashtag.objects.bulk_create([
+            NoteHashtag(note=note, hashtag_id=hashtag_id, published_at=note.published_at)
+            for hashtag_id in Hashtag.objects.filter(name__in=added).values_list('id', flat=True)
+        ], ignore_conflicts=True)
+
+
+def reindex_hashtags(batch_size=REINDEX_BATCH_SIZE, progress=None):
+    """
+    Index the hashtags of every note, e.g. those saved before the index existed. Returns the number of notes.
+    """
+    from django_activitypub.models import Note
+
+    notes = Note.objects.only('id', 'content', 'published_at', 'tombstone', 'remote_actor_id')
+    total = notes.count()
+    last_id = 0
+    done = 0
+    while True:
+        batch = list(notes.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            break
+        for note in batch:
+            index_note(note)
+        last_id = batch[-1].id
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    return done
+
+
+def featured_tags(actor, limit=None):
+    """
+    The names of the hashtags actor uses most, for featuredTags.
+    """
+    from django_activitypub.models import Hashtag
+
+    limit = featured_tags_limit() if limit is None else limit
+    return Hashtag.objects.filter(note_hashtags__note__local_actor=actor) \
+        .annotate(uses=Count('note_hashtags')) \
+        .order_by('-uses', 'name') \
+        .values_list('name', flat=True)[:limit]
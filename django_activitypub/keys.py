@@ -0,0 +1,74 @@
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+RSA = 'rsa'
+ED25519 = 'ed25519'
+
+# multicodec prefix for Ed25519 public keys, see FEP-521a
+ED25519_MULTICODEC = b'\xed\x01'
+BASE58_ALPHABET = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+
+
+def generate_key_pair(algorithm=RSA):
+    """
+    Returns (private_key, public_key) as PEM strings.
+    """
+    if algorithm == RSA:
+        private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+        private_format = serialization.PrivateFormat.TraditionalOpenSSL
+    elif algorithm == ED25519:
+        private_key = ed25519.Ed25519PrivateKey.generate()
+        private_format = serialization.PrivateFormat.PKCS8
+    else:
+        raise ValueError(f'unsupported key algorithm: {algorithm}')
+
+    private_pem = private_key.private_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=private_format,
+        encryption_algorithm=serialization.NoEncryption(),
+    ).decode('utf-8')
+    public_pem = private_key.public_key().public_bytes(
+        encoding=serialization.Encoding.PEM,
+        format=serialization.PublicFormat.SubjectPublicKeyInfo
+    ).decode('utf-8')
+    return private_pem, public_pem
+
+
+def base58btc(data):
+    number = int.from_bytes(data, 'big')
+    encoded = ''
+    while number:
+        number, remainder = divmod(number, 58)
+        encoded = BASE58_ALPHABET[remainder] + encoded
+    leading_zeros = len(data) - len(data.lstrip(b'\0'))
+    return BASE58_ALPHABET[0] * leading_zeros + encoded
+
+
+def ed25519_multibase(public_pem):
+    public_key = serialization.load_pem_public_key(public_pem.encode('utf-8'))
+    raw = public_key.public_bytes(encoding=serialization.Encoding.Raw, format=serialization.PublicFormat.Raw)
+    return 'z' + base58btc(ED25519_MULTICODEC + raw)
+
+
+def base58btc_decode(encoded):
+    number = 0
+    for char in encoded:
+        index = BASE58_ALPHABET.find(char)
+        if index < 0:
+            raise ValueError(f'invalid base58 character: {char!r}')
+        number = number * 58 + index
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    leading_zeros = len(encoded) - len(encoded.lstrip(BASE58_ALPHABET[0]))
+    return b'\0' * leading_zeros + data
+
+
+def load_ed25519_multibase(multibase):
+    """
+    The inverse of ed25519_multibase, returning an Ed25519PublicKey. Raises ValueError for other keys.
+    """
+    if not multibase.startswith('z'):
+        raise ValueError('only base58btc multibase keys are supported')
+    data = base58btc_decode(multibase[1:])
+    if not data.startswith(ED25519_MULTICODEC):
+        raise ValueError('not an Ed25519 multikey')
+    return ed25519.Ed25519PublicKey.from_public_bytes(data[len(ED25519_MULTICODEC):])
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.models import Backfill, BACKFILL_CHUNK_SIZE, run_backfill
+
+
+class Command(BaseCommand):
+    help = 'Resume unfinished note backfills to new followers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=BACKFILL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for backfill_id in Backfill.objects.filter(finished_at__isnull=True).values_list('id', flat=True):
+            backfill = run_backfill(backfill_id, chunk_size=options['chunk_size'], sleep=True)
+            status = 'finished' if backfill.finished_at else 'paused'
+            self.stdout.write(f'{backfill} - {status}')
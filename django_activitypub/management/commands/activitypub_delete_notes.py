@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_activitypub.delivery import deliver_pending
+from django_activitypub.models import LocalActor, tombstone_notes
+
+
+class Command(BaseCommand):
+    help = 'Tombstone local notes and send a Delete for each of them to followers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--actor', help='only delete the notes of the local actor with this username')
+        parser.add_argument('--no-deliver', action='store_true', help='queue the Delete activities without sending them')
+
+    def handle(self, *args, **options):
+        local_actor = None
+        if options['actor']:
+            try:
+                local_actor = LocalActor.objects.get(preferred_username=options['actor'])
+            except LocalActor.DoesNotExist:
+                raise CommandError(f'no local actor named {options["actor"]}')
+
+        count = tombstone_notes(
+            local_actor=local_actor,
+            progress=lambda done, total: self.stdout.write(f'queued {done}/{total}'),
+        )
+        self.stdout.write(f'{count} notes tombstoned')
+
+        if count and not options['no_deliver']:
+            delivered, failed = deliver_pending(
+                progress=lambda done, total: self.stdout.write(f'delivered {done}/{total}'),
+            )
+            self.stdout.write(f'{delivered} delivered, {failed} failed')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.delivery import DELIVERY_BATCH_SIZE, deliver_pending
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued activities to remote inboxes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=DELIVERY_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        delivered, failed = deliver_pending(
+            batch_size=options['batch_size'],
+            progress=lambda done, total: self.stdout.write(f'delivered {done}/{total}'),
+        )
+        self.stdout.write(f'{delivered} delivered, {failed} failed')
@@ -0,0 +1,34 @@
+import signal
+
+from django.core.management.base import BaseCommand
+
+from django_activitypub.delivery import PER_HOST_BATCH, ShardWorker
+
+
+class Command(BaseCommand):
+    help = 'Run a delivery worker; start one per node, and the destination hosts are shared between them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--name', help='unique worker name (default: hostname and pid)')
+        parser.add_argument('--concurrency', type=int, help='hosts delivered to at the same time')
+        parser.add_argument('--per-host', type=int, default=PER_HOST_BATCH, help='deliveries per host per round')
+        parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds to wait when there is no work')
+        parser.add_argument('--once', action='store_true', help='run a single round and exit')
+
+    def handle(self, *args, **options):
+        worker = ShardWorker(name=options['name'], concurrency=options['concurrency'], per_host=options['per_host'])
+        if options['once']:
+            try:
+                self.stdout.write(f'{worker.name}: attempted {worker.run_once()} deliveries')
+            finally:
+                worker.stop()
+            return
+
+        stopping = []
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+        self.stdout.write(f'{worker.name}: started')
+        try:
+            worker.run(poll_interval=options['poll_interval'], should_stop=lambda: bool(stopping))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{worker.name}: stopped')
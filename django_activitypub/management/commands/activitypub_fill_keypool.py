@@ -0,0 +1,20 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_activitypub import keys
+from django_activitypub.models import KeyPool
+
+
+class Command(BaseCommand):
+    help = 'Pre-generate key pairs for new local actors'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--size', type=int, default=getattr(settings, 'ACTIVITYPUB_KEY_POOL_SIZE', 0) or 20,
+            help='number of keys the pool should hold',
+        )
+        parser.add_argument('--algorithm', choices=[keys.RSA, keys.ED25519], default=keys.RSA)
+
+    def handle(self, *args, **options):
+        generated = KeyPool.objects.fill(options['size'], options['algorithm'])
+        self.stdout.write(f'generated {generated} {options["algorithm"]} keys')
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_activitypub.collection_sync import rebuild_digests
+from django_activitypub.models import LocalActor
+
+
+class Command(BaseCommand):
+    help = 'Recompute the per-host follower digests sent in Collection-Synchronization headers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--actor', help='only rebuild the digests of the local actor with this username')
+
+    def handle(self, *args, **options):
+        local_actor = None
+        if options['actor']:
+            try:
+                local_actor = LocalActor.objects.get(preferred_username=options['actor'])
+            except LocalActor.DoesNotExist:
+                raise CommandError(f'no local actor named {options["actor"]}')
+
+        count = rebuild_digests(
+            local_actor=local_actor,
+            progress=lambda done, total: self.stdout.write(f'rebuilt {done}/{total} actors'),
+        )
+        self.stdout.write(f'{count} digests stored')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.hashtags import REINDEX_BATCH_SIZE, reindex_hashtags
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the hashtag index tag timelines and featuredTags are served from'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=REINDEX_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        count = reindex_hashtags(
+            batch_size=options['batch_size'],
+            progress=lambda done, total: self.stdout.write(f'indexed {done}/{total} notes'),
+        )
+        self.stdout.write(f'{count} notes indexed')
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.nodeinfo import update_usage
+
+
+class Command(BaseCommand):
+    help = 'Recompute the usage statistics served by nodeinfo, run periodically (e.g. hourly from cron)'
+
+    def handle(self, *args, **options):
+        usage = update_usage()
+        users = usage['users']
+        self.stdout.write(
+            f'{users["total"]} users ({users["activeMonth"]} active this month, {users["activeHalfyear"]} this '
+            f'half year), {usage["localPosts"]} posts, {usage["localComments"]} comments'
+        )
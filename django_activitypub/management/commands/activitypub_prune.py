@@ -0,0 +1,87 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from django_activitypub.retention import (
+    RETENTION_BATCH_SIZE, actor_retention_days, inbox_item_retention_days, note_retention_days, object_retention_days,
+    prune_inbox_items, prune_remote_actors, prune_remote_notes, prune_remote_objects,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Delete old remote-only reply threads, remote actors nothing refers to any more, cached remote objects and '
+        'processed inbox items'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes-days', type=int, help='remove remote threads with no activity for this many days')
+        parser.add_argument('--actors-days', type=int, help='remove unreferenced remote actors unseen for this many days')
+        parser.add_argument('--objects-days', type=int, help='remove cached remote objects fetched this many days ago')
+        parser.add_argument(
+            '--replies-to-local', action='store_true', default=None,
+            help='also remove old remote replies to local notes, as ACTIVITYPUB_PRUNE_REPLIES_TO_LOCAL does',
+        )
+        parser.add_argument('--skip-notes', action='store_true')
+        parser.add_argument('--skip-actors', action='store_true')
+        parser.add_argument('--inbox-days', type=int, help='remove queued inbox items processed this many days ago')
+        parser.add_argument('--skip-objects', action='store_true')
+        parser.add_argument('--skip-inbox', action='store_true')
+        parser.add_argument('--batch-size', type=int, default=RETENTION_BATCH_SIZE)
+        parser.add_argument('--archive', help='append pruned notes to this file as JSON lines before deleting them')
+        parser.add_argument('--dry-run', action='store_true', help='only count what would be removed')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        verb = 'would remove' if dry_run else 'removed'
+
+        notes_days = note_retention_days() if options['notes_days'] is None else options['notes_days']
+        if not options['skip_notes'] and notes_days is not None:
+            archive = None
+            if options['archive'] and not dry_run:
+                try:
+                    archive = open(options['archive'], 'ab')
+                except OSError as e:
+                    raise CommandError(f'cannot open {options["archive"]}: {e}')
+            try:
+                subtrees, notes = prune_remote_notes(
+                    days=notes_days,
+                    batch_size=options['batch_size'],
+                    dry_run=dry_run,
+                    archive=archive,
+                    replies_to_local=options['replies_to_local'],
+                    progress=lambda done, total: self.stdout.write(f'checked {done}/{total} threads'),
+                )
+            finally:
+                if archive is not None:
+                    archive.close()
+            self.stdout.write(f'{verb} {notes} notes in {subtrees} threads older than {notes_days} days')
+
+        # after the notes, so authors of pruned threads can go in the same run
+        actors_days = actor_retention_days() if options['actors_days'] is None else options['actors_days']
+        if not options['skip_actors'] and actors_days is not None:
+            actors = prune_remote_actors(
+                days=actors_days,
+                batch_size=options['batch_size'],
+                dry_run=dry_run,
+                progress=lambda done, total: self.stdout.write(f'checked {done}/{total} remote actors'),
+            )
+            self.stdout.write(f'{verb} {actors} remote actors unseen for {actors_days} days')
+
+        objects_days = object_retention_days() if options['objects_days'] is None else options['objects_days']
+        if not options['skip_objects'] and objects_days is not None:
+            objects = prune_remote_objects(
+                days=objects_days,
+                batch_size=options['batch_size'],
+                dry_run=dry_run,
+                progress=lambda done, total: self.stdout.write(f'checked {done}/{total} remote objects'),
+            )
+            self.stdout.write(f'{verb} {objects} remote objects fetched over {objects_days} days ago')
+
+        inbox_days = inbox_item_retention_days() if options['inbox_days'] is None else options['inbox_days']
+        if not options['skip_inbox'] and inbox_days is not None:
+            items = prune_inbox_items(
+                days=inbox_days,
+                batch_size=options['batch_size'],
+                dry_run=dry_run,
+                progress=lambda done, total: self.stdout.write(f'checked {done}/{total} inbox items'),
+            )
+            self.stdout.write(f'{verb} {items} inbox items processed over {inbox_days} days ago')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.models import BACKFILL_CHUNK_SIZE, RemoteActor
+
+
+class Command(BaseCommand):
+    help = 'Copy the hot fields of remote actors out of their stored profiles into their own columns'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BACKFILL_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        count = RemoteActor.objects.sync_profile_fields(
+            batch_size=options['batch_size'],
+            progress=lambda done, total: self.stdout.write(f'updated {done}/{total}'),
+        )
+        self.stdout.write(f'{count} remote actors updated')
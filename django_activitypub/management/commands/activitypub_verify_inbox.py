@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from django_activitypub.verification import VERIFY_BATCH_SIZE, verify_pending, verify_processes
+
+
+class Command(BaseCommand):
+    help = 'Verify the signatures of queued inbox activities and handle the verified ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=VERIFY_BATCH_SIZE)
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help=f'worker processes verifying signatures (default: {verify_processes()})',
+        )
+
+    def handle(self, *args, **options):
+        handled, rejected = verify_pending(
+            batch_size=options['batch_size'],
+            processes=options['processes'],
+            progress=lambda done, total: self.stdout.write(f'verified {done}/{total}'),
+        )
+        self.stdout.write(f'{handled} handled, {rejected} rejected')
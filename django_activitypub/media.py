@@ -0,0 +1,349 @@
+import hashlib
+import io
+import ipaddress
+import logging
+import os
+import socket
+import tempfile
+import threading
+import time
+from urllib.parse import urljoin, urlparse
+
+import requests
+from django.conf import settings
+from django.core import signing
+from django.core.cache import caches
+from django.urls import reverse
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from django_activitypub import client, metrics
+from django_activitypub.tasks import run_in_background
+
+ORIGINAL = 'original'
+AVATAR = 'avatar'
+VARIANTS = (ORIGINAL, AVATAR)
+AVATAR_SIZE = 96
+DEFAULT_CACHE_SIZE = 256 * 1024 * 1024
+# largest remote image fetched, in bytes; the general ACTIVITYPUB_HTTP_MAX_RESPONSE_SIZE is sized for JSON
+DEFAULT_MAX_SIZE = 10 * 1024 * 1024
+# eviction trims the cache to this fraction of its size cap, so it doesn't run on every store
+EVICT_TO = 0.9
+# seconds a cached response may be reused by browsers; blobs never change, so this can be long
+DEFAULT_MAX_AGE = 365 * 24 * 60 * 60
+# redirects a fetch follows, each to a host checked like the first
+MAX_REDIRECTS = 3
+# seconds before a failed fetch is retried
+FAILURE_TIMEOUT = 10 * 60
+# seconds between updates of a blob's last use, so hits don't write to the disk every time
+TOUCH_INTERVAL = 60 * 60
+# raster formats only: SVG can carry scripts
+CONTENT_TYPES = {
+    'image/png': 'PNG',
+    'image/jpeg': 'JPEG',
+    'image/gif': 'GIF',
+    'image/webp': 'WEBP',
+}
+SIGNING_SALT = 'django_activitypub.media'
+# running total of the bytes in the blob store, kept so stores don't have to walk it
+USAGE_KEY = 'ap-media-usage'
+
+logger = logging.getLogger(__name__)
+
+_in_flight = set()
+_in_flight_lock = threading.Lock()
+
+
+class MediaError(Exception):
+    pass
+
+
+def proxy_enabled():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_PROXY', True)
+
+
+def cache_dir():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'activitypub-media'))
+
+
+def cache_size():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_CACHE_SIZE', DEFAULT_CACHE_SIZE)
+
+
+def max_size():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_MAX_SIZE', DEFAULT_MAX_SIZE)
+
+
+def max_age():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_MAX_AGE', DEFAULT_MAX_AGE)
+
+
+def avatar_size():
+    return getattr(settings, 'ACTIVITYPUB_MEDIA_AVATAR_SIZE', AVATAR_SIZE)
+
+
+def failure_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_MEDIA_FAILURE_CACHE', 'default')]
+
+
+def usage_cache():
+    # shared between processes writing to the same cache directory, so each sees the others' stores
+    return caches[getattr(settings, 'ACTIVITYPUB_MEDIA_USAGE_CACHE', 'default')]
+
+
+def signer():
+    # ACTIVITYPUB_MEDIA_SIGNING_KEY defaults to SECRET_KEY
+    return signing.Signer(key=getattr(settings, 'ACTIVITYPUB_MEDIA_SIGNING_KEY', None), salt=SIGNING_SALT)
+
+
+def sign(url, variant):
+    return signer().sign_object({'u': url, 'v': variant}, compress=True)
+
+
+def unsign(token):
+    """
+    Returns the (url, variant) a proxy token was made for. Raises MediaError for tokens we didn't sign.
+    """
+    try:
+        data = signer().unsign_object(token)
+    except signing.BadSignature:
+        raise MediaError('bad signature')
+    if not isinstance(data, dict) or data.get('v') not in VARIANTS or not isinstance(data.get('u'), str):
+        raise MediaError('malformed token')
+    return data['u'], data['v']
+
+
+def proxy_url(url, variant=ORIGINAL):
+    """
+    The URL of our proxy for the remote media at url, warming the cache in the background. Returns url unchanged
+    when the proxy is off or url isn't remote.
+    """
+    if not url or not proxy_enabled() or not url.startswith(('https://', 'http://')):
+        return url
+    key = entry_key(url, variant)
+    if read_entry(key) is None:
+        prefetch(url, variant)
+    return reverse('activitypub-media', kwargs={'token': sign(url, variant)})
+
+
+def entry_key(url, variant):
+    return hashlib.sha256(f'{variant}:{url}'.encode('utf-8')).hexdigest()
+
+
+def entry_path(key):
+    return os.path.join(cache_dir(), 'entries', key[:2], key)
+
+
+def blob_path(digest):
+    return os.path.join(cache_dir(), 'blobs', digest[:2], digest)
+
+
+def write_atomic(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
+
+
+def read_entry(key):
+    """
+    Returns (content_type, blob digest) for a cached URL and variant, or None on a miss.
+    """
+    try:
+        with open(entry_path(key), 'r', encoding='utf-8') as f:
+            content_type, digest = f.read().split('\n', 1)
+    except (OSError, ValueError):
+        return None
+    if not os.path.exists(blob_path(digest)):
+        return None
+    return content_type, digest
+
+
+def store(key, content, content_type):
+    """
+    Store content under its own digest, so media shared by many URLs is kept once, and point key at it.
+    """
+    digest = hashlib.sha256(content).hexdigest()
+    added = not os.path.exists(blob_path(digest))
+    if added:
+        write_atomic(blob_path(digest), content)
+    write_atomic(entry_path(key), f'{content_type}\n{digest}'.encode('utf-8'))
+    if added:
+        add_usage(len(content))
+    return content_type, digest
+
+
+def add_usage(size):
+    """
+    Add size bytes to the running total, and evict once it passes the size cap. The total is counted from disk
+    when it isn't known yet, and again by every eviction, so drift from concurrent stores doesn't build up.
+    """
+    cache = usage_cache()
+    try:
+        total = cache.incr(USAGE_KEY, size)
+    except ValueError:
+        total = None
+    if total is None or total > cache_size():
+        evict()
+
+
+def touch(digest):
+    path = blob_path(digest)
+    try:
+        if time.time() - os.stat(path).st_mtime > TOUCH_INTERVAL:
+            os.utime(path)
+    except OSError:
+        pass
+
+
+def evict(limit=None):
+    """
+    Remove the least recently used blobs until the cache is under its size cap, and reset the running total to
+    what is left. Entries pointing to removed blobs read as misses. Returns the number of bytes freed.
+    """
+    limit = cache_size() if limit is None else limit
+    blobs = []
+    total = 0
+    for root, _, files in os.walk(os.path.join(cache_dir(), 'blobs')):
+        for name in files:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    freed = 0
+    if total > limit:
+        target = total - limit * EVICT_TO
+        for _, size, path in sorted(blobs):
+            if freed >= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            freed += size
+    usage_cache().set(USAGE_KEY, total - freed, None)
+    return freed
+
+
+def resize(content, size):
+    """
+    Crop and scale an image to a size x size square, as PNG if it has transparency and JPEG otherwise.
+    """
+    with Image.open(io.BytesIO(content)) as img:
+        img = ImageOps.fit(ImageOps.exif_transpose(img), (size, size), Image.LANCZOS)
+        out = io.BytesIO()
+        if img.mode in ('RGBA', 'LA', 'P'):
+            img.convert('RGBA').save(out, 'PNG', optimize=True)
+            return out.getvalue(), 'image/png'
+        img.convert('RGB').save(out, 'JPEG', quality=85, optimize=True)
+        return out.getvalue(), 'image/jpeg'
+
+
+def public_address(address):
+    address = ipaddress.ip_address(address.split('%', 1)[0])
+    if address.version == 6 and address.ipv4_mapped:
+        address = address.ipv4_mapped
+    return address.is_global and not address.is_multicast
+
+
+def check_host(url):
+    """
+    Returns the address to connect to for url, raising MediaError unless its host resolves only to public
+    addresses. Tokens are signed, but the URLs in them come from remote profiles, which must not reach loopback,
+    link-local or private networks through us.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('https', 'http') or not parsed.hostname:
+        raise MediaError(f'{url} is not a remote URL')
+    try:
+        infos = socket.getaddrinfo(parsed.hostname, parsed.port or parsed.scheme, proto=socket.IPPROTO_TCP)
+    except (OSError, UnicodeError, ValueError) as e:
+        raise MediaError(f'could not resolve {url}: {e}')
+    if not all(public_address(info[4][0]) for info in infos):
+        raise MediaError(f'{url} resolves to a non-public address')
+    return infos[0][4][0]
+
+
+def fetch(url, variant):
+    """
+    Fetch, check and store the remote media at url. Returns (content_type, blob digest). Each request connects
+    to the address check_host approved, so the name can't be re-pointed at a private address in between.
+    """
+    location = url
+    for _ in range(MAX_REDIRECTS + 1):
+        http = client.pinned_session(urlparse(location).hostname, check_host(location))
+        with metrics.remote_fetch('media') as outcome, http:
+            response = client.request(
+                'get', location, http=http, max_size=max_size(), headers={'Accept': ', '.join(CONTENT_TYPES)},
+                allow_redirects=False,
+            )
+            outcome['status'] = response.status_code
+        if not response.is_redirect:
+            break
+        location = urljoin(location, response.headers['location'])
+    else:
+        raise MediaError(f'too many redirects from {url}')
+    if response.status_code != 200:
+        raise MediaError(f'{response.status_code} response from {url}')
+    content_type = response.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type not in CONTENT_TYPES:
+        raise MediaError(f'{url} is not a supported image ({content_type or "no content type"})')
+
+    content = response.content
+    try:
+        with Image.open(io.BytesIO(content)) as img:
+            if img.format != CONTENT_TYPES[content_type]:
+                raise MediaError(f'{url} is {img.format}, not {content_type}')
+        if variant == AVATAR:
+            content, content_type = resize(content, avatar_size())
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        raise MediaError(f'{url} is not a valid image: {e}')
+    return store(entry_key(url, variant), content, content_type)
+
+
+def get(url, variant):
+    """
+    Returns (content_type, blob path) for url, fetching it if it isn't cached. Raises MediaError if it can't be
+    fetched; failures are remembered for a while so a broken URL isn't fetched on every page view.
+    """
+    key = entry_key(url, variant)
+    entry = read_entry(key)
+    metrics.cache_lookup('media', entry is not None)
+    if entry is None:
+        failures = failure_cache()
+        failure_key = f'ap-media-failed:{key}'
+        if failures.get(failure_key):
+            raise MediaError(f'{url} failed recently')
+        try:
+            entry = fetch(url, variant)
+        except (MediaError, requests.RequestException) as e:
+            failures.set(failure_key, True, getattr(settings, 'ACTIVITYPUB_MEDIA_FAILURE_TIMEOUT', FAILURE_TIMEOUT))
+            raise MediaError(str(e)) from e
+    content_type, digest = entry
+    touch(digest)
+    return content_type, digest
+
+
+def prefetch(url, variant):
+    """
+    Fetch url into the cache in the background, once at a time per URL and variant.
+    """
+    key = entry_key(url, variant)
+    with _in_flight_lock:
+        if key in _in_flight:
+            return
+        _in_flight.add(key)
+
+    def run():
+        try:
+            get(url, variant)
+        except MediaError as e:
+            logger.info('could not prefetch %s: %s', url, e)
+        finally:
+            with _in_flight_lock:
+                _in_flight.discard(key)
+
+    run_in_background(run)
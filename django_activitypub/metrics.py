@@ -0,0 +1,282 @@
+import bisect
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from django_activitypub import profiling
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+DESCRIPTIONS = {
+    'activitypub_deliveries_total': 'Outbound deliveries by response status',
+    'activitypub_delivery_seconds': 'Time taken by outbound deliveries, including signing',
+    'activitypub_signing_seconds': 'Time taken to sign an outbound request',
+    'activitypub_verification_seconds': 'Time taken to verify an inbound request signature',
+    'activitypub_signature_replays_total': 'Inbound signatures rejected as replays before verification',
+    'activitypub_inbox_activities_total': 'Inbox activities by type and outcome',
+    'activitypub_inbox_seconds': 'Time taken to process an inbox activity',
+    'activitypub_remote_fetch_seconds': 'Time taken by remote fetches by kind',
+    'activitypub_remote_fetches_total': 'Remote fetches by kind and response status',
+    'activitypub_cache_requests_total': 'Cache lookups by cache and result',
+}
+
+
+class InMemoryBackend:
+    """
+    Keeps every observation in memory so tests can assert on them.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = defaultdict(float)
+        self.gauges = {}
+        self.observations = defaultdict(list)
+
+    @staticmethod
+    def key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def increment(self, name, value, labels):
+        with self._lock:
+            self.counters[self.key(name, labels)] += value
+
+    def set_gauge(self, name, value, labels):
+        with self._lock:
+            self.gauges[self.key(name, labels)] = value
+
+    def observe(self, name, value, labels):
+        with self._lock:
+            self.observations[self.key(name, labels)].append(value)
+
+    def counter(self, name, **labels):
+        return self.counters.get(self.key(name, labels), 0)
+
+    def observed(self, name, **labels):
+        return self.observations.get(self.key(name, labels), [])
+
+    def reset(self):
+        with self._lock:
+            self.counters.clear()
+            self.gauges.clear()
+            self.observations.clear()
+
+
+class PrometheusBackend(InMemoryBackend):
+    """
+    Aggregates observations into histogram buckets and renders them in the Prometheus text exposition format.
+    Values are per process, so scrape every worker process.
+    """
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        super().__init__()
+        self.buckets = tuple(buckets)
+        self.histograms = {}
+
+    def observe(self, name, value, labels):
+        with self._lock:
+            key = self.key(name, labels)
+            if key not in self.histograms:
+                self.histograms[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts, _ = self.histograms[key]
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self.histograms[key][1] += value
+
+    def observed(self, name, **labels):
+        counts, total = self.histograms.get(self.key(name, labels), ([0], 0.0))
+        return {'count': sum(counts), 'sum': total}
+
+    def reset(self):
+        super().reset()
+        with self._lock:
+            self.histograms.clear()
+
+    @staticmethod
+    def format_labels(labels, extra=()):
+        pairs = list(labels) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (
+            (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in pairs
+        )
+        return '{' + ','.join(f'{k}="{v}"' for k, v in escaped) + '}'
+
+    def render(self):
+        lines = []
+        with self._lock:
+            by_name = defaultdict(list)
+            for (name, labels), value in self.counters.items():
+                by_name[(name, 'counter')].append((labels, value))
+            for (name, labels), value in self.gauges.items():
+                by_name[(name, 'gauge')].append((labels, value))
+            for (name, labels), value in self.histograms.items():
+                by_name[(name, 'histogram')].append((labels, value))
+
+            for (name, kind), samples in sorted(by_name.items()):
+                if name in DESCRIPTIONS:
+                    lines.append(f'# HELP {name} {DESCRIPTIONS[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in sorted(samples):
+                    if kind != 'histogram':
+                        lines.append(f'{name}{self.format_labels(labels)} {value}')
+                        continue
+                    counts, total = value
+                    cumulative = 0
+                    for bound, count in zip(self.buckets + (float('inf'),), counts):
+                        cumulative += count
+                        le = '+Inf' if bound == float('inf') else repr(bound)
+                        lines.append(f'{name}_bucket{self.format_labels(labels, [("le", le)])} {cumulative}')
+                    lines.append(f'{name}_sum{self.format_labels(labels)} {total}')
+                    lines.append(f'{name}_count{self.format_labels(labels)} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+_backend = None
+_lru_caches = {}
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend = getattr(settings, 'ACTIVITYPUB_METRICS_BACKEND', 'django_activitypub.metrics.PrometheusBackend')
+        _backend = import_string(backend)()
+    return _backend
+
+
+def set_backend(backend):
+    global _backend
+    _backend = backend
+
+
+def increment(name, value=1, **labels):
+    get_backend().increment(name, value, labels)
+
+
+def observe(name, value, **labels):
+    get_backend().observe(name, value, labels)
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield labels
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def cache_lookup(cache, hit):
+    increment('activitypub_cache_requests_total', cache=cache, result='hit' if hit else 'miss')
+
+
+def register_lru_cache(cache):
+    """
+    Decorator reporting the hit and miss counts of a functools.lru_cache wrapped function.
+    """
+    def decorator(fn):
+        _lru_caches[cache] = fn
+        return fn
+    return decorator
+
+
+def collect():
+    backend = get_backend()
+    for cache, fn in _lru_caches.items():
+        info = fn.cache_info()
+        backend.set_gauge('activitypub_lru_cache_hits', info.hits, {'cache': cache})
+        backend.set_gauge('activitypub_lru_cache_misses', info.misses, {'cache': cache})
+        backend.set_gauge('activitypub_lru_cache_size', info.currsize, {'cache': cache})
+
+
+@contextmanager
+def remote_fetch(kind):
+    """
+    Time a remote fetch. Set 'status' on the yielded dict to the response status code.
+    """
+    outcome = {'status': 'error'}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    finally:
+        elapsed = time.perf_counter() - start
+        profiling.record_http(elapsed)
+        observe('activitypub_remote_fetch_seconds', elapsed, kind=kind)
+        increment('activitypub_remote_fetches_total', kind=kind, status=str(outcome['status']))
+
+
+@contextmanager
+def delivery():
+    """
+    Time an outbound delivery. Set 'status' on the yielded dict to the response status code. The destination host
+    is left out of the labels, as every remote server would add a series of its own.
+    """
+    outcome = {'status': 'error'}
+    start = time.perf_counter()
+    try:
+        yield outcome
+    finally:
+        elapsed = time.perf_counter() - start
+        profiling.record_http(elapsed)
+        observe('activitypub_delivery_seconds', elapsed)
+        increment('activitypub_deliveries_total', status=str(outcome['status']))
+
+
+INBOX_ACTIVITY_TYPES = {'Follow', 'Like', 'Announce', 'Create', 'Undo', 'Delete', 'Accept', 'Update'}
+
+
+def instrument_inbox(view):
+    """
+    Count inbox activities by type and outcome and time their processing. The view reports the activity
+    type by setting request.activitypub_activity_type once it has parsed the body. Works with sync and
+    async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return await view(request, *args, **kwargs)
+
+            start = time.perf_counter()
+            response = None
+            try:
+                response = await view(request, *args, **kwargs)
+                return response
+            finally:
+                record_inbox(request, response, start)
+        return markcoroutinefunction(async_wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+
+        start = time.perf_counter()
+        response = None
+        try:
+            response = view(request, *args, **kwargs)
+            return response
+        finally:
+            record_inbox(request, response, start)
+    return wrapper
+
+
+def record_inbox(request, response, start):
+    # the view raised if there is no response
+    status = response.status_code if response is not None else 500
+    if status < 300:
+        outcome = 'accepted'
+    elif status in (413, 429):
+        outcome = 'throttled'
+    elif status < 500:
+        outcome = 'rejected'
+    else:
+        outcome = 'error'
+
+    activity_type = getattr(request, 'activitypub_activity_type', 'unknown')
+    if activity_type not in INBOX_ACTIVITY_TYPES and activity_type != 'unknown':
+        activity_type = 'other'
+    increment('activitypub_inbox_activities_total', type=activity_type, outcome=outcome)
+    observe('activitypub_inbox_seconds', time.perf_counter() - start, type=activity_type)
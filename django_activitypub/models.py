@@ -1,11 +1,13 @@
-import json
+import logging
+import time
 import urllib.parse
 import uuid, re, os
+from collections import defaultdict
 
 import requests
 from django.urls import resolve, reverse
 from django.contrib.auth import get_user_model
-from django.db import models, transaction
+from django.db import IntegrityError, models, transaction
 from django.utils import timezone
 from django.conf import settings
 from django.db.models.signals import post_save, post_delete, m2m_changed
@@ -13,22 +15,48 @@ from django.dispatch import receiver
 from django.utils.html import escape
 from django.utils.safestring import mark_safe
 
-from cryptography.hazmat.primitives.asymmetric import rsa
 from cryptography.hazmat.primitives import serialization
 from tree_queries.models import TreeNode, TreeQuerySet
 from datetime import datetime
 from PIL import Image
 
-from django_activitypub.signed_requests import signed_post
+from django_activitypub import client, keys, metrics
+from django_activitypub.collection_sync import EMPTY_DIGEST, SynchronizationHeaders, build_digest, follower_changed, uri_host
+from django_activitypub.encoding import dumps
+from django_activitypub.hashtags import extract_hashtags, featured_tags, hashtag_object, index_note, link_hashtags
+from django_activitypub.media import AVATAR, proxy_url
+from django_activitypub.profiling import timed_serializer
+from django_activitypub.ratelimit import CacheBackend, TokenBucket
+from django_activitypub.signed_requests import actor_signed_post
+from django_activitypub.tasks import run_in_background, run_inline, run_later
 from django_activitypub.utils.dates import format_datetime, parse_datetime
-from django_activitypub.webfinger import fetch_remote_profile, finger
+from django_activitypub.utils.ids import snowflake_id
+from django_activitypub.utils.lru import LRUCache
+from django_activitypub.webfinger import fetch_remote_profile, finger, invalidate_webfinger_cache
+
+
+logger = logging.getLogger('django_activitypub.delivery')
+backfill_logger = logging.getLogger('django_activitypub.backfill')
+models_logger = logging.getLogger(__name__)
+
+BACKFILL_CHUNK_SIZE = 100
+# (notes per second, burst) delivered to each remote host
+BACKFILL_RATE_LIMIT = (2.0, 10)
+# seconds between checks on the Accept a new follower's backfill waits for
+BACKFILL_ACCEPT_WAIT = 30
+
+# seconds before a cached remote object is revalidated, and before a 404 or 410 is retried
+REMOTE_OBJECT_TTL = 60 * 60
+REMOTE_OBJECT_NEGATIVE_TTL = 60 * 60
+REMOTE_OBJECT_CACHE_SIZE = 1024
+# seconds a process uses its in-memory copy of a remote object before checking the row again
+REMOTE_OBJECT_LOCAL_TTL = 60
+# times a new note is saved under a fresh content_id when the generated one is already taken
+CONTENT_ID_ATTEMPTS = 3
 
 
 def content_id_generator():
-    while True:
-        content_id = str(uuid.uuid4().int)[:18]  # Generate a unique ID
-        if not Note.objects.filter(content_id=content_id).exists():
-            return content_id  # Return only if unique
+    return snowflake_id()
 
 
 class ActorChoices(models.TextChoices):
@@ -50,6 +78,8 @@ class LocalActor(models.Model):
     user = models.OneToOneField(get_user_model(), on_delete=models.CASCADE)
     private_key = models.TextField(blank=True, editable=False)
     public_key = models.TextField(blank=True, editable=False)
+    ed25519_private_key = models.TextField(blank=True, editable=False)
+    ed25519_public_key = models.TextField(blank=True, editable=False)
     actor_type = models.CharField(max_length=1, choices=ActorChoices, default=ActorChoices.PERSON)
     preferred_username = models.SlugField(max_length=255)
     domain = models.CharField(max_length=255)
@@ -85,13 +115,23 @@ class LocalActor(models.Model):
     def icon_url(self):
         return self.icon.url if self.icon else None
 
+    @property
+    def avatar_url(self):
+        return self.icon_url
+
     def __str__(self):
         return self.preferred_username
 
     def get_absolute_url(self):
         return f'https://{self.domain}' + reverse('activitypub-profile', kwargs={'username': self.preferred_username})
     
-    def as_json(self):
+    @timed_serializer
+    def as_json(self, featured=None):
+        """
+        The actor document. featured is the names for featuredTags, looked up when not given.
+        """
+        if featured is None:
+            featured = featured_tags(self)
         object = {
             'id': f'https://{self.domain}' + reverse('activitypub-profile', kwargs={'username': self.preferred_username}),
             'type': ActorChoices(self.actor_type).label,
@@ -100,7 +140,7 @@ class LocalActor(models.Model):
             'inbox': f'https://{self.domain}' + reverse('activitypub-inbox', kwargs={'username': self.preferred_username}),
             'outbox': f'https://{self.domain}' + reverse('activitypub-outbox', kwargs={'username': self.preferred_username}),
             'featured': None,
-            'featuredTags': [], 
+            'featuredTags': [hashtag_object(name, f'https://{self.domain}') for name in featured],
             'name': self.name,
             'preferredUsername': self.preferred_username,
             'summary': mark_safe(self.summary),
@@ -127,6 +167,13 @@ class LocalActor(models.Model):
                 'value': f'<a href="https://{self.domain}" translate="no"><span class="">{self.domain}</span><span class="invisible"></span></a>'
             }],
         }
+        if self.ed25519_public_key:
+            object['assertionMethod'] = [{
+                'id': f'{self.get_absolute_url()}#ed25519-key',
+                'type': 'Multikey',
+                'controller': self.get_absolute_url(),
+                'publicKeyMultibase': keys.ed25519_multibase(self.ed25519_public_key),
+            }]
         if self.icon:
             object['icon'] = {
                 'type': 'Image',
@@ -147,16 +194,9 @@ class LocalActor(models.Model):
 
     def save(self, *args, **kwargs):
         if not self.id:
-            private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
-            self.private_key = private_key.private_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PrivateFormat.TraditionalOpenSSL,
-                encryption_algorithm=serialization.NoEncryption(),
-            ).decode('utf-8')
-            self.public_key = private_key.public_key().public_bytes(
-                encoding=serialization.Encoding.PEM,
-                format=serialization.PublicFormat.SubjectPublicKeyInfo
-            ).decode('utf-8')
+            self.private_key, self.public_key = KeyPool.objects.take_or_generate(keys.RSA)
+            if getattr(settings, 'ACTIVITYPUB_ED25519_KEYS', False) and not self.ed25519_public_key:
+                self.ed25519_private_key, self.ed25519_public_key = KeyPool.objects.take_or_generate(keys.ED25519)
         super().save(*args, **kwargs)
 
     def private_key_obj(self):
@@ -171,7 +211,66 @@ class LocalActor(models.Model):
         )
 
 
+class KeyPoolManager(models.Manager):
+    def take(self, algorithm=keys.RSA):
+        """
+        Claim a pre-generated key pair. Claiming deletes the row, so a key handed to one caller can never be
+        handed to another. Returns None when the pool is empty.
+        """
+        while True:
+            with transaction.atomic():
+                key = self.select_for_update(skip_locked=True).filter(algorithm=algorithm).order_by('id').first()
+                if key is None:
+                    return None
+                if self.filter(id=key.id).delete()[0]:
+                    break
+        if (size := getattr(settings, 'ACTIVITYPUB_KEY_POOL_SIZE', 0)) and self.filter(algorithm=algorithm).count() < size // 2:
+            run_in_background(self.fill, size, algorithm)
+        return key.private_key, key.public_key
+
+    def take_or_generate(self, algorithm=keys.RSA):
+        return self.take(algorithm) or keys.generate_key_pair(algorithm)
+
+    def fill(self, size, algorithm=keys.RSA, batch_size=10):
+        """
+        Generate key pairs until the pool holds size keys of algorithm. Returns the number generated.
+        """
+        missing = max(0, size - self.filter(algorithm=algorithm).count())
+        for start in range(0, missing, batch_size):
+            pairs = [keys.generate_key_pair(algorithm) for _ in range(min(batch_size, missing - start))]
+            self.bulk_create([
+                KeyPool(algorithm=algorithm, private_key=private_key, public_key=public_key)
+                for private_key, public_key in pairs
+            ])
+        return missing
+
+
+class KeyPool(models.Model):
+    """
+    Key pairs generated ahead of time so that creating a LocalActor does not block on key generation.
+    """
+    ALGORITHM_CHOICES = [(keys.RSA, 'RSA 2048'), (keys.ED25519, 'Ed25519')]
+
+    algorithm = models.CharField(max_length=10, choices=ALGORITHM_CHOICES, default=keys.RSA)
+    private_key = models.TextField()
+    public_key = models.TextField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    objects = KeyPoolManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['algorithm', 'id'], name='ap_key_pool_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.algorithm} key {self.id}'
+
+
 class RemoteActorManager(models.Manager):
+    def get_queryset(self):
+        return super().get_queryset().defer('profile')
+
     def get_or_create_with_url(self, url, actor = None):
         try:
             return self.get(url=url)  # TODO: check cache expiry
@@ -205,12 +304,120 @@ class RemoteActorManager(models.Manager):
                     profile=data['profile'],
                 )
 
+    def update_profile(self, data):
+        """
+        Refresh a known remote actor from the object of an Update activity. Returns the number of rows updated.
+        """
+        fields = {'profile': data, **profile_fields(data), 'updated_at': timezone.now()}
+        if username := data.get('preferredUsername'):
+            fields['username'] = username
+        return self.filter(url=data['id']).update(**fields)
+
+    def sync_profile_fields(self, batch_size=BACKFILL_CHUNK_SIZE, progress=None):
+        """
+        Copy the hot fields out of every stored profile, for rows written before the columns existed or with
+        bulk_create(). Returns the number of actors updated.
+        """
+        total = self.count()
+        last_id = 0
+        done = 0
+        while True:
+            batch = list(self.filter(id__gt=last_id).defer(None).order_by('id')[:batch_size])
+            if not batch:
+                break
+            for actor in batch:
+                actor.sync_profile_fields()
+            self.bulk_update(batch, list(profile_fields({})))
+            last_id = batch[-1].id
+            done += len(batch)
+            if progress:
+                progress(done, total)
+        return done
+
+    def sync_missing_inboxes(self, actors=None):
+        """
+        Copy the hot fields out of the profiles of actors (default: all) whose inbox column is still empty but
+        whose profile has one: rows from before the columns existed that activitypub_sync_remote_actors hasn't
+        reached yet. Fan-outs call this first, so they reach those actors too. Returns the number updated.
+        """
+        actors = self.all() if actors is None else actors
+        stale = list(actors.filter(inbox_url='', profile__has_key='inbox').defer(None))
+        for actor in stale:
+            actor.sync_profile_fields()
+        self.bulk_update(stale, list(profile_fields({})))
+        return len(stale)
+
+    def delete_remote(self, url):
+        """
+        Handle the deletion of a remote actor: drop its follow relationships, likes, announces and queued
+        deliveries in bulk and tombstone its notes. The actor row is removed when no notes refer to it,
+        otherwise it is kept so tombstoned replies keep their author.
+        """
+        try:
+            remote_actor = self.get(url=url)
+        except RemoteActor.DoesNotExist:
+            return False
+
+        with transaction.atomic():
+            Follower.objects.filter(remote_actor=remote_actor).delete()
+            Following.objects.filter(remote_actor=remote_actor).delete()
+            Note.likes.through.objects.filter(remoteactor=remote_actor).delete()
+            Note.announces.through.objects.filter(remoteactor=remote_actor).delete()
+            Backfill.objects.filter(remote_actor=remote_actor).delete()
+            if remote_actor.inbox:
+                Delivery.objects.filter(inbox=remote_actor.inbox, delivered_at__isnull=True).update(failed=True)
+            if Note.objects.filter(remote_actor=remote_actor).tombstone_remote():
+                remote_actor.profile = {}
+                remote_actor.save(update_fields=['profile'])
+            else:
+                remote_actor.delete()
+        return True
+
+
+def first_value(value):
+    # ActivityStreams properties may hold one value or a list of them
+    return value[0] if isinstance(value, list) and value else value
+
+
+def text_value(value):
+    return value if isinstance(value, str) else ''
+
+
+def profile_fields(profile):
+    """
+    The RemoteActor columns copied out of a profile, so lists and fan-outs don't have to load and decode it.
+    """
+    endpoints = profile.get('endpoints')
+    icon = first_value(profile.get('icon'))
+    key = first_value(profile.get('publicKey'))
+    key = key if isinstance(key, dict) else {}
+    return {
+        'name': text_value(profile.get('name'))[:255],
+        'icon_url': text_value(icon.get('url') if isinstance(icon, dict) else icon),
+        'inbox_url': text_value(profile.get('inbox')),
+        'shared_inbox_url': text_value(endpoints.get('sharedInbox') if isinstance(endpoints, dict) else None),
+        'key_id': text_value(key.get('id')),
+        'public_key_pem': text_value(key.get('publicKeyPem')),
+    }
+
 
 class RemoteActor(models.Model):
+    """
+    A remote actor. The fields lists, fan-outs and signature checks need are copied out of the fetched profile
+    into their own columns; the profile itself is deferred and only loaded when it is read.
+    """
     username = models.CharField(max_length=255)
     domain = models.CharField(max_length=255)
     url = models.URLField(db_index=True, unique=True)
     profile = models.JSONField(blank=True, default=dict)
+    name = models.CharField(max_length=255, blank=True, editable=False)
+    icon_url = models.URLField(max_length=2048, blank=True, editable=False)
+    inbox_url = models.URLField(max_length=2048, blank=True, editable=False)
+    shared_inbox_url = models.URLField(max_length=2048, blank=True, editable=False)
+    key_id = models.URLField(max_length=2048, blank=True, editable=False)
+    public_key_pem = models.TextField(blank=True, editable=False)
+    # last time the row was written, e.g. a profile refresh; retention keeps recently seen actors
+    updated_at = models.DateTimeField(auto_now=True, null=True)
     followings = models.ManyToManyField(
         LocalActor, through='Follower', related_name='remoteactor_followings',
         through_fields=('remote_actor', 'following'),
@@ -220,28 +427,66 @@ class RemoteActor(models.Model):
 
     class Meta:
         indexes = [
-            models.Index(fields=['username', 'domain'], name='ap_remote_actor_idx')
+            models.Index(fields=['username', 'domain'], name='ap_remote_actor_idx'),
+            models.Index(fields=['domain'], name='ap_remote_actor_domain_idx'),
         ]
 
     def __str__(self):
         return f'{self.username}@{self.domain}'
 
+    def save(self, *args, **kwargs):
+        if 'profile' not in self.get_deferred_fields():
+            self.sync_profile_fields()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'profile' in update_fields:
+            kwargs['update_fields'] = {*update_fields, *profile_fields({}), 'updated_at'}
+        super().save(*args, **kwargs)
+
+    def sync_profile_fields(self):
+        """
+        Copy the hot fields out of profile. save() does this, but bulk_create() and update() don't.
+        """
+        for name, value in profile_fields(self.profile).items():
+            setattr(self, name, value)
+
     @property
     def handle(self):
         return f'{self.username}@{self.domain}'
 
     @property
     def account_url(self):
-        return self.profile.get('id', '#')
+        return self.url
 
     @property
-    def icon_url(self):
-        return self.profile.get('icon', {}).get('url', None)
+    def preferred_username(self):
+        return self.username
 
     @property
-    def preferred_username(self):
-        return self.profile.get('preferredUsername', self.username)
-    
+    def avatar_url(self):
+        """
+        The icon through our media proxy, resized for display next to posts.
+        """
+        return proxy_url(self.icon_url, AVATAR)
+
+    @property
+    def inbox(self):
+        """
+        The actor's inbox. Rows from before the inbox columns existed have them empty until
+        activitypub_sync_remote_actors runs; those read it from the profile.
+        """
+        return self.inbox_url or text_value(self.profile.get('inbox'))
+
+    def key_document(self):
+        """
+        The actor's RSA key in the shape of a profile, for checking signatures without the full profile.
+        """
+        if not self.key_id:
+            return None
+        return {
+            'id': self.url,
+            'publicKey': {'id': self.key_id, 'owner': self.url, 'publicKeyPem': self.public_key_pem},
+        }
+
     def get_absolute_url(self):
         return self.account_url
 
@@ -261,7 +506,27 @@ class Follower(models.Model):
 
     def __str__(self):
         return f'{self.remote_actor} -> {self.following}'
-    
+
+
+class FollowerDigest(models.Model):
+    """
+    The FEP-8fcf digest of a local actor's followers on one remote host, the XOR of the SHA-256 of their URIs.
+    Kept up to date as followers come and go, and sent with deliveries so the host can spot a drift in one
+    comparison.
+    """
+    local_actor = models.ForeignKey(LocalActor, on_delete=models.CASCADE, related_name='follower_digests')
+    host = models.CharField(max_length=255)
+    digest = models.CharField(max_length=64, default=EMPTY_DIGEST)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['local_actor', 'host'], name='ap_unique_follower_digests')
+        ]
+
+    def __str__(self):
+        return f'{self.local_actor} @ {self.host}'
+
 
 class Following(models.Model):
     remote_actor = models.ForeignKey(RemoteActor, on_delete=models.CASCADE)
@@ -320,6 +585,14 @@ class NoteManager(TreeQuerySet):
             note.save()
         if note.id:
             return note
+
+    def tombstone_remote(self):
+        """
+        Tombstone remote notes in place, keeping the rows so replies to them stay in their thread.
+        """
+        remote = self.filter(remote_actor__isnull=False)
+        NoteHashtag.objects.filter(note__in=remote).delete()
+        return remote.update(tombstone=True, content='', updated_at=timezone.now())
     
 
 class Note(TreeNode):
@@ -338,6 +611,7 @@ class Note(TreeNode):
     federate = models.BooleanField(default=False)
     update = models.BooleanField(default=False)
     attachments = models.ManyToManyField('ImageAttachment', blank=True, related_name='attachments')
+    hashtags = models.ManyToManyField('Hashtag', through='NoteHashtag', blank=True, related_name='notes')
 
     objects = NoteManager.as_manager()
 
@@ -351,6 +625,20 @@ class Note(TreeNode):
             return f'{self.content_url}?id={self.content_id}'
         return self.get_absolute_url()
 
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            return super().save(*args, **kwargs)
+        for attempt in range(CONTENT_ID_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return super().save(*args, **kwargs)
+            except IntegrityError:
+                # two processes sharing a snowflake worker id can generate the same content_id
+                if attempt == CONTENT_ID_ATTEMPTS - 1 or not Note.objects.filter(content_id=self.content_id).exists():
+                    raise
+                logger.warning('content_id %s is taken, generating another', self.content_id)
+                self.content_id = content_id_generator()
+
     def get_absolute_url(self):
         if self.local_actor:
             return f'https://{self.local_actor.domain}' + reverse('activitypub-notes-statuses', kwargs={'username': self.local_actor.preferred_username, 'id': self.content_id})
@@ -359,6 +647,7 @@ class Note(TreeNode):
     def content_html(self, base_url):
         return parse_html(self.content, base_url)
 
+    @timed_serializer
     def as_json(self, mode = 'activity', base_url = None):
         if not base_url:
             base_url = f'https://{self.actor.domain}'
@@ -458,6 +747,35 @@ class Note(TreeNode):
         return min(getattr(self, 'tree_depth', 1), 5)
     
 
+class Hashtag(models.Model):
+    # stored lowercased, so #Art and #art share a timeline
+    name = models.CharField(max_length=255, unique=True)
+
+    def __str__(self):
+        return f'#{self.name}'
+
+
+class NoteHashtag(models.Model):
+    """
+    A hashtag used in a note. The note's published_at is copied here, so a tag timeline is read in order straight
+    from the index.
+    """
+    note = models.ForeignKey(Note, on_delete=models.CASCADE, related_name='note_hashtags')
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name='note_hashtags')
+    published_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['hashtag', 'note'], name='ap_unique_note_hashtags')
+        ]
+        indexes = [
+            models.Index(fields=['hashtag', '-published_at', '-note'], name='ap_note_hashtag_date_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.hashtag} {self.note_id}'
+
+
 class NoteTemplate(models.Model):
     name = models.CharField(max_length=250)
     content = models.TextField()
@@ -475,14 +793,220 @@ class ImageAttachment(models.Model):
     def __str__(self):
         return self.attachment.name
 
-    
+
+class DeliveryPriority(models.IntegerChoices):
+    REPLY = 0, 'Accept replies'
+    ACTIVITY = 1, 'Fan-outs to followers'
+    BULK = 2, 'Bulk deletes'
+
+
+class Delivery(models.Model):
+    """
+    An activity queued for delivery to a remote inbox.
+    """
+    local_actor = models.ForeignKey(LocalActor, on_delete=models.CASCADE, related_name='deliveries')
+    inbox = models.URLField()
+    host = models.CharField(max_length=255, blank=True)
+    body = models.TextField()
+    priority = models.PositiveSmallIntegerField(choices=DeliveryPriority, default=DeliveryPriority.ACTIVITY)
+    created_at = models.DateTimeField(auto_now_add=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    last_error = models.TextField(blank=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    failed = models.BooleanField(default=False)
+    claimed_by = models.CharField(max_length=255, blank=True, help_text="The delivery worker sending this now.")
+    available_at = models.DateTimeField(
+        null=True, blank=True, help_text="Not attempted before this time, while claimed or backing off.",
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['delivered_at', 'failed', 'id'], name='ap_delivery_pending_idx'),
+            models.Index(fields=['host', 'priority', 'id'], name='ap_delivery_host_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.local_actor} -> {self.inbox}'
+
+
+class InboxItem(models.Model):
+    """
+    A signed request to a local inbox, queued for batched signature verification.
+    """
+    local_actor = models.ForeignKey(LocalActor, on_delete=models.CASCADE, related_name='inbox_items')
+    url = models.URLField(max_length=2048, help_text="The absolute URL the request was made to.")
+    key_id = models.CharField(max_length=2048)
+    headers = models.JSONField(default=dict)
+    body = models.BinaryField()
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    status = models.PositiveSmallIntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['processed_at', 'id'], name='ap_inbox_item_pending_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.key_id} -> {self.local_actor}'
+
+
+class DeliveryWorker(models.Model):
+    """
+    A running delivery worker. Workers with a recent heartbeat share the destination hosts between them.
+    """
+    name = models.CharField(max_length=255, unique=True)
+    started_at = models.DateTimeField(auto_now_add=True)
+    heartbeat_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return self.name
+
+
+class Backfill(models.Model):
+    """
+    Delivery of a local actor's existing notes to a new follower, newest first. The cursor is the last
+    note delivered.
+    """
+    local_actor = models.ForeignKey(LocalActor, on_delete=models.CASCADE, related_name='backfills')
+    remote_actor = models.ForeignKey(RemoteActor, on_delete=models.CASCADE, related_name='backfills')
+    cursor_published_at = models.DateTimeField(null=True, blank=True)
+    cursor_id = models.BigIntegerField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['local_actor', 'remote_actor'], name='ap_unique_backfills')
+        ]
+
+    def __str__(self):
+        return f'{self.local_actor} -> {self.remote_actor}'
+
+    def pending_notes(self):
+        notes = Note.objects.filter(local_actor=self.local_actor, tombstone=False).order_by('-published_at', '-id')
+        if self.cursor_id is not None:
+            notes = notes.filter(
+                models.Q(published_at__lt=self.cursor_published_at) |
+                models.Q(published_at=self.cursor_published_at, id__lt=self.cursor_id)
+            )
+        return notes
+
+
+class RemoteObjectManager(models.Manager):
+    def fetch(self, url):
+        """
+        Returns the remote object at url, from the cache while it is fresh. Stale objects are revalidated
+        with a conditional GET, and a 404 or 410 is remembered so gone objects are not fetched again
+        until it expires.
+        """
+        now = timezone.now()
+        cached = self.cached(url)
+        if cached is not None and cached.is_fresh(now):
+            metrics.cache_lookup('remote_object', True)
+            return cached.result()
+        metrics.cache_lookup('remote_object', False)
+
+        stale = cached if cached is not None and cached.data is not None else None
+        try:
+            resp = client.get_json(url, kind='object', headers=stale.validators() if stale else None)
+        except requests.RequestException as e:
+            if stale:
+                models_logger.info('serving stale %s: %s', url, e)
+                return stale.data
+            raise
+
+        if resp.status_code == 304 and stale:
+            stale.fetched_at = now
+            stale.save(update_fields=['fetched_at'])
+            obj = stale
+        elif resp.status_code in (404, 410):
+            obj, _ = self.update_or_create(url=url, defaults={
+                'data': None, 'status': resp.status_code, 'etag': '', 'last_modified': '', 'fetched_at': now,
+            })
+        elif resp.status_code >= 400 and stale:
+            models_logger.info('serving stale %s: %s response', url, resp.status_code)
+            return stale.data
+        else:
+            resp.raise_for_status()
+            obj, _ = self.update_or_create(url=url, defaults={
+                'data': resp.json(),
+                'status': resp.status_code,
+                'etag': resp.headers.get('ETag', '')[:255],
+                'last_modified': resp.headers.get('Last-Modified', '')[:64],
+                'fetched_at': now,
+            })
+        remote_object_cache.set(url, (obj, time.monotonic()))
+        return obj.result()
+
+    def cached(self, url):
+        """
+        The stored copy of url. The row is read again once this process' copy is older than
+        ACTIVITYPUB_REMOTE_OBJECT_LOCAL_TTL seconds, so objects other processes refreshed or invalidated are
+        seen here too.
+        """
+        entry = remote_object_cache.get(url)
+        ttl = getattr(settings, 'ACTIVITYPUB_REMOTE_OBJECT_LOCAL_TTL', REMOTE_OBJECT_LOCAL_TTL)
+        if entry is not None and time.monotonic() - entry[1] < ttl:
+            return entry[0]
+        obj = self.filter(url=url).first()
+        if obj is None:
+            remote_object_cache.pop(url)
+        else:
+            remote_object_cache.set(url, (obj, time.monotonic()))
+        return obj
+
+    def invalidate(self, url):
+        remote_object_cache.pop(url)
+        return self.filter(url=url).delete()
+
+
+class RemoteObject(models.Model):
+    """
+    Cached copy of a remote ActivityPub object, or of the 404 or 410 returned for it, in which case data
+    is null.
+    """
+    url = models.URLField(max_length=2048, unique=True)
+    data = models.JSONField(null=True, blank=True)
+    status = models.PositiveSmallIntegerField(default=200)
+    etag = models.CharField(max_length=255, blank=True)
+    last_modified = models.CharField(max_length=64, blank=True)
+    fetched_at = models.DateTimeField(db_index=True)
+
+    objects = RemoteObjectManager()
+
+    def __str__(self):
+        return self.url
+
+    def is_fresh(self, now):
+        if self.data is None:
+            ttl = getattr(settings, 'ACTIVITYPUB_REMOTE_OBJECT_NEGATIVE_TTL', REMOTE_OBJECT_NEGATIVE_TTL)
+        else:
+            ttl = getattr(settings, 'ACTIVITYPUB_REMOTE_OBJECT_TTL', REMOTE_OBJECT_TTL)
+        return (now - self.fetched_at).total_seconds() < ttl
+
+    def validators(self):
+        headers = {}
+        if self.etag:
+            headers['If-None-Match'] = self.etag
+        if self.last_modified:
+            headers['If-Modified-Since'] = self.last_modified
+        return headers
+
+    def result(self):
+        if self.data is None:
+            raise client.FetchError(f'{self.status} response from {self.url}', self.status)
+        return self.data
+
+
+remote_object_cache = LRUCache(REMOTE_OBJECT_CACHE_SIZE)
+
+
 def parse_hashtags(content, domain):
-    for t in re.findall(r'#\w+', content):
-        yield {
-            'type': 'Hashtag',
-            'href': f'https://{domain}/tags/{t}',
-            'name': t,
-        }
+    for name in extract_hashtags(content):
+        yield hashtag_object(name, f'https://{domain}')
     
 def parse_mentions(content):
     """
@@ -513,88 +1037,65 @@ def parse_html(content, base_url):
         r'<span class="invisible">\1</span>\2</a>',
         content
     )
-    re.sub(r'(?<=\n)(?:#\w+\s*)+', '', content)
-    # hashtags = re.findall(r'#\w+', match.group()) if match else []
-    hashtag_pattern = re.compile(r'#(\w+)')
-    content = hashtag_pattern.sub(r'<a href="{}/tags/\1" class="mention hashtag status-link" rel="tag">#\1</a>'.format(base_url), content)
+    content = link_hashtags(content, base_url)
     paragraphs = content.split('\n')
     formatted_text = ''.join(f'<p>{para.strip()}</p>' for para in paragraphs if para.strip())
     return mark_safe(formatted_text)
 
 
+def note_fanout(actor, note, mode, followers):
+    """
+    Queue note's activity for the remote actors in followers. Its mentions and hashtags link to the follower's
+    domain, so the activity is built and encoded once per domain and queued for that domain's inboxes, collapsed
+    by shared inbox.
+    """
+    from django_activitypub.delivery import queue_delivery
+
+    RemoteActor.objects.sync_missing_inboxes(followers)
+    inboxes = defaultdict(set)
+    for domain, inbox, shared_inbox in followers.values_list('domain', 'inbox_url', 'shared_inbox_url'):
+        if shared_inbox or inbox:
+            inboxes[domain].add(shared_inbox or inbox)
+    for domain, targets in inboxes.items():
+        data = {
+            '@context': [
+                'https://www.w3.org/ns/activitystreams',
+                "https://w3id.org/security/v1"
+            ],
+        }
+        data.update(note.as_json(mode=mode, base_url=f'https://{domain}'))
+        data['object']['tag'] = list(parse_mentions(note.content)) + list(parse_hashtags(note.content, domain))
+        queue_delivery(actor, dumps(data).decode('utf-8'), sorted(targets))
+        logger.info('%s note %s queued for %d inboxes', mode, note.id, len(targets), extra={'host': domain})
+
+
 def send_create_note_to_followers(note):
     if note.local_actor:
         actor = note.local_actor
     elif note.parent and note.parent.local_actor:
         actor = note.parent.local_actor
-    actor_url = actor.get_absolute_url()
-    data = {'@context' : [
-        'https://www.w3.org/ns/activitystreams',
-        "https://w3id.org/security/v1"
-    ]}
-    followers = actor.followers.all().exclude(id__in=[f.remote_actor.id for f in note.outbox.all()])
-    for follower in followers:
-        inbox = follower.profile.get('inbox')
-        domain = follower.domain
-        data.update(note.as_json(mode='activity', base_url=f'https://{domain}'))
-        data['object']['tag'] = list(parse_mentions(note.content)) + list(parse_hashtags(note.content, domain))
-        try:
-            resp = signed_post(
-                inbox,
-                actor.private_key.encode('utf-8'),
-                f'{actor_url}#main-key',
-                body=json.dumps(data)
-            )
-            resp.raise_for_status()
-            note.outbox.add(Follower.objects.get(remote_actor=follower))
+    followers = actor.followers.exclude(id__in=note.outbox.values('remote_actor_id'))
+    outbox = list(Follower.objects.filter(following=actor, remote_actor__in=followers))
+    note_fanout(actor, note, 'activity', followers)
+    note.outbox.add(*outbox)
 
-            print(f'send_create_note_to_followers - {follower.__str__()} - {resp.status_code}')
-        except Exception as e: 
-            # TODO: gracefully handle deleted followers so replies stay
-            # if re.findall(r'Not Found', str(e)):
-            #     follower.delete()
-            print(f'send_create_note_to_followers - error - {e}')
 
 def send_update_note_to_followers(note):
     if note.local_actor:
         actor = note.local_actor
     elif note.parent and note.parent.local_actor:
         actor = note.parent.local_actor
-    actor_url = actor.get_absolute_url()
-    data = {
-        '@context': [
-            'https://www.w3.org/ns/activitystreams',
-            "https://w3id.org/security/v1"
-        ],
-    }
+    note_fanout(actor, note, 'update', actor.followers.all())
 
-    for follower in note.local_actor.followers.all():
-        inbox = follower.profile.get('inbox')
-        domain = follower.domain
-        data.update(note.as_json(mode='update', base_url=f'https://{domain}'))
-        data['object']['tag'] = list(parse_mentions(note.content)) + list(parse_hashtags(note.content, domain))
-        try:
-            resp = signed_post(
-                inbox,
-                note.local_actor.private_key.encode('utf-8'),
-                f'{actor_url}#main-key',
-                body=json.dumps(data)
-            )
-            resp.raise_for_status()
-            print(f'send_update_note_to_followers - {follower.__str__()}')
-        except Exception as e:  # TODO: handle 404 and delete followers 
-            print(str(e))
 
-
-def send_delete_note_to_followers(note):
-    actor_url = note.actor.get_absolute_url()
-    data = {
+def delete_activity(note):
+    return {
         '@context': [
             'https://www.w3.org/ns/activitystreams',
         ],
         'id': f'https://{note.actor.domain}' + reverse('activitypub-notes-delete', kwargs={'username': note.actor.preferred_username, 'id': note.content_id}),
         'type': 'Delete',
-        'actor': actor_url,
+        'actor': note.actor.get_absolute_url(),
         "to": [
             "https://www.w3.org/ns/activitystreams#Public"
         ],
@@ -604,73 +1105,161 @@ def send_delete_note_to_followers(note):
             'atomUri': note.get_absolute_url()
         },
     }
-    send_to_followers(note.local_actor, data)
+
+
+def send_delete_note_to_followers(note):
+    send_to_followers(note.local_actor, delete_activity(note))
 
 def send_to_followers(actor, data, note=None):
-    for follower in actor.followers.all():
-        try:
-            resp = signed_post(
-                follower.profile.get('inbox'),
-                actor.private_key.encode('utf-8'),
-                f'{actor.get_absolute_url()}#main-key',
-                body=json.dumps(data)
-            )
-            if resp.status_code == 404:
-                try:
-                    if 'error' in resp.json():
-                        follower.delete()
-                        print(f'{follower.__str__()} deleted')
-                except Exception as e:
-                    print(f'resp.json - {str(e)}')
-            resp.raise_for_status()
-        except Exception as e:
-            print(f'signed_post - {str(e)}')
-        if resp.status_code != 404:
-            if note:
-                print(f'{follower.__str__()} - tombstoned')
-                note.tombstone = True
-                note.save()
-            else:
-                print(f'{follower.__str__()} - success')
+    from django_activitypub.delivery import follower_inboxes, queue_delivery
+
+    queue_delivery(actor, dumps(data).decode('utf-8'), follower_inboxes(actor))
+    logger.info('%s queued for the followers of %s', data.get('type'), actor)
+    if note and not note.tombstone:
+        note.tombstone = True
+        note.save(update_fields=['tombstone'])
 
 
-def delete_all_notes():
-    for note in Note.objects.all():
-        if not note.parent and note.local_actor and not note.tombstone:
-            send_delete_note_to_followers(note)
+def tombstone_notes(local_actor=None, progress=None):
+    """
+    Mark every top-level local note (optionally only local_actor's) as a tombstone and queue one Delete per note
+    for each of the author's follower inboxes, collapsed by shared inbox. Each chunk of notes is tombstoned in the
+    same transaction that queues its Deletes, so a failure part-way never leaves Deletes queued for live notes, and
+    running it again picks up where it stopped. Returns the number of notes tombstoned.
+    """
+    from django_activitypub.delivery import enqueue, follower_inboxes
+
+    notes = Note.objects.filter(parent__isnull=True, local_actor__isnull=False, tombstone=False)
+    if local_actor:
+        notes = notes.filter(local_actor=local_actor)
+
+    last_id = notes.order_by('id').values_list('id', flat=True).last()
+    if last_id is None:
+        return 0
+    # notes created while this runs are left alone
+    notes = notes.filter(id__lte=last_id).select_related('local_actor').order_by('id')
+    total = notes.count()
+
+    inboxes = {}
+    done = 0
+    cursor = 0
+    while True:
+        with transaction.atomic():
+            chunk = list(notes.filter(id__gt=cursor).select_for_update(of=('self',))[:BACKFILL_CHUNK_SIZE])
+            if not chunk:
+                break
+            for note in chunk:
+                actor = note.local_actor
+                if actor.id not in inboxes:
+                    inboxes[actor.id] = follower_inboxes(actor)
+                enqueue(actor, dumps(delete_activity(note)).decode('utf-8'), inboxes[actor.id], priority=DeliveryPriority.BULK)
+            ids = [note.id for note in chunk]
+            NoteHashtag.objects.filter(note_id__in=ids).delete()
+            Note.objects.filter(id__in=ids).update(tombstone=True)
+        cursor = chunk[-1].id
+        done += len(chunk)
+        if progress:
+            progress(done, total)
+    return done
+
+
+def delete_all_notes(progress=None):
+    from django_activitypub.delivery import deliver_pending, delivery_workers
+
+    count = tombstone_notes(progress=progress)
+    # like queue_delivery, leave the deletes to the delivery workers when they run
+    if count and not delivery_workers():
+        run_in_background(deliver_pending)
+    return count
+
+
+def send_old_notes(local_actor, remote_actor, after=None):
+    """
+    Schedule a backfill of local_actor's notes to a new follower, once the queued Delivery with id after (the
+    Accept of the follow) has been sent. Backfills resume from their stored cursor, so calling this again for an
+    unfinished backfill picks up where it left off.
+    """
+    backfill, _ = Backfill.objects.get_or_create(local_actor=local_actor, remote_actor=remote_actor)
+    if not backfill.finished_at:
+        run_in_background(run_backfill, backfill.id, after=after)
+    return backfill
 
 
-def send_old_notes(local_actor, remote_actor): 
-    # TODO: get all public notes and then send to the actor, check if domain exists > check on get or create level
-    actor = local_actor
-    actor_url = local_actor.get_absolute_url()
-    domain = remote_actor.domain
-    inbox = remote_actor.profile.get('inbox')
-    data = {
-        '@context': [
-            'https://www.w3.org/ns/activitystreams',
-            "https://w3id.org/security/v1"
-        ],
-    }
-    # TODO: Filter out m2m in followers that's not added yet - total followers != added followers
-    notes = Note.objects.order_by('-published_at').filter(local_actor=local_actor)
-    for note in notes:
+def run_backfill(backfill_id, chunk_size=BACKFILL_CHUNK_SIZE, sleep=None, after=None):
+    """
+    Deliver a backfill's remaining notes, newest first, within the per-host backfill rate limit. With sleep (the
+    default for inline tasks and commands) it waits for the rate limit in place; in the background it pauses and
+    schedules itself to resume instead, so a shared worker thread isn't held for minutes. Stops for good when the
+    inbox is gone, and pauses when the server errors or refuses us. With after it first waits for that Delivery to
+    be sent, so the follower has the Accept before any notes; it pauses if the Delivery failed.
+    """
+    sleep = run_inline() if sleep is None else sleep
+    backfill = Backfill.objects.select_related('local_actor', 'remote_actor').get(id=backfill_id)
+    accept = Delivery.objects.filter(id=after).values('delivered_at', 'failed').first() if after else None
+    if accept is not None:
+        if accept['failed']:
+            backfill_logger.warning('backfill %s paused, its Accept was not delivered', backfill)
+            return backfill
+        if accept['delivered_at'] is None:
+            if sleep:
+                # inline, the Accept was attempted first and is backing off; activitypub_backfill resumes later
+                backfill_logger.info('backfill %s paused until its Accept is delivered', backfill)
+                return backfill
+            run_later(BACKFILL_ACCEPT_WAIT, run_backfill, backfill_id, chunk_size=chunk_size, after=after)
+            return backfill
+    actor = backfill.local_actor
+    domain = backfill.remote_actor.domain
+    inbox = backfill.remote_actor.inbox
+    rate, capacity = getattr(settings, 'ACTIVITYPUB_BACKFILL_RATE_LIMIT', BACKFILL_RATE_LIMIT)
+    bucket = TokenBucket(CacheBackend(getattr(settings, 'ACTIVITYPUB_RATELIMIT_CACHE', 'default')), 'backfill', rate, capacity)
+
+    for note in backfill.pending_notes().iterator(chunk_size=chunk_size):
+        while wait := bucket.take(domain):
+            if not sleep:
+                backfill_logger.debug(
+                    'backfill %s waiting %.1fs for the rate limit', backfill, wait, extra={'host': domain},
+                )
+                run_later(wait, run_backfill, backfill_id, chunk_size=chunk_size)
+                return backfill
+            time.sleep(wait)
+
+        data = {
+            '@context': [
+                'https://www.w3.org/ns/activitystreams',
+                "https://w3id.org/security/v1"
+            ],
+        }
         data.update(note.as_json(mode='update', base_url=f'https://{domain}'))
         data['object']['tag'] = list(parse_mentions(note.content)) + list(parse_hashtags(note.content, domain))
         try:
-            resp = signed_post(
-                inbox,
-                actor.private_key.encode('utf-8'),
-                f'{actor_url}#main-key',
-                body=json.dumps(data)
-            )
+            resp = actor_signed_post(actor, inbox, body=dumps(data))
             resp.raise_for_status()
-            print(f'send_old_notes - {remote_actor.__str__()} - {resp.status_code}')
-        except Exception as e: 
-            # TODO: gracefully handle deleted followers so replies stay
-            # if re.findall(r'Not Found', str(e)):
-            #     follower.delete()
-            print(str(e))
+            backfill_logger.debug('note %s delivered to %s', note.id, backfill.remote_actor, extra={'host': domain, 'status': resp.status_code})
+        except requests.HTTPError as e:
+            status = e.response.status_code
+            if status in (404, 410):
+                # the inbox is gone, so every remaining note would fail the same way
+                backfill_logger.warning('backfill %s stopped, inbox gone: %s', backfill, e, extra={'host': domain})
+                backfill.finished_at = timezone.now()
+                backfill.save(update_fields=['finished_at', 'updated_at'])
+                return backfill
+            if status >= 500 or status in (401, 403, 429):
+                # leave the cursor in place so the backfill can be resumed later
+                backfill_logger.warning('backfill %s paused: %s', backfill, e, extra={'host': domain})
+                return backfill
+            backfill_logger.info('note %s skipped: %s', note.id, e, extra={'host': domain})
+        except requests.RequestException as e:
+            backfill_logger.warning('backfill %s paused: %s', backfill, e, extra={'host': domain})
+            return backfill
+
+        backfill.cursor_published_at = note.published_at
+        backfill.cursor_id = note.id
+        backfill.save(update_fields=['cursor_published_at', 'cursor_id', 'updated_at'])
+
+    backfill.finished_at = timezone.now()
+    backfill.save(update_fields=['finished_at', 'updated_at'])
+    backfill_logger.info('backfill %s finished', backfill, extra={'host': domain})
+    return backfill
 
 
 def send_follow(local_actor, remote_actor):
@@ -681,12 +1270,7 @@ def send_follow(local_actor, remote_actor):
         "actor": local_actor.get_absolute_url(),
         "object": remote_actor.get_absolute_url(),
     }
-    resp = signed_post(
-        remote_actor.profile.get('inbox'),
-        local_actor.private_key.encode('utf-8'),
-        f'{local_actor.get_absolute_url()}#main-key',
-        body=json.dumps(data)
-    )
+    resp = actor_signed_post(local_actor, remote_actor.inbox, body=dumps(data))
     resp.raise_for_status()
     Following.objects.get_or_create(remote_actor=remote_actor, following=local_actor)
 
@@ -704,12 +1288,7 @@ def send_unfollow(local_actor, remote_actor):
             "object": remote_actor.get_absolute_url()
         }
     }
-    resp = signed_post(
-        remote_actor.profile.get('inbox'),
-        local_actor.private_key.encode('utf-8'),
-        f'{local_actor.get_absolute_url()}#main-key',
-        body=json.dumps(data)
-    )
+    resp = actor_signed_post(local_actor, remote_actor.inbox, body=dumps(data))
     resp.raise_for_status()
     if Following.objects.filter(following=local_actor, remote_actor=remote_actor):
         Following.objects.get(following=local_actor, remote_actor=remote_actor).delete()
@@ -729,9 +1308,7 @@ def send_update_profile(local_actor):
     
 
 def get_object(url):
-    resp = requests.get(url, headers={'Accept': 'application/activity+json'})
-    resp.raise_for_status()
-    return resp.json()
+    return RemoteObject.objects.fetch(url)
 
     
 def get_with_url(url):
@@ -745,7 +1322,7 @@ def note_dispatch(sender, instance, created, **kwargs):
     if not instance.tombstone and instance.local_actor and instance.federate or instance.update:
         def process_note():
             if instance.update:
-                send_update_note_to_followers(instance.local_actor)
+                send_update_note_to_followers(instance)
             else:
                 send_create_note_to_followers(instance)
             instance.update = False
@@ -754,6 +1331,41 @@ def note_dispatch(sender, instance, created, **kwargs):
             instance.save(update_fields=["federate"])
         transaction.on_commit(process_note)
 
+@receiver(post_save, sender=Note)
+def note_hashtag_index(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and not {'content', 'tombstone', 'published_at'} & set(update_fields):
+        return
+    index_note(instance)
+
+@receiver(post_save, sender=LocalActor)
+@receiver(post_delete, sender=LocalActor)
+def localActor_webfinger_invalidate(sender, instance, **kwargs):
+    invalidate_webfinger_cache()
+
+
+@receiver(post_save, sender=Follower)
+def follower_digest_add(sender, instance, created, **kwargs):
+    if created:
+        follower_changed(instance, added=True)
+
+@receiver(post_delete, sender=Follower)
+def follower_digest_remove(sender, instance, **kwargs):
+    follower_changed(instance, added=False)
+
+@receiver(m2m_changed, sender=Follower)
+def follower_digest_bulk_add(sender, instance, action, reverse, pk_set, **kwargs):
+    # add() inserts the rows without post_save, so rebuild the digests it touched
+    if action != 'post_add' or not pk_set:
+        return
+    if isinstance(instance, RemoteActor):
+        for local_actor in LocalActor.objects.filter(id__in=pk_set):
+            build_digest(local_actor, uri_host(instance.url))
+    else:
+        urls = RemoteActor.objects.filter(id__in=pk_set).values_list('url', flat=True)
+        for host in {uri_host(url) for url in urls}:
+            build_digest(instance, host)
+
+
 @receiver(post_save, sender=ImageAttachment)
 def imageAttachment_note_add(sender, instance, created, **kwargs):
     if instance.note:  
@@ -767,8 +1379,8 @@ def imageAttachment_note_del(sender, instance, **kwargs):
 @receiver(m2m_changed, sender=Note.attachments.through)
 def imageAttachment_note(sender, instance, action, reverse, pk_set, **kwargs):
     if action == "post_add":
-        print(f"Attachments {pk_set} added to Note {instance.id}")
+        models_logger.debug('attachments %s added to note %s', pk_set, instance.id)
     elif action == "post_remove":
-        print(f"Attachments {pk_set} removed from Note {instance.id}")
+        models_logger.debug('attachments %s removed from note %s', pk_set, instance.id)
     elif action == "post_clear":
-        print(f"All attachments removed from Note {instance.id}")
\ No newline at end of file
+        models_logger.debug('all attachments removed from note %s', instance.id)
\ No newline at end of file
@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Count, Q
+from django.utils import timezone
+
+NODEINFO_USAGE_KEY = 'ap-nodeinfo:usage'
+# the snapshot outlives a missed run of activitypub_nodeinfo, but is rebuilt on demand eventually
+NODEINFO_USAGE_TIMEOUT = 24 * 60 * 60
+ACTIVE_MONTH = timedelta(days=30)
+ACTIVE_HALFYEAR = timedelta(days=180)
+
+DEFAULT_SOFTWARE = {
+    'name': 'django-activitypub',
+    'version': '0.0.2',
+}
+
+
+def nodeinfo_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_NODEINFO_CACHE', 'default')]
+
+
+def compute_usage(now=None):
+    """
+    Count local users and notes. A user is active if they published a note in the period.
+    """
+    from django_activitypub.models import LocalActor, Note
+
+    now = now or timezone.now()
+    users = LocalActor.objects.aggregate(
+        total=Count('id', distinct=True),
+        activeHalfyear=Count('id', distinct=True, filter=Q(notes__published_at__gte=now - ACTIVE_HALFYEAR)),
+        activeMonth=Count('id', distinct=True, filter=Q(notes__published_at__gte=now - ACTIVE_MONTH)),
+    )
+    notes = Note.objects.filter(local_actor__isnull=False, tombstone=False).aggregate(
+        localPosts=Count('id', filter=Q(parent__isnull=True)),
+        localComments=Count('id', filter=Q(parent__isnull=False)),
+    )
+    return {'users': users, **notes}
+
+
+def update_usage():
+    """
+    Recompute the usage statistics and store the snapshot served by the nodeinfo view.
+    """
+    usage = compute_usage()
+    nodeinfo_cache().set(
+        NODEINFO_USAGE_KEY, usage,
+        getattr(settings, 'ACTIVITYPUB_NODEINFO_USAGE_TIMEOUT', NODEINFO_USAGE_TIMEOUT),
+    )
+    return usage
+
+
+def get_usage():
+    usage = nodeinfo_cache().get(NODEINFO_USAGE_KEY)
+    if usage is None:
+        usage = update_usage()
+    return usage
+
+
+def nodeinfo_document(usage):
+    """
+    Builds a nodeinfo 2.0 document from ACTIVITYPUB_NODEINFO, which may set software, services,
+    openRegistrations and metadata.
+    """
+    config = getattr(settings, 'ACTIVITYPUB_NODEINFO', {})
+    return {
+        'version': '2.0',
+        'software': {**DEFAULT_SOFTWARE, **config.get('software', {})},
+        'protocols': ['activitypub'],
+        'services': config.get('services', {'inbound': [], 'outbound': []}),
+        'openRegistrations': config.get('openRegistrations', False),
+        'usage': usage,
+        'metadata': config.get('metadata', {}),
+    }
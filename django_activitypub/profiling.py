@@ -0,0 +1,157 @@
+import logging
+import time
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# profiles can nest (a query budget inside the middleware), so keep all of the active ones
+_active = ContextVar('activitypub_profiles', default=())
+_serialize_depth = ContextVar('activitypub_serialize_depth', default=0)
+
+
+class Profile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = 0
+        self.query_time = 0.0
+        self.http_calls = 0
+        self.http_time = 0.0
+        self.serialize_time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - start
+
+    @property
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self):
+        return ', '.join([
+            f'total;dur={self.elapsed * 1000:.1f}',
+            f'db;dur={self.query_time * 1000:.1f};desc="{self.queries} queries"',
+            f'http;dur={self.http_time * 1000:.1f};desc="{self.http_calls} calls"',
+            f'serialize;dur={self.serialize_time * 1000:.1f}',
+        ])
+
+
+@contextmanager
+def profile():
+    """
+    Record the database queries, outbound HTTP calls and serialization time of the enclosed block.
+    """
+    current = Profile()
+    token = _active.set(_active.get() + (current,))
+    try:
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(current))
+            yield current
+    finally:
+        _active.reset(token)
+
+
+def record_http(elapsed):
+    for current in _active.get():
+        current.http_calls += 1
+        current.http_time += elapsed
+
+
+@contextmanager
+def serializing():
+    if not _active.get():
+        yield
+        return
+    token = _serialize_depth.set(_serialize_depth.get() + 1)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        _serialize_depth.reset(token)
+        # nested serializers are already counted by the outermost one
+        if not _serialize_depth.get():
+            for current in _active.get():
+                current.serialize_time += time.perf_counter() - start
+
+
+def timed_serializer(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        with serializing():
+            return fn(*args, **kwargs)
+    return wrapper
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+def query_budget(queries):
+    """
+    Declare the maximum number of database queries a view may run. When ACTIVITYPUB_ENFORCE_QUERY_BUDGETS is
+    set (e.g. in test settings) going over the budget raises QueryBudgetExceeded; otherwise the profiling
+    middleware logs a warning.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not getattr(settings, 'ACTIVITYPUB_ENFORCE_QUERY_BUDGETS', False):
+                return view(request, *args, **kwargs)
+            with profile() as current:
+                response = view(request, *args, **kwargs)
+            if current.queries > queries:
+                raise QueryBudgetExceeded(
+                    f'{view.__name__} ran {current.queries} queries, over its budget of {queries}'
+                )
+            return response
+        wrapper.query_budget = queries
+        return wrapper
+    return decorator
+
+
+class ProfilingMiddleware:
+    """
+    Opt-in middleware timing the django_activitypub views. Adds a Server-Timing header with the wall time,
+    query count and time, outbound HTTP calls and serialization time, and logs the same values.
+    """
+    sync_capable = True
+    async_capable = False
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with profile() as current:
+            response = self.get_response(request)
+
+        match = request.resolver_match
+        if not match or not (match.url_name or '').startswith('activitypub-'):
+            return response
+
+        response['Server-Timing'] = current.server_timing()
+        budget = getattr(match.func, 'query_budget', None)
+        log = logger.warning if budget is not None and current.queries > budget else logger.info
+        log(
+            '%s %s: %.1fms, %d queries', request.method, match.url_name, current.elapsed * 1000, current.queries,
+            extra={
+                'view': match.url_name,
+                'status': response.status_code,
+                'duration': current.elapsed,
+                'queries': current.queries,
+                'query_budget': budget,
+                'query_time': current.query_time,
+                'http_calls': current.http_calls,
+                'http_time': current.http_time,
+                'serialize_time': current.serialize_time,
+            },
+        )
+        return response
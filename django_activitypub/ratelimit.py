@@ -0,0 +1,308 @@
+import ipaddress
+import math
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from urllib.parse import urlparse
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+
+from django_activitypub.signed_requests import signature_key_id
+
+# (tokens per second, bucket capacity)
+DEFAULT_RATE_LIMITS = {
+    'address': (10.0, 300),
+    'domain': (5.0, 200),
+    'actor': (1.0, 30),
+}
+# charged before the signature is checked; the domain and actor a request claims are only charged once it verifies,
+# so forged keyIds can't use up a real server's budget
+UNVERIFIED_BUCKETS = ('address',)
+DEFAULT_MAX_BODY_SIZE = 1024 * 1024
+DEFAULT_MAX_CONCURRENT_PER_ADDRESS = 4
+SLOT_TIMEOUT = 60
+
+
+class MemoryBackend:
+    """
+    Process-local storage for rate limit state, used in tests and single-process deployments.
+    """
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        value, expires = self._data.get(key, (None, 0))
+        if expires < time.monotonic():
+            self._data.pop(key, None)
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def set(self, key, value, timeout):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + timeout)
+
+    def incr(self, key, delta, timeout):
+        with self._lock:
+            value = (self._get(key) or 0) + delta
+            self._data[key] = (value, time.monotonic() + timeout)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+class CacheBackend:
+    """
+    Rate limit state shared between processes through a Django cache.
+    """
+    def __init__(self, alias='default'):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value, timeout):
+        self.cache.set(key, value, timeout)
+
+    def incr(self, key, delta, timeout):
+        self.cache.add(key, 0, timeout)
+        try:
+            return self.cache.incr(key, delta)
+        except ValueError:  # expired between add() and incr()
+            self.cache.set(key, delta, timeout)
+            return delta
+
+
+class TokenBucket:
+    def __init__(self, backend, name, rate, capacity):
+        self.backend = backend
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity)
+
+    def take(self, key, tokens=1, now=None):
+        """
+        Take tokens from the bucket for key. Returns 0 when allowed, otherwise the number of
+        seconds until enough tokens are available.
+        """
+        now = time.time() if now is None else now
+        cache_key = f'ap-rl:{self.name}:{key}'
+        state = self.backend.get(cache_key)
+        if state is None:
+            available, updated = self.capacity, now
+        else:
+            available, updated = state
+            available = min(self.capacity, available + (now - updated) * self.rate)
+
+        if available >= tokens:
+            retry_after = 0.0
+            available -= tokens
+        else:
+            retry_after = (tokens - available) / self.rate
+
+        # keep the state around for as long as it takes to refill completely
+        timeout = max(1, math.ceil((self.capacity - available) / self.rate))
+        self.backend.set(cache_key, (available, now), timeout)
+        return retry_after
+
+
+def trusted_proxies():
+    """
+    The networks of the reverse proxies in front of the site (ACTIVITYPUB_TRUSTED_PROXIES, addresses or CIDR
+    ranges), whose X-Forwarded-For headers are believed.
+    """
+    return [ipaddress.ip_network(proxy, strict=False) for proxy in getattr(settings, 'ACTIVITYPUB_TRUSTED_PROXIES', ())]
+
+
+def is_trusted(address, proxies):
+    try:
+        address = ipaddress.ip_address(address)
+    except ValueError:
+        return False
+    return any(address in network for network in proxies)
+
+
+class InboxRateLimiter:
+    def __init__(self, backend=None):
+        self._backend = backend
+
+    @property
+    def backend(self):
+        if self._backend is None:
+            self._backend = CacheBackend(getattr(settings, 'ACTIVITYPUB_RATELIMIT_CACHE', 'default'))
+        return self._backend
+
+    @property
+    def max_body_size(self):
+        return getattr(settings, 'ACTIVITYPUB_INBOX_MAX_BODY_SIZE', DEFAULT_MAX_BODY_SIZE)
+
+    @property
+    def max_concurrent(self):
+        return getattr(settings, 'ACTIVITYPUB_INBOX_MAX_CONCURRENT_PER_ADDRESS', DEFAULT_MAX_CONCURRENT_PER_ADDRESS)
+
+    def buckets(self):
+        limits = {**DEFAULT_RATE_LIMITS, **getattr(settings, 'ACTIVITYPUB_INBOX_RATE_LIMITS', {})}
+        return {
+            name: TokenBucket(self.backend, f'inbox-{name}', rate, capacity)
+            for name, (rate, capacity) in limits.items()
+        }
+
+    @staticmethod
+    def address(request):
+        """
+        The address a request came from. Behind the reverse proxies in ACTIVITYPUB_TRUSTED_PROXIES that is the
+        nearest X-Forwarded-For hop they didn't add themselves; X-Forwarded-For is ignored unless it is set.
+        """
+        address = request.META.get('REMOTE_ADDR', 'unknown')
+        proxies = trusted_proxies()
+        if not proxies or not is_trusted(address, proxies):
+            return address
+        hops = [hop.strip() for hop in request.META.get('HTTP_X_FORWARDED_FOR', '').split(',') if hop.strip()]
+        for hop in reversed(hops):
+            if not is_trusted(hop, proxies):
+                return hop
+        return hops[0] if hops else address
+
+    @classmethod
+    def identify(cls, request):
+        """
+        Work out the (domain, actor) a request claims to come from without parsing the body, using the
+        keyId of the Signature header. Unsigned requests are keyed by their remote address. The claim is only
+        trustworthy once the signature has been verified.
+        """
+        key_id = signature_key_id(request.headers)
+        parsed = urlparse(key_id)
+        if parsed.netloc:
+            return parsed.netloc.lower(), key_id.split('#', 1)[0]
+        addr = cls.address(request)
+        return addr, addr
+
+    def check_size(self, request):
+        try:
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            length = 0
+        if length > self.max_body_size:
+            return False
+        return len(request.body) <= self.max_body_size
+
+    def check_rate(self, **keys):
+        """
+        Take a token from the bucket of each name=key given. Returns 0 if the request is within budget, otherwise
+        the number of seconds to wait.
+        """
+        buckets = self.buckets()
+        retry_after = 0.0
+        for name, bucket in buckets.items():
+            if name in keys:
+                retry_after = max(retry_after, bucket.take(keys[name]))
+        return retry_after
+
+    def acquire_slot(self, address):
+        """
+        Takes one of the concurrent processing slots of a remote address. Returns False if they were all in use;
+        the slot must be given back with release_slot either way.
+        """
+        return self.backend.incr(f'ap-rl:inbox-slots:{address}', 1, SLOT_TIMEOUT) <= self.max_concurrent
+
+    def release_slot(self, address):
+        self.backend.incr(f'ap-rl:inbox-slots:{address}', -1, SLOT_TIMEOUT)
+
+    @contextmanager
+    def slot(self, address):
+        """
+        Holds one of the address's concurrent processing slots. Yields False if they are all in use.
+        """
+        try:
+            yield self.acquire_slot(address)
+        finally:
+            self.release_slot(address)
+
+
+inbox_limiter = InboxRateLimiter()
+
+
+def too_many_requests(retry_after):
+    resp = JsonResponse({'error': 'too many requests'}, status=429)
+    resp['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+
+def admit(request):
+    """
+    Returns (rejection, address), where rejection is the response to send instead of running the view.
+    """
+    if not inbox_limiter.check_size(request):
+        return JsonResponse({'error': 'request body too large'}, status=413), None
+
+    address = inbox_limiter.address(request)
+    if retry_after := inbox_limiter.check_rate(address=address):
+        return too_many_requests(retry_after), address
+    return None, address
+
+
+def admit_verified(request):
+    """
+    Charge the budgets of the domain and actor a request was signed by, once its signature has been verified.
+    Returns the response to send instead of handling the activity, or None.
+    """
+    domain, actor = inbox_limiter.identify(request)
+    if retry_after := inbox_limiter.check_rate(domain=domain, actor=actor):
+        return too_many_requests(retry_after)
+    return None
+
+
+def throttle_inbox(view):
+    """
+    Rejects oversized POST bodies and applies the per-address budget and concurrency slots of inbox_limiter
+    before the view parses or verifies anything. Views call admit_verified() once the signature checks out.
+    Works with sync and async views.
+    """
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def async_wrapper(request, *args, **kwargs):
+            if request.method != 'POST':
+                return await view(request, *args, **kwargs)
+
+            # the limiter state lives in the cache, whose clients are safe to call from any thread
+            rejection, address = await sync_to_async(admit, thread_sensitive=False)(request)
+            if rejection:
+                return rejection
+
+            acquired = await sync_to_async(inbox_limiter.acquire_slot, thread_sensitive=False)(address)
+            try:
+                if not acquired:
+                    return too_many_requests(1)
+                return await view(request, *args, **kwargs)
+            finally:
+                await sync_to_async(inbox_limiter.release_slot, thread_sensitive=False)(address)
+        return markcoroutinefunction(async_wrapper)
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.method != 'POST':
+            return view(request, *args, **kwargs)
+
+        rejection, address = admit(request)
+        if rejection:
+            return rejection
+
+        with inbox_limiter.slot(address) as acquired:
+            if not acquired:
+                return too_many_requests(1)
+            return view(request, *args, **kwargs)
+    return wrapper
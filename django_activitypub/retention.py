@@ -0,0 +1,264 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+
+from django_activitypub.encoding import dumps
+
+# days after which inactive remote threads and unreferenced remote actors are removed; None keeps them forever
+REMOTE_NOTE_RETENTION_DAYS = 180
+REMOTE_ACTOR_RETENTION_DAYS = 30
+# days after which cached remote objects are removed, fresh or not
+REMOTE_OBJECT_RETENTION_DAYS = 7
+# days processed inbox items are kept for inspection
+INBOX_ITEM_RETENTION_DAYS = 7
+RETENTION_BATCH_SIZE = 100
+# parent ids per query while walking subtrees, below SQLite's limit on query parameters
+WALK_CHUNK_SIZE = 500
+
+
+def note_retention_days():
+    return getattr(settings, 'ACTIVITYPUB_REMOTE_NOTE_RETENTION_DAYS', REMOTE_NOTE_RETENTION_DAYS)
+
+
+def actor_retention_days():
+    return getattr(settings, 'ACTIVITYPUB_REMOTE_ACTOR_RETENTION_DAYS', REMOTE_ACTOR_RETENTION_DAYS)
+
+
+def object_retention_days():
+    return getattr(settings, 'ACTIVITYPUB_REMOTE_OBJECT_RETENTION_DAYS', REMOTE_OBJECT_RETENTION_DAYS)
+
+
+def inbox_item_retention_days():
+    return getattr(settings, 'ACTIVITYPUB_INBOX_ITEM_RETENTION_DAYS', INBOX_ITEM_RETENTION_DAYS)
+
+
+def prune_replies_to_local():
+    # remote replies to local notes are part of local threads, so they are only pruned on request
+    return getattr(settings, 'ACTIVITYPUB_PRUNE_REPLIES_TO_LOCAL', False)
+
+
+def subtree_roots(cutoff, replies_to_local=None):
+    """
+    Old remote notes at the top of a remote-only thread. With replies_to_local (ACTIVITYPUB_PRUNE_REPLIES_TO_LOCAL)
+    remote replies to local notes count as roots too, so the branches under local notes are pruned as well.
+    """
+    from django_activitypub.models import Note
+
+    replies_to_local = prune_replies_to_local() if replies_to_local is None else replies_to_local
+    top = Q(parent__isnull=True)
+    if replies_to_local:
+        top |= Q(parent__local_actor__isnull=False)
+    return Note.objects.filter(remote_actor__isnull=False, published_at__lt=cutoff, updated_at__lt=cutoff).filter(top)
+
+
+def take_level(children, cutoff, root_of, members, blocked):
+    """
+    Assign one level of (id, parent id, local actor id, published, updated) children to the subtrees of their
+    parents' roots in members, blocking a root when a child is local or active since cutoff. Returns the ids to
+    descend into next.
+    """
+    frontier = []
+    for note_id, parent_id, local_actor_id, published_at, updated_at in children:
+        root = root_of[parent_id]
+        if root in blocked:
+            continue
+        if local_actor_id is not None or max(published_at, updated_at) >= cutoff:
+            blocked.add(root)
+            continue
+        root_of[note_id] = root
+        members[root].append(note_id)
+        frontier.append(note_id)
+    return frontier
+
+
+def walk_subtrees(roots, cutoff):
+    """
+    Walk the subtrees under roots one level at a time, rather than with a recursive query per root. Returns
+    ({root: [note ids]}, blocked), where blocked holds the roots with a local note or activity since cutoff below them.
+    Each level is locked as it is read, so together with locked roots no reply can be attached anywhere in the
+    subtrees until the transaction this runs in ends.
+    """
+    from django_activitypub.models import Note
+
+    members = {root: [root] for root in roots}
+    root_of = {root: root for root in roots}
+    blocked = set()
+    frontier = list(roots)
+    while frontier:
+        children = []
+        for start in range(0, len(frontier), WALK_CHUNK_SIZE):
+            children.extend(
+                Note.objects.select_for_update().filter(parent_id__in=frontier[start:start + WALK_CHUNK_SIZE])
+                .values_list('id', 'parent_id', 'local_actor_id', 'published_at', 'updated_at')
+            )
+        frontier = take_level(children, cutoff, root_of, members, blocked)
+    return members, blocked
+
+
+def archive_notes(note_ids, archive):
+    """
+    Write notes to archive as JSON lines, so pruned threads can be kept outside the database.
+    """
+    from django_activitypub.models import Note
+
+    notes = Note.objects.filter(id__in=note_ids).order_by('id').values(
+        'id', 'parent_id', 'content_url', 'remote_actor__url', 'published_at', 'updated_at', 'content', 'tombstone',
+    )
+    for note in notes:
+        archive.write(dumps(note) + b'\n')
+
+
+def prune_remote_notes(
+    days=None, batch_size=RETENTION_BATCH_SIZE, dry_run=False, archive=None, progress=None, replies_to_local=None,
+):
+    """
+    Delete remote-only subtrees of replies with no activity for days (ACTIVITYPUB_REMOTE_NOTE_RETENTION_DAYS) and
+    no local note in them, a batch of subtrees per transaction. archive is an optional binary file the notes are
+    written to first. replies_to_local is passed on to subtree_roots. Returns (subtrees, notes) removed, or that
+    would be with dry_run.
+    """
+    from django_activitypub.models import Note
+
+    days = note_retention_days() if days is None else days
+    if days is None:
+        return 0, 0
+    cutoff = timezone.now() - timedelta(days=days)
+    roots = subtree_roots(cutoff, replies_to_local)
+    total = roots.count()
+    last_id = 0
+    subtrees = notes = done = 0
+    while True:
+        batch = list(roots.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            break
+        with transaction.atomic():
+            # lock the roots and then, level by level, the notes below them, so no reply can be attached while the
+            # batch is walked; the roots are checked again once locked, in case one changed since it was listed
+            locked = list(Note.objects.select_for_update().filter(id__in=batch).values_list('id', flat=True))
+            members, blocked = walk_subtrees(list(roots.filter(id__in=locked).values_list('id', flat=True)), cutoff)
+            note_ids = [note_id for root, ids in members.items() if root not in blocked for note_id in ids]
+            if note_ids and not dry_run:
+                if archive is not None:
+                    archive_notes(note_ids, archive)
+                Note.objects.filter(id__in=note_ids).delete()
+        subtrees += len(members) - len(blocked)
+        notes += len(note_ids)
+        last_id = batch[-1]
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    return subtrees, notes
+
+
+def unreferenced_actors(cutoff):
+    """
+    Remote actors not seen since cutoff that nothing refers to: no follows either way, likes, announces, notes or
+    unfinished backfills.
+    """
+    from django_activitypub.models import Backfill, Follower, Following, Note, RemoteActor
+
+    actor = OuterRef('pk')
+    return RemoteActor.objects.filter(Q(updated_at__isnull=True) | Q(updated_at__lt=cutoff)).filter(
+        ~Exists(Follower.objects.filter(remote_actor=actor)),
+        ~Exists(Following.objects.filter(remote_actor=actor)),
+        ~Exists(Note.objects.filter(remote_actor=actor)),
+        ~Exists(Note.likes.through.objects.filter(remoteactor=actor)),
+        ~Exists(Note.announces.through.objects.filter(remoteactor=actor)),
+        ~Exists(Backfill.objects.filter(remote_actor=actor, finished_at__isnull=True)),
+    )
+
+
+def prune_remote_actors(days=None, batch_size=RETENTION_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Delete remote actors nothing has referred to for days (ACTIVITYPUB_REMOTE_ACTOR_RETENTION_DAYS), a batch per
+    transaction. Returns the number removed, or that would be with dry_run.
+    """
+    from django_activitypub.models import RemoteActor
+
+    days = actor_retention_days() if days is None else days
+    if days is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    candidates = unreferenced_actors(cutoff)
+    total = candidates.count()
+    last_id = 0
+    removed = done = 0
+    while True:
+        batch = list(candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            break
+        if dry_run:
+            removed += len(batch)
+        else:
+            with transaction.atomic():
+                # checked again as part of the delete, in case one was followed or liked in the meantime
+                removed += unreferenced_actors(cutoff).filter(id__in=batch).delete()[1].get(RemoteActor._meta.label, 0)
+        last_id = batch[-1]
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    return removed
+
+
+def prune_remote_objects(days=None, batch_size=RETENTION_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Delete cached remote objects fetched more than days (ACTIVITYPUB_REMOTE_OBJECT_RETENTION_DAYS) ago, a batch per
+    transaction. Returns the number removed, or that would be with dry_run.
+    """
+    from django_activitypub.models import RemoteObject
+
+    days = object_retention_days() if days is None else days
+    if days is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    candidates = RemoteObject.objects.filter(fetched_at__lt=cutoff)
+    total = candidates.count()
+    last_id = 0
+    removed = done = 0
+    while True:
+        batch = list(candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            break
+        if dry_run:
+            removed += len(batch)
+        else:
+            # checked again as part of the delete, in case one was fetched again in the meantime
+            removed += candidates.filter(id__in=batch).delete()[0]
+        last_id = batch[-1]
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    return removed
+
+
+def prune_inbox_items(days=None, batch_size=RETENTION_BATCH_SIZE, dry_run=False, progress=None):
+    """
+    Delete queued inbox items processed more than days (ACTIVITYPUB_INBOX_ITEM_RETENTION_DAYS) ago, a batch per
+    transaction. Items still waiting to be verified are kept. Returns the number removed, or that would be with dry_run.
+    """
+    from django_activitypub.models import InboxItem
+
+    days = inbox_item_retention_days() if days is None else days
+    if days is None:
+        return 0
+    cutoff = timezone.now() - timedelta(days=days)
+    candidates = InboxItem.objects.filter(processed_at__lt=cutoff)
+    total = candidates.count()
+    last_id = 0
+    removed = done = 0
+    while True:
+        batch = list(candidates.filter(id__gt=last_id).order_by('id').values_list('id', flat=True)[:batch_size])
+        if not batch:
+            break
+        if dry_run:
+            removed += len(batch)
+        else:
+            removed += InboxItem.objects.filter(id__in=batch).delete()[0]
+        last_id = batch[-1]
+        done += len(batch)
+        if progress:
+            progress(done, total)
+    return removed
@@ -1,29 +1,84 @@
 import base64
 import hashlib
+import math
+import re
+import time
 from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
 from datetime import datetime, timezone
 from urllib.parse import urlparse
 from cryptography.exceptions import InvalidSignature
 from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.primitives.asymmetric import padding, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric import padding, ec, ed25519, rsa
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
 from cryptography.hazmat.primitives.serialization import load_pem_private_key, load_pem_public_key
-import requests
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_activitypub import client, keys, metrics
+from django_activitypub.utils.lru import LRUCache
+
+# how old a signed Date may be, and how far ahead of our clock, in seconds
+SIGNATURE_MAX_AGE = 60 * 60
+SIGNATURE_CLOCK_SKEW = 5 * 60
+REPLAY_CACHE_SIZE = 100_000
+
+# draft-cavage-http-signatures, which every ActivityPub server understands, and RFC 9421 message signatures
+CAVAGE = 'cavage'
+RFC9421 = 'rfc9421'
+DEFAULT_SIGNATURE_SCHEMES = (RFC9421, CAVAGE)
+SIGNATURE_SCHEME_TIMEOUT = 24 * 60 * 60
+# responses that mean the signature itself was refused, so the next scheme is worth a try
+REFUSED_STATUSES = (400, 401, 403)
+
+SIGNATURE_INPUT_RE = re.compile(r'\s*([a-z0-9_.*-]+)=(\(([^)]*)\)((?:;[a-z0-9_.*-]+=(?:"[^"]*"|[^;,]*))*))')
+SIGNATURE_PARAM_RE = re.compile(r';([a-z0-9_.*-]+)=("[^"]*"|[^;,]*)')
 
 
 def get_gmt_now() -> str:
     return datetime.now(timezone.utc).strftime("%a, %d %b %Y %H:%M:%S GMT")
 
 
-def sign_message(private_key, message):
-    key = load_pem_private_key(private_key, password=None)
+@metrics.register_lru_cache('private_key')
+@lru_cache(maxsize=64)
+def load_private_key(private_key):
+    return load_pem_private_key(private_key, password=None)
 
-    return base64.standard_b64encode(
-        key.sign(
-            message.encode("utf-8"),
-            padding.PKCS1v15(),
-            hashes.SHA256(),
-        )
-    ).decode("utf-8")
+
+def sign_message(private_key, message, raw_ecdsa=False):
+    """
+    Sign message with an RSA, Ed25519 or ECDSA key. RFC 9421 wants ECDSA signatures as raw r || s rather than DER.
+    """
+    key = load_private_key(private_key)
+    data = message.encode("utf-8")
+
+    if isinstance(key, rsa.RSAPrivateKey):
+        signature = key.sign(data, padding.PKCS1v15(), hashes.SHA256())
+    elif isinstance(key, ed25519.Ed25519PrivateKey):
+        signature = key.sign(data)
+    elif isinstance(key, ec.EllipticCurvePrivateKey):
+        signature = key.sign(data, ec.ECDSA(hashes.SHA256()))
+        if raw_ecdsa:
+            size = (key.curve.key_size + 7) // 8
+            r, s = decode_dss_signature(signature)
+            signature = r.to_bytes(size, 'big') + s.to_bytes(size, 'big')
+    else:
+        raise ValueError(f'unsupported private key type: {type(key)}')
+
+    return base64.standard_b64encode(signature).decode("utf-8")
+
+
+def signature_algorithm(private_key, scheme=CAVAGE):
+    key = load_private_key(private_key)
+    if isinstance(key, rsa.RSAPrivateKey):
+        return 'rsa-sha256' if scheme == CAVAGE else 'rsa-v1_5-sha256'
+    if scheme == CAVAGE:
+        return 'hs2019'
+    if isinstance(key, ed25519.Ed25519PrivateKey):
+        return 'ed25519'
+    return 'ecdsa-p256-sha256'
 
 
 class HttpSignature:
@@ -38,7 +93,7 @@ class HttpSignature:
 
         signature_parts = [
             f'keyId="{key_id}"',
-            'algorithm="rsa-sha256"',
+            f'algorithm="{signature_algorithm(private_key)}"',
             f'headers="{headers}"',
             f'signature="{signature_string}"',
         ]
@@ -53,6 +108,40 @@ class HttpSignature:
         return self
 
 
+class MessageSignature:
+    """
+    An RFC 9421 signature over derived components such as @method and @target-uri, and header fields.
+    """
+    def __init__(self, label='sig1'):
+        self.label = label
+        self.components = []
+
+    def with_component(self, name, value):
+        self.components.append((name, value))
+        return self
+
+    def signature_params(self, key_id, algorithm, created):
+        names = " ".join(f'"{name}"' for name, _ in self.components)
+        return f'({names});created={created};keyid="{key_id}";alg="{algorithm}"'
+
+    def build_message(self, signature_params):
+        lines = [f'"{name}": {value}' for name, value in self.components]
+        lines.append(f'"@signature-params": {signature_params}')
+        return "\n".join(lines)
+
+    def build_headers(self, key_id, private_key, created=None):
+        """
+        Returns the Signature-Input and Signature headers.
+        """
+        created = int(time.time()) if created is None else created
+        params = self.signature_params(key_id, signature_algorithm(private_key, RFC9421), created)
+        signature_string = sign_message(private_key, self.build_message(params), raw_ecdsa=True)
+        return {
+            "signature-input": f"{self.label}={params}",
+            "signature": f"{self.label}=:{signature_string}:",
+        }
+
+
 def content_digest_sha256(content):
     if isinstance(content, str):
         content = content.encode("utf-8")
@@ -61,6 +150,33 @@ def content_digest_sha256(content):
     return "SHA-256=" + digest
 
 
+def content_digest_rfc9530(content):
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    digest = base64.standard_b64encode(hashlib.sha256(content).digest()).decode("utf-8")
+    return f"sha-256=:{digest}:"
+
+
+def check_content_digest(header, content):
+    """
+    Check a Content-Digest header against content. At least one of the digests must be one we support, and every
+    one we support must match.
+    """
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+
+    checked = False
+    for algorithm, value in re.findall(r'([a-z0-9-]+)=:([A-Za-z0-9+/=]*):', header):
+        name = {'sha-256': 'sha256', 'sha-512': 'sha512'}.get(algorithm)
+        if name is None:
+            continue
+        if base64.standard_b64encode(hashlib.new(name, content).digest()).decode("utf-8") != value:
+            return False
+        checked = True
+    return checked
+
+
 def build_signature(host, method, target):
     return (
         HttpSignature()
@@ -69,8 +185,20 @@ def build_signature(host, method, target):
     )
 
 
-def signed_post(url, private_key, public_key_url, headers=None, body='', method='post'):
-    headers = {} if headers is None else headers
+def build_message_signature(method, url):
+    return (
+        MessageSignature()
+        .with_component("@method", method.upper())
+        .with_component("@target-uri", url)
+    )
+
+
+def signed_post(url, private_key, public_key_url, headers=None, body='', method='post', scheme=CAVAGE):
+    """
+    Send a request signed with private_key. Any headers passed in are sent and covered by the signature.
+    """
+    extra = {name.lower(): value for name, value in (headers or {}).items()}
+    headers = dict(extra)
 
     parsed_url = urlparse(url)
     host = parsed_url.netloc
@@ -90,27 +218,92 @@ def signed_post(url, private_key, public_key_url, headers=None, body='', method=
     #     }
     # })
 
-    digest = content_digest_sha256(body)
-
-    signature_header = (
-        build_signature(host, method, target)
-        .with_field("date", date_header)
-        .with_field("digest", digest)
-        .with_field("content-type", content_type)
-        .build_signature(public_key_url, private_key)
-    )
+    if scheme == RFC9421:
+        digest = content_digest_rfc9530(body)
+        with metrics.timer('activitypub_signing_seconds'):
+            signature = build_message_signature(method, url)
+            if method == 'post':
+                signature.with_component("content-digest", digest).with_component("content-type", content_type)
+            for name, value in extra.items():
+                signature.with_component(name, value)
+            headers.update(signature.build_headers(public_key_url, private_key))
+        headers["content-digest"] = digest
+    else:
+        digest = content_digest_sha256(body)
+        with metrics.timer('activitypub_signing_seconds'):
+            signature = (
+                build_signature(host, method, target)
+                .with_field("date", date_header)
+                .with_field("digest", digest)
+                .with_field("content-type", content_type)
+            )
+            for name, value in extra.items():
+                signature.with_field(name, value)
+            signature_header = signature.build_signature(public_key_url, private_key)
+        headers["digest"] = digest
+        headers["signature"] = signature_header
 
     headers["accept"] = accept
-    headers["digest"] = digest
     headers["date"] = date_header
     headers["host"] = host
     headers["content-type"] = content_type
-    headers["signature"] = signature_header
     headers["user-agent"] = "Finalboss/1.0 (http.requests/2.32.3; +https://iamthefinalboss.com/)"
     if method == 'get':
-        response = requests.get(url, headers=headers)
+        with metrics.remote_fetch('signed') as fetch:
+            response = client.request('get', url, headers=headers)
+            fetch['status'] = response.status_code
     elif method == 'post':
-        response = requests.post(url, data=body, headers=headers)
+        with metrics.delivery() as delivery:
+            response = client.request('post', url, data=body, headers=headers)
+            delivery['status'] = response.status_code
+    return response
+
+
+def signature_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_SIGNATURE_CACHE', 'default')]
+
+
+def replay_cache_backend():
+    return caches[getattr(settings, 'ACTIVITYPUB_REPLAY_CACHE', 'default')]
+
+
+def signature_scheme_key(host):
+    return f'ap-signature-scheme:{host}'
+
+
+def actor_signing_key(actor, scheme):
+    """
+    Returns (private_key, key_id) for signing as actor. RFC 9421 signatures use the actor's Ed25519 key when it
+    has one, since it is much cheaper than RSA; draft-cavage verifiers only know the RSA key.
+    """
+    if scheme == RFC9421 and actor.ed25519_private_key:
+        return actor.ed25519_private_key.encode('utf-8'), f'{actor.get_absolute_url()}#ed25519-key'
+    return actor.private_key.encode('utf-8'), f'{actor.get_absolute_url()}#main-key'
+
+
+def actor_signed_post(actor, url, body='', method='post', headers=None):
+    """
+    signed_post as actor, negotiating the signature scheme per host. Hosts we haven't talked to are sent the
+    preferred scheme first and the next one if they refuse it ("double knocking"); the scheme that worked is
+    remembered, so later requests only knock once.
+    """
+    host = urlparse(url).netloc
+    cache = signature_cache()
+    key = signature_scheme_key(host)
+    schemes = list(getattr(settings, 'ACTIVITYPUB_SIGNATURE_SCHEMES', DEFAULT_SIGNATURE_SCHEMES))
+    known = cache.get(key)
+    if known in schemes:
+        schemes = schemes[schemes.index(known):]
+
+    for scheme in schemes:
+        private_key, key_id = actor_signing_key(actor, scheme)
+        response = signed_post(url, private_key, key_id, headers=headers, body=body, method=method, scheme=scheme)
+        if response.status_code not in REFUSED_STATUSES:
+            break
+
+    # when every scheme was refused the last one is remembered, so refusals for other reasons don't knock twice
+    if scheme != known:
+        cache.set(key, scheme, getattr(settings, 'ACTIVITYPUB_SIGNATURE_SCHEME_TIMEOUT', SIGNATURE_SCHEME_TIMEOUT))
     return response
 
 
@@ -121,6 +314,137 @@ def parse_signature_header(header):
     return parsed
 
 
+def parse_signature_input(header):
+    """
+    Parse the first signature of a Signature-Input header into (label, components, params, signature_params),
+    where signature_params is the serialized value the signature base ends with.
+    """
+    match = SIGNATURE_INPUT_RE.match(header)
+    if match is None:
+        raise ValueError('malformed Signature-Input header')
+    label, signature_params, components, params = match.groups()
+    params = {name: value.strip('"') for name, value in SIGNATURE_PARAM_RE.findall(params)}
+    return label, re.findall(r'"([^"]+)"', components), params, signature_params
+
+
+def parse_signature_value(header, label):
+    match = re.search(rf'(?:^|,)\s*{re.escape(label)}=:([A-Za-z0-9+/=]*):', header)
+    if match is None:
+        raise ValueError(f'no signature labelled {label}')
+    return base64.standard_b64decode(match.group(1))
+
+
+def signature_key_id(headers):
+    """
+    The keyId a request claims to be signed with, in either scheme, without verifying anything.
+    """
+    try:
+        if 'signature-input' in headers:
+            return parse_signature_input(headers['signature-input'])[2].get('keyid', '')
+        if 'signature' in headers:
+            return parse_signature_header(headers['signature']).get('keyId', '')
+    except (IndexError, ValueError):
+        pass
+    return ''
+
+
+def component_value(name, method, url, headers):
+    parsed = urlparse(url)
+    if name == '@method':
+        return method.upper()
+    if name == '@target-uri':
+        return url
+    if name == '@authority':
+        return parsed.netloc.lower()
+    if name == '@scheme':
+        return parsed.scheme
+    if name == '@path':
+        return parsed.path
+    if name == '@query':
+        return f'?{parsed.query}'
+    if name == '@request-target':
+        return f'{parsed.path}?{parsed.query}' if parsed.query else parsed.path
+    value = headers.get(name)
+    return value.strip() if value is not None else None
+
+
+class ReplayCache:
+    """
+    Remembers verified signatures until their Date falls out of the accepted window, so each is only accepted once.
+    A bounded LRU in the process catches most replays without a round trip; the ACTIVITYPUB_REPLAY_CACHE cache
+    catches those sent to another process, as long as it is a cache the processes share.
+    """
+    def __init__(self, maxsize):
+        self.local = LRUCache(maxsize)
+
+    @staticmethod
+    def cache_key(key):
+        key_id, digest = key
+        return 'ap-replay:' + hashlib.sha256(key_id.encode('utf-8') + b'\0' + digest).hexdigest()
+
+    def seen(self, key, now):
+        expires_at = self.local.get(key)
+        if expires_at is not None and expires_at > now:
+            return True
+        return replay_cache_backend().get(self.cache_key(key)) is not None
+
+    def add(self, key, expires_at, now=None):
+        """
+        Record a verified signature until expires_at. Returns False when it was already recorded, here or by
+        another process, in which case the request is a replay.
+        """
+        now = time.time() if now is None else now
+        expires = self.local.get(key)
+        if expires is not None and expires > now:
+            return False
+        self.local.set(key, expires_at)
+        return replay_cache_backend().add(self.cache_key(key), 1, max(1, math.ceil(expires_at - now)))
+
+    def clear(self):
+        self.local.clear()
+
+
+replay_cache = ReplayCache(REPLAY_CACHE_SIZE)
+
+
+def signature_max_age():
+    return getattr(settings, 'ACTIVITYPUB_SIGNATURE_MAX_AGE', SIGNATURE_MAX_AGE)
+
+
+def check_timestamp(signed_at, now):
+    skew = getattr(settings, 'ACTIVITYPUB_SIGNATURE_CLOCK_SKEW', SIGNATURE_CLOCK_SKEW)
+    return now - signature_max_age() <= signed_at <= now + skew
+
+
+def check_date(value, now):
+    """
+    Returns the signed Date as a timestamp, or None if it is missing, malformed or outside the accepted window.
+    """
+    try:
+        signed_at = parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+    if not check_timestamp(signed_at, now):
+        return None
+    return signed_at
+
+
+@dataclass
+class PreparedSignature:
+    """
+    A signature that passed the cheap checks, with the message it signs, ready for the public key operation.
+    """
+    key_id: str
+    signature: bytes
+    message: bytes
+    signed_at: float
+    raw_ecdsa: bool = False
+
+    @property
+    def replay_key(self):
+        return self.key_id, hashlib.sha256(self.signature).digest()
+
+
 @dataclass
 class ValidateResult:
     success: bool
@@ -151,12 +475,64 @@ class SignatureChecker:
             public_key = public_key.get('@value')
 
         self.public_key = load_pem_public_key(public_key.encode('utf-8'))
+        self.keys = {self.key_id: self.public_key}
+
+    @classmethod
+    def for_actor(cls, actor_data: dict):
+        """
+        A checker for every key of a remote actor: its publicKey, and the Ed25519 Multikeys in assertionMethod.
+        """
+        checker = cls(actor_data.get('publicKey'))
+        for method in actor_data.get('assertionMethod') or []:
+            if not isinstance(method, dict) or method.get('type') != 'Multikey':
+                continue
+            if method.get('controller') != actor_data.get('id') or not method.get('publicKeyMultibase'):
+                continue
+            try:
+                checker.keys[method['id']] = keys.load_ed25519_multibase(method['publicKeyMultibase'])
+            except (KeyError, ValueError):
+                continue
+        return checker
 
     def validate(self, method, url, headers, body) -> ValidateResult:
+        start = time.perf_counter()
+        result = self.prepare(method, url, headers, body)
+        if isinstance(result, PreparedSignature):
+            prepared = result
+            if replay_cache.seen(prepared.replay_key, time.time()):
+                metrics.increment('activitypub_signature_replays_total')
+                result = ValidateResult.fail('Replayed signature')
+            else:
+                result = self.verify(prepared)
+                # recording the signature is the atomic check: a replay racing it in another process loses here
+                if result.success and not replay_cache.add(prepared.replay_key, prepared.signed_at + signature_max_age()):
+                    metrics.increment('activitypub_signature_replays_total')
+                    result = ValidateResult.fail('Replayed signature')
+        metrics.observe(
+            'activitypub_verification_seconds', time.perf_counter() - start,
+            result='success' if result.success else 'fail',
+        )
+        return result
+
+    def prepare(self, method, url, headers, body, now=None):
+        """
+        Run every check short of the public key operation. Returns a PreparedSignature for verify(), or a failed
+        ValidateResult. Replays are left to the caller. The signature's age is checked against now, the time the
+        request was received, which defaults to the current time.
+        """
+        now = time.time() if now is None else now
+        if 'signature-input' in headers:
+            return self._prepare_message_signature(method, url, headers, body, now)
+        return self._prepare(method, url, headers, body, now)
+
+    def _prepare(self, method, url, headers, body, now):
         if 'signature' not in headers:
             return ValidateResult.fail('Missing signature header')
 
+        # the cheap checks come first, so malformed and replayed requests never reach the public key operation
         if method.lower() == 'post':
+            if 'digest' not in headers:
+                return ValidateResult.fail('Missing digest header')
             digest = content_digest_sha256(body)
             req_digest = headers['digest']
             req_digest = req_digest[:4].upper() + req_digest[4:]
@@ -166,8 +542,12 @@ class SignatureChecker:
             digest = ''
 
         builder = HttpSignature()
-        parsed = parse_signature_header(headers['signature'])
-        fields = parsed['headers'].split(' ')
+        try:
+            parsed = parse_signature_header(headers['signature'])
+            fields = parsed['headers'].split(' ')
+            signature = base64.standard_b64decode(parsed['signature'])
+        except (IndexError, KeyError, ValueError):
+            return ValidateResult.fail('Malformed signature header')
 
         if "(request-target)" not in fields or "date" not in fields:
             return ValidateResult.fail(f'Missing required signature fields in {fields}')
@@ -175,42 +555,98 @@ class SignatureChecker:
         if digest and 'digest' not in fields:
             return ValidateResult.fail('Missing digest field')
 
-        # TODO: check date is within acceptable range
+        signed_at = check_date(headers.get('date'), now)
+        if signed_at is None:
+            return ValidateResult.fail(f'Date outside the accepted window: {headers.get("date")}')
+
+        key_id = parsed.get('keyId')
+        if key_id not in self.keys:
+            return ValidateResult.fail(f'Key ID mismatch: expected({self.key_id}) != parsed({key_id})')
 
         for field in fields:
             if field == "(request-target)":
                 parsed_url = urlparse(url)
                 builder.with_field(field, f"{method.lower()} {parsed_url.path}")
-            else:
+            elif field in headers:
                 builder.with_field(field, headers[field])
-
-        if self.key_id != parsed['keyId']:
-            return ValidateResult.fail(f'Key ID mismatch: expected({self.key_id}) != parsed({parsed["keyId"]})')
+            else:
+                return ValidateResult.fail(f'Missing signed header {field}')
 
         message = builder.build_message().encode('utf8')
-        signature = base64.standard_b64decode(parsed['signature'])
+        return PreparedSignature(key_id, signature, message, signed_at)
 
-        # TODO: support EC public keys
-        if isinstance(self.public_key, rsa.RSAPublicKey):
-            try:
-                self.public_key.verify(
-                    signature,
-                    message,
-                    padding.PKCS1v15(),
-                    hashes.SHA256(),
-                )
-                return ValidateResult.success(self.controller)
-            except InvalidSignature as f:
-                return ValidateResult.fail(f'Invalid signature: {f}')
-
-        if isinstance(self.public_key, ed25519.Ed25519PublicKey):
-            try:
-                self.public_key.verify(
-                    signature,
-                    message,
-                )
-                return ValidateResult.success(self.controller)
-            except InvalidSignature as f:
-                return ValidateResult.fail(f'Invalid signature: {f}')
-
-        return ValidateResult.fail(f'Unsupported public key type: {type(self.public_key)}')
+    def _prepare_message_signature(self, method, url, headers, body, now):
+        if 'signature' not in headers:
+            return ValidateResult.fail('Missing signature header')
+
+        if method.lower() == 'post':
+            if 'content-digest' not in headers:
+                return ValidateResult.fail('Missing content-digest header')
+            if not check_content_digest(headers['content-digest'], body):
+                return ValidateResult.fail(f'Content-Digest mismatch: {headers["content-digest"]}')
+
+        try:
+            label, components, params, signature_params = parse_signature_input(headers['signature-input'])
+            signature = parse_signature_value(headers['signature'], label)
+            signed_at = int(params['created'])
+        except (KeyError, ValueError):
+            return ValidateResult.fail('Malformed signature header')
+
+        if '@method' not in components or not ('@target-uri' in components or '@path' in components):
+            return ValidateResult.fail(f'Missing required signature components in {components}')
+
+        if method.lower() == 'post' and 'content-digest' not in components:
+            return ValidateResult.fail('Missing content-digest component')
+
+        if not check_timestamp(signed_at, now):
+            return ValidateResult.fail(f'Signature created outside the accepted window: {signed_at}')
+
+        key_id = params.get('keyid')
+        if key_id not in self.keys:
+            return ValidateResult.fail(f'Key ID mismatch: expected one of {list(self.keys)} != parsed({key_id})')
+
+        builder = MessageSignature(label)
+        for name in components:
+            value = component_value(name, method, url, headers)
+            if value is None:
+                return ValidateResult.fail(f'Missing signed component {name}')
+            builder.with_component(name, value)
+
+        message = builder.build_message(signature_params).encode('utf8')
+        return PreparedSignature(key_id, signature, message, signed_at, raw_ecdsa=True)
+
+    def verify(self, prepared: PreparedSignature) -> ValidateResult:
+        """
+        The public key operation for a prepared signature.
+        """
+        public_key = self.keys[prepared.key_id]
+        signature = prepared.signature
+        message = prepared.message
+        try:
+            if isinstance(public_key, rsa.RSAPublicKey):
+                public_key.verify(signature, message, padding.PKCS1v15(), hashes.SHA256())
+            elif isinstance(public_key, ed25519.Ed25519PublicKey):
+                public_key.verify(signature, message)
+            elif isinstance(public_key, ec.EllipticCurvePublicKey):
+                if prepared.raw_ecdsa:
+                    size = (public_key.curve.key_size + 7) // 8
+                    if len(signature) != 2 * size:
+                        return ValidateResult.fail('Invalid signature: wrong length')
+                    signature = encode_dss_signature(
+                        int.from_bytes(signature[:size], 'big'), int.from_bytes(signature[size:], 'big'),
+                    )
+                public_key.verify(signature, message, ec.ECDSA(hashes.SHA256()))
+            else:
+                return ValidateResult.fail(f'Unsupported public key type: {type(public_key)}')
+        except InvalidSignature as f:
+            return ValidateResult.fail(f'Invalid signature: {f}')
+        return ValidateResult.success(self.controller)
+
+
+def verify_prepared(actor_data, jobs):
+    """
+    Verify [(id, PreparedSignature)] jobs signed with actor_data's keys, parsing each key once. This does no I/O
+    and needs no Django setup, so it can run in a worker process. Returns [(id, ValidateResult)].
+    """
+    checker = SignatureChecker.for_actor(actor_data)
+    return [(job_id, checker.verify(prepared)) for job_id, prepared in jobs]
@@ -0,0 +1,59 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+
+DEFAULT_BACKGROUND_WORKERS = 2
+
+logger = logging.getLogger('django_activitypub.tasks')
+
+_executor = None
+
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=getattr(settings, 'ACTIVITYPUB_BACKGROUND_WORKERS', DEFAULT_BACKGROUND_WORKERS),
+            thread_name_prefix='activitypub',
+        )
+    return _executor
+
+
+def run_inline():
+    return getattr(settings, 'ACTIVITYPUB_RUN_TASKS_INLINE', False)
+
+
+def _run(fn, args, kwargs):
+    close_old_connections()
+    try:
+        return fn(*args, **kwargs)
+    except Exception:
+        # nothing waits on the future, so this is the only place the error can surface
+        logger.exception('background task %s failed', getattr(fn, '__qualname__', fn))
+    finally:
+        connection.close()
+
+
+def run_in_background(fn, *args, **kwargs):
+    """
+    Run fn in the background once the current transaction commits. Set ACTIVITYPUB_RUN_TASKS_INLINE to
+    run tasks synchronously instead (e.g. in tests or management commands).
+    """
+    if run_inline():
+        transaction.on_commit(lambda: fn(*args, **kwargs))
+    else:
+        transaction.on_commit(lambda: get_executor().submit(_run, fn, args, kwargs))
+
+
+def run_later(delay, fn, *args, **kwargs):
+    """
+    Run fn in the background after delay seconds. The wait happens on a timer, so no worker thread is held while
+    waiting; tasks still waiting when the process exits are dropped.
+    """
+    timer = threading.Timer(delay, lambda: get_executor().submit(_run, fn, args, kwargs))
+    timer.daemon = True
+    timer.start()
+    return timer
@@ -2,6 +2,7 @@ from django import template
 from django.utils.safestring import mark_safe
 from html_sanitizer import Sanitizer
 
+from django_activitypub.media import ORIGINAL, proxy_url
 from django_activitypub.models import Note
 
 register = template.Library()
@@ -13,6 +14,19 @@ def sanitize_content(content):
     return mark_safe(sani.sanitize(content))
 
 
+@register.filter
+def note_html(note, base_url):
+    # local notes are plain text, remote ones arrive as HTML
+    if note.local_actor_id:
+        return note.content_html(base_url)
+    return sanitize_content(note.content)
+
+
+@register.filter
+def proxy_media(url, variant=ORIGINAL):
+    return proxy_url(url, variant)
+
+
 @register.filter
 def max_depth(value, num):
     try:
@@ -32,7 +46,7 @@ def pub_interactions(content_url):
         note = Note.objects.get(content_url=content_url)
     except Note.DoesNotExist:
         return {}
-    replies = note.descendants().select_related('remote_actor')
+    replies = note.descendants().select_related('remote_actor').defer('remote_actor__profile')
     return {
         'note': note,
         'replies': replies,
@@ -0,0 +1,93 @@
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import responses
+from asgiref.sync import async_to_sync
+from django.test import override_settings
+
+from django_activitypub import client
+from django_activitypub.client import FetchError, ResponseTooLarge
+
+
+class TestClient(unittest.TestCase):
+    url = 'https://example.com/users/foo'
+
+    def test_get_json(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, self.url, json={'id': self.url})
+            res = client.get_json(self.url)
+            self.assertEqual(rsps.calls[0].request.headers['Accept'], 'application/activity+json')
+        self.assertEqual(res.status_code, 200)
+        self.assertEqual(res.json(), {'id': self.url})
+
+    def test_not_json(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, self.url, body='<html>', status=404)
+            res = client.get_json(self.url)
+        self.assertIsNone(res.data)
+        with self.assertRaises(FetchError) as ctx:
+            res.raise_for_status()
+        self.assertEqual(ctx.exception.status_code, 404)
+        with self.assertRaises(FetchError):
+            res.json()
+
+    def test_response_size_cap(self):
+        with responses.RequestsMock() as rsps, override_settings(ACTIVITYPUB_HTTP_MAX_RESPONSE_SIZE=10):
+            rsps.add(responses.GET, self.url, body='{"name": "much too long"}')
+            with self.assertRaises(ResponseTooLarge):
+                client.get_json(self.url)
+            rsps.add(responses.GET, self.url + '/small', body='{}')
+            self.assertEqual(client.get_json(self.url + '/small').data, {})
+
+    def test_session_is_shared_and_requests_time_out(self):
+        self.assertIs(client.session(), client.session())
+        with responses.RequestsMock() as rsps, override_settings(ACTIVITYPUB_HTTP_TIMEOUT=3):
+            rsps.add(responses.GET, self.url, json={})
+            client.get_json(self.url, params={'resource': 'acct:foo@example.com'})
+            self.assertEqual(rsps.calls[0].request.req_kwargs['timeout'], (3, 3))
+            self.assertTrue(rsps.calls[0].request.url.endswith('?resource=acct%3Afoo%40example.com'))
+
+    @unittest.skipIf(client.httpx is not None, 'requests is only used without httpx')
+    def test_async_falls_back_to_requests(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, self.url, json={'id': self.url})
+            res = async_to_sync(client.aget_json)(self.url)
+        self.assertEqual(res.json(), {'id': self.url})
+
+
+class TestPinnedSession(unittest.TestCase):
+    def setUp(self):
+        hosts = self.hosts = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                hosts.append(self.headers['Host'])
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write(b'ok')
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+
+    def test_connects_to_the_pinned_address(self):
+        # the name doesn't resolve; the connection goes to the address it was pinned to
+        url = f'http://media.invalid:{self.server.server_port}/a.png'
+        with client.pinned_session('media.invalid', '127.0.0.1') as http:
+            response = client.request('get', url, http=http)
+        self.assertEqual(response.content, b'ok')
+        self.assertEqual(self.hosts, [f'media.invalid:{self.server.server_port}'])
+
+    def test_size_cap_can_be_raised_per_request(self):
+        url = f'http://media.invalid:{self.server.server_port}/a.png'
+        http = client.pinned_session('media.invalid', '127.0.0.1')
+        with override_settings(ACTIVITYPUB_HTTP_MAX_RESPONSE_SIZE=1), http:
+            with self.assertRaises(ResponseTooLarge):
+                client.request('get', url, http=http)
+            self.assertEqual(client.request('get', url, http=http, max_size=2).content, b'ok')
@@ -0,0 +1,140 @@
+import unittest
+from unittest import mock
+
+import responses
+from django.test import TestCase, override_settings
+
+from django_activitypub.collection_sync import (
+    EMPTY_DIGEST, MAX_SYNC_PAGES, check_synchronization, followers_digest, header_value, parse_header,
+    reconcile_following, sync_cache, toggle, uri_host,
+)
+from django_activitypub.models import Following
+from django_activitypub.test_models import make_local_actor, make_remote_actor
+
+FOLLOWERS = [
+    'https://remote.test/users/alice',
+    'https://remote.test/users/bob',
+    'https://remote.test/users/carol',
+]
+
+
+class TestFollowersDigest(unittest.TestCase):
+    def test_empty(self):
+        self.assertEqual(followers_digest([]), EMPTY_DIGEST)
+
+    def test_order_does_not_matter(self):
+        self.assertEqual(followers_digest(FOLLOWERS), followers_digest(reversed(FOLLOWERS)))
+
+    def test_incremental_updates_match(self):
+        digest = EMPTY_DIGEST
+        for uri in FOLLOWERS:
+            digest = toggle(digest, uri)
+        self.assertEqual(digest, followers_digest(FOLLOWERS))
+
+        digest = toggle(digest, FOLLOWERS[1])
+        self.assertEqual(digest, followers_digest([FOLLOWERS[0], FOLLOWERS[2]]))
+
+    def test_uri_host(self):
+        self.assertEqual(uri_host('https://Remote.Test:8443/users/alice'), 'remote.test:8443')
+
+
+class TestHeader(unittest.TestCase):
+    def test_round_trip(self):
+        value = header_value(
+            'https://local.test/pub/alice/followers',
+            'https://local.test/pub/alice/followers/sync?host=remote.test',
+            followers_digest(FOLLOWERS),
+        )
+        self.assertEqual(parse_header(value), {
+            'collectionId': 'https://local.test/pub/alice/followers',
+            'url': 'https://local.test/pub/alice/followers/sync?host=remote.test',
+            'digest': followers_digest(FOLLOWERS),
+        })
+
+    def test_collection_on_another_server_is_ignored(self):
+        value = header_value(
+            'https://elsewhere.test/users/bob/followers',
+            'https://elsewhere.test/users/bob/followers_synchronization',
+            EMPTY_DIGEST,
+        )
+        self.assertFalse(check_synchronization('https://remote.test/users/bob', value, 'local.test'))
+
+    def test_incomplete_header_is_ignored(self):
+        self.assertFalse(check_synchronization('https://remote.test/users/bob', 'digest="00"', 'local.test'))
+
+
+@override_settings(ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',))
+class TestReconcileFollowing(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = make_local_actor('alice')
+        cls.carol = make_local_actor('carol')
+
+    def setUp(self):
+        self.remote = make_remote_actor()
+        self.collection_id = f'{self.remote.url}/followers'
+        self.sync_url = f'{self.remote.url}/followers_synchronization'
+        self.remote.profile['followers'] = self.collection_id
+        self.remote.save()
+        self.following = Following.objects.create(remote_actor=self.remote, following=self.alice)
+        sync_cache().clear()
+        self.addCleanup(sync_cache().clear)
+
+    def header(self, uris):
+        return header_value(self.collection_id, self.sync_url, followers_digest(uris))
+
+    @mock.patch('django_activitypub.tasks.run_in_background')
+    def test_matching_digest(self, run_in_background):
+        value = self.header([self.alice.get_absolute_url()])
+        self.assertFalse(check_synchronization(self.remote.url, value, 'local.test'))
+        run_in_background.assert_not_called()
+
+    @mock.patch('django_activitypub.tasks.run_in_background')
+    def test_drifted_digest_reconciles(self, run_in_background):
+        value = self.header([self.alice.get_absolute_url(), self.carol.get_absolute_url()])
+        self.assertTrue(check_synchronization(self.remote.url, value, 'local.test'))
+        run_in_background.assert_called_once_with(reconcile_following, self.remote.id, self.sync_url, 'local.test')
+
+    @mock.patch('django_activitypub.tasks.run_in_background')
+    def test_drift_reconciles_once_per_interval(self, run_in_background):
+        value = self.header([self.alice.get_absolute_url(), self.carol.get_absolute_url()])
+        for _ in range(3):
+            self.assertTrue(check_synchronization(self.remote.url, value, 'local.test'))
+        run_in_background.assert_called_once()
+
+        check_synchronization(self.remote.url, value, 'other.test')
+        self.assertEqual(run_in_background.call_count, 2)
+
+    @mock.patch('django_activitypub.tasks.run_in_background')
+    def test_collection_must_be_the_senders_followers(self, run_in_background):
+        value = header_value(f'{self.remote.url}/following', self.sync_url, EMPTY_DIGEST)
+        self.assertFalse(check_synchronization(self.remote.url, value, 'local.test'))
+        run_in_background.assert_not_called()
+
+    @responses.activate
+    def test_follows_it_does_not_list_are_dropped(self):
+        responses.get(self.sync_url, json={'type': 'OrderedCollection', 'orderedItems': []})
+        reconcile_following(self.remote.id, self.sync_url, 'local.test')
+        self.assertFalse(Following.objects.filter(id=self.following.id).exists())
+
+    @responses.activate
+    def test_actors_it_lists_that_do_not_follow_it_undo(self):
+        responses.get(self.sync_url, json={
+            'type': 'OrderedCollection',
+            'first': {'orderedItems': [self.alice.get_absolute_url()], 'next': f'{self.sync_url}?page=2'},
+        })
+        responses.get(f'{self.sync_url}?page=2', json={'orderedItems': [self.carol.get_absolute_url()]})
+        responses.post(self.remote.inbox_url, status=202)
+        reconcile_following(self.remote.id, self.sync_url, 'local.test')
+        self.assertTrue(Following.objects.filter(id=self.following.id).exists())
+        undo, = [call for call in responses.calls if call.request.method == 'POST']
+        self.assertIn(self.carol.get_absolute_url().encode('utf-8'), undo.request.body)
+
+    @responses.activate
+    def test_truncated_collection_drops_nothing(self):
+        for page in range(MAX_SYNC_PAGES):
+            url = self.sync_url if page == 0 else f'{self.sync_url}?page={page}'
+            responses.get(url, json={'orderedItems': [], 'next': f'{self.sync_url}?page={page + 1}'})
+        reconcile_following(self.remote.id, self.sync_url, 'local.test')
+        self.assertEqual(len(responses.calls), MAX_SYNC_PAGES)
+        self.assertTrue(Following.objects.filter(id=self.following.id).exists())
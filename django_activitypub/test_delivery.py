@@ -0,0 +1,210 @@
+import json
+
+import responses
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from django_activitypub.delivery import (
+    MAX_ATTEMPTS, ShardWorker, deliver, deliver_pending, enqueue, queue_delivery, send_queued,
+)
+from django_activitypub.models import (
+    Delivery, DeliveryPriority, DeliveryWorker, Follower, Note, send_create_note_to_followers,
+)
+from django_activitypub.test_models import make_local_actor, make_remote_actor
+
+INBOX = 'https://remote.test/users/bob/inbox'
+GONE_INBOX = 'https://gone.test/users/carol/inbox'
+
+
+@override_settings(ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',), ACTIVITYPUB_COLLECTION_SYNC=False)
+class TestDeliver(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def queue(self, *inboxes):
+        return enqueue(self.actor, '{"type": "Delete"}', inboxes)
+
+    def test_delivered(self):
+        delivery, = self.queue(INBOX)
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            deliver(delivery)
+        self.assertIsNotNone(delivery.delivered_at)
+        self.assertEqual((delivery.attempts, delivery.failed, delivery.last_error), (1, False, ''))
+
+    def test_gone_inboxes_fail_at_once(self):
+        delivery, = self.queue(GONE_INBOX)
+        with responses.RequestsMock() as rsps:
+            rsps.post(GONE_INBOX, status=410)
+            deliver(delivery)
+        self.assertTrue(delivery.failed)
+        self.assertIsNone(delivery.delivered_at)
+
+    def test_server_errors_are_retried_up_to_max_attempts(self):
+        delivery, = self.queue(INBOX)
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=503)
+            deliver(delivery)
+            self.assertFalse(delivery.failed)
+            for _ in range(MAX_ATTEMPTS - 1):
+                deliver(delivery)
+        self.assertTrue(delivery.failed)
+        self.assertEqual(delivery.attempts, MAX_ATTEMPTS)
+        self.assertIn('503', delivery.last_error)
+
+    def test_deliver_pending_saves_the_outcomes(self):
+        self.queue(INBOX, GONE_INBOX)
+        progress = []
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            rsps.post(GONE_INBOX, status=410)
+            result = deliver_pending(batch_size=1, progress=lambda done, total: progress.append((done, total)))
+        self.assertEqual(result, (1, 1))
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertEqual(
+            dict(Delivery.objects.values_list('inbox', 'failed')), {INBOX: False, GONE_INBOX: True},
+        )
+        # nothing is left to deliver
+        self.assertEqual(deliver_pending(), (0, 0))
+
+    def test_deliver_pending_goes_by_lane_and_backs_off(self):
+        self.queue(INBOX)
+        enqueue(self.actor, '{}', [GONE_INBOX], priority=DeliveryPriority.REPLY)
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=503)
+            rsps.post(GONE_INBOX, status=202)
+            deliver_pending()
+            self.assertEqual([call.request.url for call in rsps.calls], [GONE_INBOX, INBOX])
+        retry = Delivery.objects.get(inbox=INBOX)
+        self.assertEqual((retry.attempts, retry.claimed_by), (1, ''))
+        self.assertGreater(retry.available_at, timezone.now())
+        self.assertEqual(deliver_pending(), (0, 0))
+
+    def test_deliver_pending_skips_claimed_deliveries(self):
+        delivery, = self.queue(INBOX)
+        ShardWorker('w1').claim(['remote.test'], DeliveryPriority.ACTIVITY, timezone.now())
+        with responses.RequestsMock():
+            self.assertEqual(deliver_pending(), (0, 0))
+        self.assertEqual(Delivery.objects.get(id=delivery.id).attempts, 0)
+
+
+@override_settings(ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',), ACTIVITYPUB_COLLECTION_SYNC=False)
+class TestShardWorker(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def queue(self, host, count=1, priority=DeliveryPriority.ACTIVITY):
+        return enqueue(self.actor, '{}', [f'https://{host}/inbox'] * count, priority=priority)
+
+    def worker(self, name='w1', **kwargs):
+        worker = ShardWorker(name, concurrency=2, **kwargs)
+        worker.heartbeat(timezone.now())
+        return worker
+
+    def test_lanes_go_in_order(self):
+        self.queue('bulk.test', priority=DeliveryPriority.BULK)
+        self.queue('activity.test')
+        self.queue('reply.test', priority=DeliveryPriority.REPLY)
+        worker = self.worker()
+        sent = []
+        with responses.RequestsMock() as rsps:
+            rsps.post('https://bulk.test/inbox', status=202)
+            rsps.post('https://activity.test/inbox', status=202)
+            rsps.post('https://reply.test/inbox', status=202)
+            while worker.run_once():
+                sent.append(rsps.calls[-1].request.url)
+        self.assertEqual(sent, ['https://reply.test/inbox', 'https://activity.test/inbox', 'https://bulk.test/inbox'])
+        self.assertFalse(Delivery.objects.filter(delivered_at__isnull=True).exists())
+
+    def test_hosts_are_capped_per_round(self):
+        self.queue('remote.test', count=5)
+        worker = self.worker(per_host=2)
+        hosts, lane = worker.schedule(worker.ring(timezone.now()), timezone.now())
+        self.assertEqual((hosts, lane), (['remote.test'], DeliveryPriority.ACTIVITY))
+        self.assertEqual(len(worker.claim(hosts, lane, timezone.now())), 2)
+        self.assertEqual(len(worker.claim(hosts, lane, timezone.now())), 2)
+        self.assertEqual(len(worker.claim(hosts, lane, timezone.now())), 1)
+
+    def test_a_delivery_is_claimed_by_one_worker(self):
+        self.queue('remote.test', count=3)
+        first, second = self.worker('w1'), self.worker('w2')
+        now = timezone.now()
+        # workers with different views of the ring can both think they own a host
+        claimed = first.claim(['remote.test'], DeliveryPriority.ACTIVITY, now)
+        self.assertEqual(len(claimed), 3)
+        self.assertEqual(second.claim(['remote.test'], DeliveryPriority.ACTIVITY, now), [])
+        self.assertEqual(set(Delivery.objects.values_list('claimed_by', flat=True)), {'w1'})
+
+    def test_stop_hands_back_unsent_claims(self):
+        self.queue('remote.test', count=2)
+        worker = self.worker()
+        claimed = worker.claim(['remote.test'], DeliveryPriority.ACTIVITY, timezone.now())
+        Delivery.objects.filter(id=claimed[0].id).update(delivered_at=timezone.now())
+        worker.stop()
+        self.assertFalse(DeliveryWorker.objects.filter(name='w1').exists())
+        unsent = Delivery.objects.get(id=claimed[1].id)
+        self.assertEqual((unsent.claimed_by, unsent.available_at), ('', None))
+        self.assertEqual(Delivery.objects.get(id=claimed[0].id).claimed_by, 'w1')
+
+    def test_failures_back_off(self):
+        self.queue('remote.test')
+        worker = self.worker()
+        with responses.RequestsMock() as rsps:
+            rsps.post('https://remote.test/inbox', status=503)
+            self.assertEqual(worker.run_once(), 1)
+            self.assertEqual(worker.run_once(), 0)
+        delivery = Delivery.objects.get()
+        self.assertEqual((delivery.attempts, delivery.claimed_by), (1, ''))
+        self.assertGreater(delivery.available_at, timezone.now())
+
+
+@override_settings(
+    ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',), ACTIVITYPUB_COLLECTION_SYNC=False, ACTIVITYPUB_RUN_TASKS_INLINE=True,
+)
+class TestQueueDelivery(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def test_sent_once_committed_without_workers(self):
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            with self.captureOnCommitCallbacks(execute=True):
+                queue_delivery(self.actor, '{}', [INBOX], priority=DeliveryPriority.REPLY)
+                self.assertEqual(len(rsps.calls), 0)
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertIsNotNone(Delivery.objects.get().delivered_at)
+
+    @override_settings(ACTIVITYPUB_DELIVERY_WORKERS=True)
+    def test_left_to_the_workers(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            queue_delivery(self.actor, '{}', [INBOX])
+        self.assertEqual(callbacks, [])
+
+    def test_send_queued_skips_claimed_deliveries(self):
+        delivery, = enqueue(self.actor, '{}', [INBOX])
+        ShardWorker('w1').claim(['remote.test'], DeliveryPriority.ACTIVITY, timezone.now())
+        self.assertEqual(send_queued([delivery.id]), 0)
+
+    def test_fan_out_is_queued_per_inbox(self):
+        bob = make_remote_actor('bob', shared_inbox='https://remote.test/inbox')
+        carol = make_remote_actor('carol', shared_inbox='https://remote.test/inbox')
+        dave = make_remote_actor('dave', domain='other.test')
+        for remote in (bob, carol, dave):
+            Follower.objects.create(remote_actor=remote, following=self.actor)
+        note = Note.objects.create(local_actor=self.actor, content='hello #art', content_url='https://local.test/1')
+
+        with override_settings(ACTIVITYPUB_DELIVERY_WORKERS=True):
+            send_create_note_to_followers(note)
+            deliveries = {delivery.inbox: delivery for delivery in Delivery.objects.all()}
+            self.assertEqual(set(deliveries), {'https://remote.test/inbox', dave.inbox_url})
+            self.assertEqual(deliveries[dave.inbox_url].priority, DeliveryPriority.ACTIVITY)
+            body = json.loads(deliveries[dave.inbox_url].body)
+            self.assertEqual(body['type'], 'Create')
+            self.assertEqual(body['object']['tag'][0]['href'], 'https://other.test/tags/art')
+            self.assertEqual(note.outbox.count(), 3)
+
+            send_create_note_to_followers(note)
+        self.assertEqual(Delivery.objects.count(), 2)
@@ -0,0 +1,58 @@
+import json
+import unittest
+from datetime import datetime, timezone
+
+from django.test import override_settings
+from django.utils.safestring import mark_safe
+
+from django_activitypub import encoding
+from django_activitypub.encoding import ActivityJsonResponse, EncodedCache
+
+
+class TestEncoding(unittest.TestCase):
+    payload = {
+        'type': 'Note',
+        'content': mark_safe('<p>héllo #tags</p>'),
+        'published': datetime(2024, 1, 13, 5, 59, 20, tzinfo=timezone.utc),
+        'tag': [],
+    }
+
+    def test_backends_agree(self):
+        with override_settings(ACTIVITYPUB_JSON_BACKEND='json'):
+            stdlib = encoding.dumps(self.payload)
+        self.assertIn('héllo'.encode('utf-8'), stdlib)
+        self.assertEqual(json.loads(stdlib)['published'], '2024-01-13T05:59:20Z')
+        if encoding.orjson is None:
+            return
+        with override_settings(ACTIVITYPUB_JSON_BACKEND='orjson'):
+            fast = encoding.dumps(self.payload)
+        self.assertEqual(json.loads(fast)['content'], json.loads(stdlib)['content'])
+
+    def test_dumps_with_items(self):
+        items = [encoding.dumps({'id': 1}), encoding.dumps({'id': 2})]
+        encoded = encoding.dumps_with_items({'type': 'OrderedCollectionPage'}, 'orderedItems', items)
+        self.assertEqual(json.loads(encoded), {'type': 'OrderedCollectionPage', 'orderedItems': [{'id': 1}, {'id': 2}]})
+        self.assertEqual(json.loads(encoding.dumps_with_items({}, 'items', [])), {'items': []})
+
+    def test_encoded_cache(self):
+        cache = EncodedCache(maxsize=2)
+        built = []
+
+        def build(value):
+            built.append(value)
+            return {'value': value}
+
+        self.assertEqual(cache.get_or_encode('a', lambda: build('a')), encoding.dumps({'value': 'a'}))
+        cache.get_or_encode('a', lambda: build('a'))
+        cache.get_or_encode('b', lambda: build('b'))
+        cache.get_or_encode('c', lambda: build('c'))
+        cache.get_or_encode('a', lambda: build('a'))
+        self.assertEqual(built, ['a', 'b', 'c', 'a'])
+
+    def test_response(self):
+        resp = ActivityJsonResponse({'ok': True}, content_type='application/activity+json')
+        self.assertEqual(resp['Content-Type'], 'application/activity+json')
+        self.assertEqual(json.loads(resp.content), {'ok': True})
+        self.assertEqual(ActivityJsonResponse(b'{"raw":1}').content, b'{"raw":1}')
+        with self.assertRaises(TypeError):
+            ActivityJsonResponse([1, 2])
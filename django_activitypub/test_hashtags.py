@@ -0,0 +1,50 @@
+import unittest
+
+from django.test import override_settings
+
+from django_activitypub.hashtags import extract_hashtags, hashtag_object, link_hashtags
+from django_activitypub.models import parse_hashtags, parse_html
+
+
+class TestExtractHashtags(unittest.TestCase):
+    def test_plain_text(self):
+        self.assertEqual(extract_hashtags('#Art and #comics, again #art'), ['Art', 'comics'])
+
+    def test_numbers_and_words_are_not_tags(self):
+        self.assertEqual(extract_hashtags('issue #12 at https://example.com/page#anchor, c#'), [])
+
+    def test_html(self):
+        content = (
+            '<p>Done! <a href="https://remote.test/tags/DigitalArt" class="mention hashtag" rel="tag">'
+            '#<span>DigitalArt</span></a> it&#39;s <a href="https://remote.test/tags/wip">#<span>WIP</span></a></p>'
+        )
+        self.assertEqual(extract_hashtags(content, html=True), ['DigitalArt', 'WIP'])
+
+
+class TestHashtagLinks(unittest.TestCase):
+    def setUp(self):
+        self.settings = override_settings(ROOT_URLCONF='django_activitypub.urls')
+        self.settings.enable()
+
+    def tearDown(self):
+        self.settings.disable()
+
+    def test_hashtag_object(self):
+        self.assertEqual(hashtag_object('DigitalArt', 'https://local.test'), {
+            'type': 'Hashtag',
+            'href': 'https://local.test/tags/digitalart',
+            'name': '#DigitalArt',
+        })
+
+    def test_parse_hashtags(self):
+        tags = list(parse_hashtags('#Gamer #gamer #Art', 'local.test'))
+        self.assertEqual([tag['href'] for tag in tags], ['https://local.test/tags/gamer', 'https://local.test/tags/art'])
+
+    def test_link_hashtags(self):
+        self.assertEqual(
+            link_hashtags('hi #Art', 'https://local.test'),
+            'hi <a href="https://local.test/tags/art" class="mention hashtag status-link" rel="tag">#Art</a>',
+        )
+
+    def test_escaped_quotes_are_not_linked(self):
+        self.assertEqual(parse_html("it's #1", 'https://local.test'), '<p>it&#x27;s #1</p>')
@@ -0,0 +1,85 @@
+import unittest
+from unittest import mock
+
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+
+from django_activitypub import keys
+from django_activitypub.models import KeyPool, LocalActor
+
+
+class TestKeys(unittest.TestCase):
+    def test_base58btc(self):
+        self.assertEqual(keys.base58btc(b'hello world'), 'StV1DL6CwTryKyV')
+        self.assertEqual(keys.base58btc(b'\0\0\x01'), '112')
+
+    def test_ed25519_key_pair(self):
+        private_pem, public_pem = keys.generate_key_pair(keys.ED25519)
+        self.assertIsNotNone(load_pem_private_key(private_pem.encode('utf-8'), password=None))
+        multibase = keys.ed25519_multibase(public_pem)
+        self.assertTrue(multibase.startswith('z6Mk'))
+
+    def test_ed25519_multibase_round_trip(self):
+        private_pem, public_pem = keys.generate_key_pair(keys.ED25519)
+        public_key = keys.load_ed25519_multibase(keys.ed25519_multibase(public_pem))
+        private_key = load_pem_private_key(private_pem.encode('utf-8'), password=None)
+        public_key.verify(private_key.sign(b'message'), b'message')
+        self.assertEqual(keys.base58btc_decode('112'), b'\0\0\x01')
+        with self.assertRaises(ValueError):
+            keys.load_ed25519_multibase('z' + keys.base58btc(b'\x12\x00' + b'\x01' * 32))
+
+    def test_unknown_algorithm(self):
+        with self.assertRaises(ValueError):
+            keys.generate_key_pair('dsa')
+
+
+class TestKeyPool(TestCase):
+    def test_a_pooled_key_is_taken_once(self):
+        KeyPool.objects.create(private_key='private 1', public_key='public 1')
+        KeyPool.objects.create(private_key='private 2', public_key='public 2')
+        self.assertEqual(KeyPool.objects.take(), ('private 1', 'public 1'))
+        self.assertEqual(KeyPool.objects.take(), ('private 2', 'public 2'))
+        self.assertIsNone(KeyPool.objects.take())
+        self.assertFalse(KeyPool.objects.exists())
+
+    def test_keys_are_taken_by_algorithm(self):
+        KeyPool.objects.create(algorithm=keys.ED25519, private_key='ed-private', public_key='ed-public')
+        self.assertIsNone(KeyPool.objects.take(keys.RSA))
+        self.assertEqual(KeyPool.objects.take(keys.ED25519), ('ed-private', 'ed-public'))
+
+    def test_generates_when_the_pool_is_empty(self):
+        private_pem, public_pem = KeyPool.objects.take_or_generate(keys.ED25519)
+        self.assertIsNotNone(load_pem_private_key(private_pem.encode('utf-8'), password=None))
+        self.assertTrue(keys.ed25519_multibase(public_pem).startswith('z6Mk'))
+
+    def test_fill_tops_up_the_pool(self):
+        KeyPool.objects.create(algorithm=keys.ED25519, private_key='ed-private', public_key='ed-public')
+        self.assertEqual(KeyPool.objects.fill(3, keys.ED25519, batch_size=1), 2)
+        self.assertEqual(KeyPool.objects.filter(algorithm=keys.ED25519).count(), 3)
+        self.assertEqual(KeyPool.objects.fill(3, keys.ED25519), 0)
+
+    @override_settings(ACTIVITYPUB_KEY_POOL_SIZE=4)
+    def test_taking_below_half_refills_in_the_background(self):
+        for i in range(3):
+            KeyPool.objects.create(private_key=f'private {i}', public_key=f'public {i}')
+        with mock.patch('django_activitypub.models.run_in_background') as background:
+            KeyPool.objects.take()
+            background.assert_not_called()
+            KeyPool.objects.take()
+        background.assert_called_once_with(KeyPool.objects.fill, 4, keys.RSA)
+
+    @override_settings(ACTIVITYPUB_ED25519_KEYS=True)
+    def test_save_fills_both_key_pairs(self):
+        KeyPool.objects.create(private_key='rsa-private', public_key='rsa-public')
+        KeyPool.objects.create(algorithm=keys.ED25519, private_key='ed-private', public_key='ed-public')
+        user = get_user_model().objects.create(username='alice')
+        actor = LocalActor.objects.create(user=user, preferred_username='alice', domain='local.test')
+        self.assertEqual((actor.private_key, actor.public_key), ('rsa-private', 'rsa-public'))
+        self.assertEqual((actor.ed25519_private_key, actor.ed25519_public_key), ('ed-private', 'ed-public'))
+        self.assertFalse(KeyPool.objects.exists())
+
+        actor.name = 'Alice'
+        actor.save()
+        actor.refresh_from_db()
+        self.assertEqual(actor.public_key, 'rsa-public')
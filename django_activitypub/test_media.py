@@ -0,0 +1,138 @@
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import responses
+from django.test import RequestFactory, override_settings
+from PIL import Image
+
+from django_activitypub import client, media
+from django_activitypub.views import media_proxy
+
+AVATAR_URL = 'https://remote.test/avatars/bob.png'
+
+
+def image_bytes(size=(300, 200), mode='RGBA', fmt='PNG'):
+    out = io.BytesIO()
+    Image.new(mode, size, 'red').save(out, fmt)
+    return out.getvalue()
+
+
+class TestMediaCache(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.settings = override_settings(ACTIVITYPUB_MEDIA_SIGNING_KEY='media-test', ACTIVITYPUB_MEDIA_CACHE_DIR=self.dir)
+        self.settings.enable()
+        media.failure_cache().clear()
+        media.usage_cache().delete(media.USAGE_KEY)
+        self.addresses = ['93.184.216.34']
+        resolve = mock.patch('django_activitypub.media.socket.getaddrinfo', side_effect=lambda host, *args, **kwargs: [
+            (None, None, None, '', (address, 443)) for address in self.addresses
+        ])
+        resolve.start()
+        self.addCleanup(resolve.stop)
+
+    def tearDown(self):
+        self.settings.disable()
+        shutil.rmtree(self.dir)
+
+    def test_tokens_are_signed(self):
+        token = media.sign(AVATAR_URL, media.AVATAR)
+        self.assertEqual(media.unsign(token), (AVATAR_URL, media.AVATAR))
+        with self.assertRaises(media.MediaError):
+            media.unsign(token[:-1] + ('A' if token[-1] != 'A' else 'B'))
+
+    def test_resize(self):
+        content, content_type = media.resize(image_bytes(), 96)
+        self.assertEqual(content_type, 'image/png')
+        with Image.open(io.BytesIO(content)) as img:
+            self.assertEqual(img.size, (96, 96))
+        self.assertEqual(media.resize(image_bytes(mode='RGB', fmt='JPEG'), 96)[1], 'image/jpeg')
+
+    def test_identical_media_is_stored_once(self):
+        content = image_bytes()
+        _, first = media.store(media.entry_key('https://a.test/1.png', media.ORIGINAL), content, 'image/png')
+        _, second = media.store(media.entry_key('https://b.test/2.png', media.ORIGINAL), content, 'image/png')
+        self.assertEqual(first, second)
+
+    def test_least_recently_used_blobs_are_evicted(self):
+        keys = [media.entry_key(f'https://remote.test/{i}.png', media.ORIGINAL) for i in range(3)]
+        for i, key in enumerate(keys):
+            _, digest = media.store(key, bytes([i]) * 100, 'image/png')
+            os.utime(media.blob_path(digest), (1000 + i, 1000 + i))
+        media.evict(limit=250)
+        self.assertIsNone(media.read_entry(keys[0]))
+        self.assertIsNotNone(media.read_entry(keys[2]))
+
+    def test_stores_keep_a_running_total(self):
+        keys = [media.entry_key(f'https://remote.test/{i}.png', media.ORIGINAL) for i in range(4)]
+        with override_settings(ACTIVITYPUB_MEDIA_CACHE_SIZE=250):
+            media.store(keys[0], bytes([0]) * 100, 'image/png')
+            with mock.patch('django_activitypub.media.os.walk', wraps=os.walk) as walk:
+                media.store(keys[1], bytes([1]) * 100, 'image/png')
+                media.store(keys[1], bytes([1]) * 100, 'image/png')
+                walk.assert_not_called()
+                self.assertEqual(media.usage_cache().get(media.USAGE_KEY), 200)
+
+                media.store(keys[2], bytes([2]) * 100, 'image/png')
+                walk.assert_called_once()
+        self.assertEqual(media.usage_cache().get(media.USAGE_KEY), 200)
+        self.assertEqual(sum(media.read_entry(key) is not None for key in keys), 2)
+
+    def test_fetch_and_serve(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, AVATAR_URL, body=image_bytes(), content_type='image/png')
+            response = media_proxy(RequestFactory().get('/'), media.sign(AVATAR_URL, media.AVATAR))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response['Content-Type'], 'image/png')
+            self.assertIn('immutable', response['Cache-Control'])
+
+            again = RequestFactory().get('/', headers={'If-None-Match': response['ETag']})
+            self.assertEqual(media_proxy(again, media.sign(AVATAR_URL, media.AVATAR)).status_code, 304)
+            self.assertEqual(len(rsps.calls), 1)
+
+    def test_unsupported_media_is_refused(self):
+        url = 'https://remote.test/avatars/bob.svg'
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, url, body='<svg/>', content_type='image/svg+xml')
+            self.assertEqual(media_proxy(RequestFactory().get('/'), media.sign(url, media.ORIGINAL)).status_code, 404)
+            # the failure is remembered
+            self.assertEqual(media_proxy(RequestFactory().get('/'), media.sign(url, media.ORIGINAL)).status_code, 404)
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertEqual(media_proxy(RequestFactory().get('/'), 'forged').status_code, 400)
+
+    def test_private_addresses_are_refused(self):
+        private = (
+            '127.0.0.1', '10.1.2.3', '192.168.0.1', '172.16.0.1', '169.254.169.254', '::1', 'fe80::1%eth0',
+            '::ffff:127.0.0.1',
+        )
+        for address in private:
+            with self.subTest(address=address):
+                self.addresses = ['93.184.216.34', address]
+                with self.assertRaises(media.MediaError):
+                    media.fetch(AVATAR_URL, media.ORIGINAL)
+
+    def test_fetch_connects_to_the_checked_address(self):
+        with responses.RequestsMock() as rsps, \
+                mock.patch('django_activitypub.client.pinned_session', wraps=client.pinned_session) as pinned:
+            rsps.add(responses.GET, AVATAR_URL, body=image_bytes(), content_type='image/png')
+            media.fetch(AVATAR_URL, media.ORIGINAL)
+        pinned.assert_called_once_with('remote.test', '93.184.216.34')
+
+    def test_redirects_are_checked(self):
+        internal = 'http://metadata.internal/latest'
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, AVATAR_URL, status=302, headers={'Location': '/avatars/moved.png'})
+            moved = 'https://remote.test/avatars/moved.png'
+            rsps.add(responses.GET, moved, body=image_bytes(), content_type='image/png')
+            self.assertEqual(media.fetch(AVATAR_URL, media.ORIGINAL)[0], 'image/png')
+
+            rsps.replace(responses.GET, AVATAR_URL, status=302, headers={'Location': internal})
+            refused = [None, media.MediaError('private')]
+            with mock.patch('django_activitypub.media.check_host', side_effect=refused) as check:
+                with self.assertRaises(media.MediaError):
+                    media.fetch(AVATAR_URL, media.ORIGINAL)
+            self.assertEqual(check.call_args[0][0], internal)
@@ -0,0 +1,94 @@
+import unittest
+from asgiref.sync import async_to_sync
+import responses
+from django.http import JsonResponse
+from django.test import RequestFactory
+
+from django_activitypub import metrics
+from django_activitypub.metrics import InMemoryBackend, PrometheusBackend
+
+
+class MetricsTestCase(unittest.TestCase):
+    backend_class = InMemoryBackend
+
+    def setUp(self):
+        self.backend = self.backend_class()
+        self._original = metrics._backend
+        metrics.set_backend(self.backend)
+
+    def tearDown(self):
+        metrics.set_backend(self._original)
+
+
+class TestInMemoryBackend(MetricsTestCase):
+    def test_counters_by_labels(self):
+        metrics.increment('activitypub_remote_fetches_total', kind='profile', status='200')
+        metrics.increment('activitypub_remote_fetches_total', kind='profile', status='200')
+        metrics.increment('activitypub_remote_fetches_total', kind='media', status='error')
+        self.assertEqual(self.backend.counter('activitypub_remote_fetches_total', kind='profile', status='200'), 2)
+        self.assertEqual(self.backend.counter('activitypub_remote_fetches_total', status='error', kind='media'), 1)
+
+    def test_remote_fetch_records_error_status(self):
+        with self.assertRaises(ValueError):
+            with metrics.remote_fetch('profile'):
+                raise ValueError()
+        self.assertEqual(self.backend.counter('activitypub_remote_fetches_total', kind='profile', status='error'), 1)
+        self.assertEqual(len(self.backend.observed('activitypub_remote_fetch_seconds', kind='profile')), 1)
+
+    def test_signed_post_records_delivery(self):
+        from django_activitypub.signed_requests import signed_post
+        from cryptography.hazmat.primitives import serialization
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048).private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.TraditionalOpenSSL,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, 'https://example.com/inbox', status=410)
+            signed_post('https://example.com/inbox', key, 'https://local.example/pub/foo#main-key', body='{}')
+        self.assertEqual(self.backend.counter('activitypub_deliveries_total', status='410'), 1)
+        self.assertEqual(len(self.backend.observed('activitypub_delivery_seconds')), 1)
+        self.assertEqual(len(self.backend.observed('activitypub_signing_seconds')), 1)
+
+    def test_instrument_inbox(self):
+        factory = RequestFactory()
+
+        @metrics.instrument_inbox
+        def view(request):
+            request.activitypub_activity_type = 'Like'
+            return JsonResponse({}, status=401)
+
+        view(factory.post('/inbox', data='{}', content_type='application/activity+json'))
+        self.assertEqual(self.backend.counter('activitypub_inbox_activities_total', type='Like', outcome='rejected'), 1)
+
+    def test_instrument_async_inbox(self):
+        @metrics.instrument_inbox
+        async def view(request):
+            request.activitypub_activity_type = 'Follow'
+            return JsonResponse({'ok': True})
+
+        async_to_sync(view)(RequestFactory().post('/inbox', data='{}', content_type='application/activity+json'))
+        self.assertEqual(self.backend.counter('activitypub_inbox_activities_total', type='Follow', outcome='accepted'), 1)
+
+
+class TestPrometheusBackend(MetricsTestCase):
+    backend_class = PrometheusBackend
+
+    def test_render(self):
+        self.backend.buckets = (0.1, 1.0)
+        metrics.increment('activitypub_remote_fetches_total', kind='profile', status='200')
+        metrics.observe('activitypub_remote_fetch_seconds', 0.5, kind='profile')
+        metrics.observe('activitypub_remote_fetch_seconds', 2, kind='profile')
+        text = self.backend.render()
+        self.assertIn('# TYPE activitypub_remote_fetches_total counter', text)
+        self.assertIn('activitypub_remote_fetches_total{kind="profile",status="200"} 1.0', text)
+        self.assertIn('activitypub_remote_fetch_seconds_bucket{kind="profile",le="0.1"} 0', text)
+        self.assertIn('activitypub_remote_fetch_seconds_bucket{kind="profile",le="1.0"} 1', text)
+        self.assertIn('activitypub_remote_fetch_seconds_bucket{kind="profile",le="+Inf"} 2', text)
+        self.assertIn('activitypub_remote_fetch_seconds_count{kind="profile"} 2', text)
+
+    def test_label_values_are_escaped(self):
+        metrics.increment('activitypub_inbox_activities_total', type='a"b', outcome='accepted')
+        self.assertIn('type="a\\"b"', self.backend.render())
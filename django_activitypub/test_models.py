@@ -0,0 +1,359 @@
+import json
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+import requests
+import responses
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from django_activitypub.client import FetchError
+from django_activitypub.models import (
+    Backfill, Delivery, Follower, LocalActor, Note, RemoteActor, RemoteObject, delete_all_notes, remote_object_cache,
+    run_backfill, tombstone_notes,
+)
+
+INBOX = 'https://remote.test/users/bob/inbox'
+
+
+def make_local_actor(username='alice'):
+    user = get_user_model().objects.create(username=username)
+    return LocalActor.objects.create(user=user, preferred_username=username, domain='local.test', name=username)
+
+
+def make_remote_actor(username='bob', domain='remote.test', shared_inbox=None):
+    url = f'https://{domain}/users/{username}'
+    profile = {'id': url, 'inbox': f'{url}/inbox'}
+    if shared_inbox:
+        profile['endpoints'] = {'sharedInbox': shared_inbox}
+    return RemoteActor.objects.create(username=username, domain=domain, url=url, profile=profile)
+
+
+class TestRemoteObject(unittest.TestCase):
+    url = 'https://example.com/notes/1'
+
+    def test_freshness(self):
+        now = timezone.now()
+        obj = RemoteObject(url=self.url, data={'id': self.url}, fetched_at=now - timedelta(seconds=30))
+        with override_settings(ACTIVITYPUB_REMOTE_OBJECT_TTL=60, ACTIVITYPUB_REMOTE_OBJECT_NEGATIVE_TTL=10):
+            self.assertTrue(obj.is_fresh(now))
+            obj.data = None
+            self.assertFalse(obj.is_fresh(now))
+
+    def test_validators(self):
+        obj = RemoteObject(url=self.url, etag='"abc"', last_modified='Sat, 13 Jan 2024 05:59:20 GMT')
+        self.assertEqual(obj.validators(), {
+            'If-None-Match': '"abc"',
+            'If-Modified-Since': 'Sat, 13 Jan 2024 05:59:20 GMT',
+        })
+        self.assertEqual(RemoteObject(url=self.url).validators(), {})
+
+    def test_gone_objects_raise(self):
+        with self.assertRaises(FetchError) as ctx:
+            RemoteObject(url=self.url, data=None, status=410).result()
+        self.assertEqual(ctx.exception.status_code, 410)
+        self.assertEqual(RemoteObject(url=self.url, data={'id': self.url}).result(), {'id': self.url})
+
+
+class TestRemoteObjectFetch(TestCase):
+    url = 'https://remote.test/notes/1'
+
+    def setUp(self):
+        remote_object_cache.clear()
+        self.addCleanup(remote_object_cache.clear)
+
+    def store(self, age, **fields):
+        fields.setdefault('data', {'id': self.url, 'content': 'old'})
+        return RemoteObject.objects.create(url=self.url, fetched_at=timezone.now() - timedelta(seconds=age), **fields)
+
+    @responses.activate
+    def test_fresh_objects_are_not_fetched(self):
+        self.store(10)
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'old')
+        self.assertEqual(len(responses.calls), 0)
+
+    @responses.activate
+    def test_fetch_stores_the_object(self):
+        responses.get(self.url, json={'id': self.url, 'content': 'new'}, headers={'ETag': '"v1"'})
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'new')
+        self.assertEqual(RemoteObject.objects.get(url=self.url).etag, '"v1"')
+        RemoteObject.objects.fetch(self.url)
+        self.assertEqual(len(responses.calls), 1)
+
+    @responses.activate
+    def test_stale_objects_are_revalidated(self):
+        self.store(2 * 60 * 60, etag='"v1"')
+        responses.get(self.url, status=304)
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'old')
+        self.assertEqual(responses.calls[0].request.headers['If-None-Match'], '"v1"')
+        self.assertTrue(RemoteObject.objects.get(url=self.url).is_fresh(timezone.now()))
+
+    @responses.activate
+    def test_gone_objects_are_remembered(self):
+        for status in (404, 410):
+            with self.subTest(status=status):
+                remote_object_cache.clear()
+                RemoteObject.objects.filter(url=self.url).delete()
+                responses.upsert(responses.GET, self.url, json={}, status=status)
+                for _ in range(2):
+                    with self.assertRaises(FetchError) as ctx:
+                        RemoteObject.objects.fetch(self.url)
+                    self.assertEqual(ctx.exception.status_code, status)
+                self.assertIsNone(RemoteObject.objects.get(url=self.url).data)
+        self.assertEqual(len(responses.calls), 2)
+
+    @responses.activate
+    def test_stale_objects_are_served_when_the_fetch_fails(self):
+        self.store(2 * 60 * 60)
+        responses.get(self.url, status=503)
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'old')
+        responses.replace(responses.GET, self.url, body=requests.ConnectionError('refused'))
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'old')
+
+    @responses.activate
+    def test_errors_without_a_stale_copy_raise(self):
+        responses.get(self.url, body=requests.ConnectionError('refused'))
+        with self.assertRaises(requests.ConnectionError):
+            RemoteObject.objects.fetch(self.url)
+
+    @responses.activate
+    def test_rows_invalidated_by_another_process_are_fetched_again(self):
+        self.store(10)
+        RemoteObject.objects.fetch(self.url)
+        # as another process' invalidate() would, leaving this process' copy behind
+        RemoteObject.objects.filter(url=self.url).delete()
+        responses.get(self.url, json={'id': self.url, 'content': 'new'})
+        self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'old')
+        with override_settings(ACTIVITYPUB_REMOTE_OBJECT_LOCAL_TTL=0):
+            self.assertEqual(RemoteObject.objects.fetch(self.url)['content'], 'new')
+
+
+class TestRemoteActorColumns(unittest.TestCase):
+    def test_hot_fields_are_copied_from_the_profile(self):
+        actor = RemoteActor(url='https://example.com/users/bob', profile={
+            'name': 'Bob',
+            'icon': [{'type': 'Image', 'url': 'https://example.com/bob.png'}],
+            'inbox': 'https://example.com/users/bob/inbox',
+            'endpoints': {'sharedInbox': 'https://example.com/inbox'},
+            'publicKey': {'id': 'https://example.com/users/bob#main-key', 'publicKeyPem': 'PEM'},
+        })
+        actor.sync_profile_fields()
+        self.assertEqual(actor.name, 'Bob')
+        self.assertEqual(actor.icon_url, 'https://example.com/bob.png')
+        self.assertEqual(actor.inbox_url, 'https://example.com/users/bob/inbox')
+        self.assertEqual(actor.shared_inbox_url, 'https://example.com/inbox')
+        self.assertEqual(actor.key_document(), {
+            'id': 'https://example.com/users/bob',
+            'publicKey': {
+                'id': 'https://example.com/users/bob#main-key',
+                'owner': 'https://example.com/users/bob',
+                'publicKeyPem': 'PEM',
+            },
+        })
+
+        actor.profile = {'inbox': 'https://example.com/users/bob/inbox', 'endpoints': 'https://example.com/endpoints'}
+        actor.sync_profile_fields()
+        self.assertEqual(actor.shared_inbox_url, '')
+
+
+class TestUnsyncedRemoteActors(TestCase):
+    """
+    Rows from before the inbox columns existed, until activitypub_sync_remote_actors has run.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def setUp(self):
+        self.bob = make_remote_actor()
+        self.carol = make_remote_actor('carol', domain='other.test', shared_inbox='https://other.test/inbox')
+        RemoteActor.objects.update(inbox_url='', shared_inbox_url='')
+        for remote in (self.bob, self.carol):
+            Follower.objects.create(remote_actor=remote, following=self.actor)
+
+    def test_inbox_falls_back_to_the_profile(self):
+        self.assertEqual(RemoteActor.objects.get(id=self.bob.id).inbox, INBOX)
+
+    def test_fanouts_sync_them_first(self):
+        from django_activitypub.delivery import follower_inboxes
+
+        self.assertEqual(follower_inboxes(self.actor), ['https://other.test/inbox', INBOX])
+        self.assertEqual(RemoteActor.objects.get(id=self.carol.id).shared_inbox_url, 'https://other.test/inbox')
+        self.assertEqual(RemoteActor.objects.sync_missing_inboxes(), 0)
+
+    def test_actors_without_an_inbox_are_left_alone(self):
+        RemoteActor.objects.filter(id=self.bob.id).update(profile={})
+        self.assertEqual(RemoteActor.objects.sync_missing_inboxes(), 1)
+        self.assertEqual(RemoteActor.objects.sync_missing_inboxes(), 0)
+
+
+@override_settings(ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',), ACTIVITYPUB_BACKFILL_RATE_LIMIT=(1000, 1000))
+class TestBackfill(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+        cls.remote_actor = make_remote_actor()
+        cls.notes = [
+            Note.objects.create(local_actor=cls.actor, content=f'note {i}', content_url=f'https://local.test/{i}')
+            for i in range(3)
+        ]
+        # newest first, as backfills deliver them
+        cls.notes.sort(key=lambda note: (note.published_at, note.id), reverse=True)
+
+    def setUp(self):
+        self.backfill = Backfill.objects.create(local_actor=self.actor, remote_actor=self.remote_actor)
+
+    def delivered(self, rsps):
+        return [json.loads(call.request.body)['object']['url'].split('?')[0] for call in rsps.calls]
+
+    def test_resumes_from_the_cursor_after_a_server_error(self):
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            rsps.post(INBOX, status=503)
+            backfill = run_backfill(self.backfill.id)
+        self.assertIsNone(backfill.finished_at)
+        self.assertEqual(backfill.cursor_id, self.notes[0].id)
+
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            backfill = run_backfill(self.backfill.id)
+            delivered = self.delivered(rsps)
+        self.assertEqual(delivered, [note.content_url for note in self.notes[1:]])
+        self.assertIsNotNone(backfill.finished_at)
+
+    def test_pauses_when_rate_limited_or_refused(self):
+        for status in (429, 401):
+            with responses.RequestsMock() as rsps:
+                rsps.post(INBOX, status=status)
+                backfill = run_backfill(self.backfill.id)
+                self.assertEqual(len(rsps.calls), 1)
+            self.assertIsNone(backfill.finished_at)
+            self.assertIsNone(backfill.cursor_id)
+
+    def test_stops_when_the_inbox_is_gone(self):
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=410)
+            backfill = run_backfill(self.backfill.id)
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertIsNotNone(backfill.finished_at)
+
+    def test_other_client_errors_skip_the_note(self):
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=422)
+            backfill = run_backfill(self.backfill.id)
+            self.assertEqual(len(rsps.calls), 3)
+        self.assertIsNotNone(backfill.finished_at)
+
+    def test_waits_for_the_rate_limit_on_a_timer_in_the_background(self):
+        with override_settings(ACTIVITYPUB_BACKFILL_RATE_LIMIT=(0.001, 1)), \
+                mock.patch('django_activitypub.models.run_later') as run_later, \
+                responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            backfill = run_backfill(self.backfill.id, sleep=False)
+            self.assertEqual(len(rsps.calls), 1)
+        self.assertEqual(backfill.cursor_id, self.notes[0].id)
+        self.assertEqual(run_later.call_args.args[1:], (run_backfill, self.backfill.id))
+
+    def test_waits_for_the_accept(self):
+        from django_activitypub.delivery import enqueue
+
+        accept, = enqueue(self.actor, '{}', [INBOX])
+        with mock.patch('django_activitypub.models.run_later') as run_later, responses.RequestsMock():
+            run_backfill(self.backfill.id, sleep=False, after=accept.id)
+        self.assertEqual(run_later.call_args.args[1:], (run_backfill, self.backfill.id))
+        self.assertEqual(run_later.call_args.kwargs['after'], accept.id)
+
+        Delivery.objects.filter(id=accept.id).update(failed=True)
+        with responses.RequestsMock():
+            self.assertIsNone(run_backfill(self.backfill.id, after=accept.id).cursor_id)
+
+        Delivery.objects.filter(id=accept.id).update(failed=False, delivered_at=timezone.now())
+        with responses.RequestsMock() as rsps:
+            rsps.post(INBOX, status=202)
+            self.assertIsNotNone(run_backfill(self.backfill.id, after=accept.id).finished_at)
+
+
+class TestTombstoneNotes(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+        for name in ('bob', 'carol'):
+            Follower.objects.create(
+                remote_actor=make_remote_actor(name, shared_inbox='https://remote.test/inbox'), following=cls.actor,
+            )
+        Follower.objects.create(remote_actor=make_remote_actor('dave', 'other.test'), following=cls.actor)
+        cls.notes = [
+            Note.objects.create(local_actor=cls.actor, content=f'note {i}', content_url=f'https://local.test/{i}')
+            for i in range(3)
+        ]
+        cls.reply = Note.objects.create(
+            local_actor=cls.actor, parent=cls.notes[0], content='reply', content_url='https://local.test/reply',
+        )
+
+    def test_queues_a_delete_per_inbox_and_tombstones(self):
+        self.assertEqual(tombstone_notes(self.actor), 3)
+        self.assertEqual(
+            sorted(Delivery.objects.values_list('inbox', flat=True).distinct()),
+            ['https://other.test/users/dave/inbox', 'https://remote.test/inbox'],
+        )
+        self.assertEqual(Delivery.objects.count(), 6)
+        self.assertEqual(Note.objects.filter(tombstone=True).count(), 3)
+        self.assertFalse(Note.objects.get(id=self.reply.id).tombstone)
+
+        # nothing is queued twice
+        self.assertEqual(tombstone_notes(self.actor), 0)
+        self.assertEqual(Delivery.objects.count(), 6)
+
+    def test_failure_part_way_leaves_no_deletes_for_live_notes(self):
+        from django_activitypub import delivery
+
+        calls = []
+
+        def failing_enqueue(*args, **kwargs):
+            calls.append(args)
+            queued = enqueue(*args, **kwargs)
+            if len(calls) == 2:
+                # after the second note's Deletes were inserted, so they have to be rolled back
+                raise RuntimeError('database went away')
+            return queued
+
+        enqueue = delivery.enqueue
+        with mock.patch('django_activitypub.models.BACKFILL_CHUNK_SIZE', 1), \
+                mock.patch('django_activitypub.delivery.enqueue', failing_enqueue):
+            with self.assertRaises(RuntimeError):
+                tombstone_notes(self.actor)
+        self.assertEqual(list(Note.objects.filter(tombstone=True).values_list('id', flat=True)), [self.notes[0].id])
+        self.assertEqual(Delivery.objects.count(), 2)
+
+        # a re-run only queues the notes that are still live
+        self.assertEqual(tombstone_notes(self.actor), 2)
+        self.assertEqual(Delivery.objects.count(), 6)
+
+    @mock.patch('django_activitypub.models.run_in_background')
+    def test_delete_all_leaves_sending_to_the_workers(self, run_in_background):
+        with override_settings(ACTIVITYPUB_DELIVERY_WORKERS=True):
+            self.assertEqual(delete_all_notes(), 3)
+        run_in_background.assert_not_called()
+        Note.objects.update(tombstone=False)
+        self.assertEqual(delete_all_notes(), 3)
+        run_in_background.assert_called_once()
+
+
+class TestNoteContentId(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def test_taken_content_id_is_generated_again(self):
+        first = Note.objects.create(local_actor=self.actor, content='first', content_url='https://local.test/1')
+        second = Note(local_actor=self.actor, content='second', content_url='https://local.test/2', content_id=first.content_id)
+        with self.assertLogs('django_activitypub.delivery', 'WARNING'):
+            second.save()
+        self.assertNotEqual(second.content_id, first.content_id)
+        self.assertEqual(Note.objects.count(), 2)
+
+        second.content = 'edited'
+        second.save()
+        self.assertEqual(Note.objects.get(id=second.id).content, 'edited')
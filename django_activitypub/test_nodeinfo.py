@@ -0,0 +1,35 @@
+import unittest
+
+from django.test import override_settings
+
+from django_activitypub.nodeinfo import NODEINFO_USAGE_KEY, get_usage, nodeinfo_cache, nodeinfo_document
+
+
+class TestNodeinfo(unittest.TestCase):
+    usage = {'users': {'total': 2, 'activeHalfyear': 1, 'activeMonth': 1}, 'localPosts': 5, 'localComments': 3}
+
+    def test_usage_is_read_from_snapshot(self):
+        nodeinfo_cache().set(NODEINFO_USAGE_KEY, self.usage)
+        try:
+            self.assertEqual(get_usage(), self.usage)
+        finally:
+            nodeinfo_cache().delete(NODEINFO_USAGE_KEY)
+
+    def test_document_from_settings(self):
+        config = {
+            'software': {'name': 'mysite', 'homepage': 'https://example.com'},
+            'openRegistrations': True,
+            'metadata': {'nodeName': 'Example'},
+        }
+        with override_settings(ACTIVITYPUB_NODEINFO=config):
+            data = nodeinfo_document(self.usage)
+        self.assertEqual(data['software'], {'name': 'mysite', 'version': '0.0.2', 'homepage': 'https://example.com'})
+        self.assertTrue(data['openRegistrations'])
+        self.assertEqual(data['metadata'], {'nodeName': 'Example'})
+        self.assertEqual(data['usage'], self.usage)
+
+    def test_document_defaults(self):
+        data = nodeinfo_document(self.usage)
+        self.assertEqual(data['version'], '2.0')
+        self.assertEqual(data['protocols'], ['activitypub'])
+        self.assertFalse(data['openRegistrations'])
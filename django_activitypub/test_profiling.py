@@ -0,0 +1,112 @@
+import unittest
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from django.urls import ResolverMatch
+
+from django_activitypub import profiling
+from django_activitypub.models import Follower, Following, Note
+from django_activitypub.profiling import ProfilingMiddleware, QueryBudgetExceeded, query_budget
+from django_activitypub.test_models import make_local_actor, make_remote_actor
+from django_activitypub.webfinger import webfinger_cache
+
+
+class TestProfilingMiddleware(unittest.TestCase):
+    def run_view(self, view, url_name):
+        request = RequestFactory().get('/pub/foo')
+
+        def get_response(request):
+            request.resolver_match = ResolverMatch(view, (), {}, url_name=url_name)
+            return view(request)
+        return ProfilingMiddleware(get_response)(request)
+
+    def test_server_timing_for_activitypub_views(self):
+        def view(request):
+            profiling.record_http(0.25)
+            with profiling.serializing():
+                with profiling.serializing():
+                    pass
+            return HttpResponse()
+
+        resp = self.run_view(view, 'activitypub-profile')
+        self.assertIn('http;dur=250.0;desc="1 calls"', resp['Server-Timing'])
+        self.assertIn('db;dur=0.0;desc="0 queries"', resp['Server-Timing'])
+        self.assertIn('serialize;dur=', resp['Server-Timing'])
+
+    def test_other_views_are_left_alone(self):
+        resp = self.run_view(lambda request: HttpResponse(), 'admin:index')
+        self.assertFalse(resp.has_header('Server-Timing'))
+
+
+class TestQueryBudget(unittest.TestCase):
+    def test_budget_is_declared_on_the_view(self):
+        view = query_budget(3)(lambda request: HttpResponse())
+        self.assertEqual(view.query_budget, 3)
+
+    def test_over_budget_raises_when_enforced(self):
+        @query_budget(0)
+        def view(request):
+            for current in profiling._active.get():
+                current(lambda *args: None, 'SELECT 1', (), False, {})
+            return HttpResponse()
+
+        request = RequestFactory().get('/')
+        view(request)
+        with override_settings(ACTIVITYPUB_ENFORCE_QUERY_BUDGETS=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                view(request)
+
+
+@override_settings(ACTIVITYPUB_ENFORCE_QUERY_BUDGETS=True)
+class TestViewQueryBudgets(TestCase):
+    """
+    The views against a database with enough rows for a missing select_related or prefetch to show; going over a
+    budget raises QueryBudgetExceeded out of the test client.
+    """
+    accept = 'application/activity+json'
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+        remotes = [make_remote_actor(f'user{i}', domain=f'remote{i % 2}.test') for i in range(4)]
+        for remote in remotes:
+            Follower.objects.create(remote_actor=remote, following=cls.actor)
+            Following.objects.create(remote_actor=remote, following=cls.actor)
+        cls.notes = []
+        for i in range(5):
+            note = Note.objects.create(local_actor=cls.actor, content=f'note {i} #art', content_url=f'https://local.test/{i}')
+            note.likes.set(remotes[:2])
+            note.announces.set(remotes[2:])
+            cls.notes.append(note)
+        for remote in remotes:
+            Note.objects.create(remote_actor=remote, parent=cls.notes[0], content='<p>reply #art</p>',
+                                content_url=f'{remote.url}/statuses/1')
+
+    def setUp(self):
+        webfinger_cache().clear()
+
+    def get(self, path, **params):
+        response = self.client.get(path, params, HTTP_ACCEPT=self.accept)
+        self.assertEqual(response.status_code, 200, path)
+        return response
+
+    def test_webfinger(self):
+        self.get('/.well-known/webfinger', resource='acct:alice@local.test')
+
+    def test_profile(self):
+        self.get('/pub/alice')
+
+    def test_notes(self):
+        content_id = self.notes[0].content_id
+        self.get(f'/pub/alice/statuses/{content_id}')
+        self.get(f'/pub/alice/statuses/{content_id}/replies', page=1)
+        self.get(f'/pub/alice/statuses/{content_id}/likes')
+
+    def test_collections(self):
+        self.get('/pub/alice/followers', page=1)
+        self.get('/pub/alice/following', page=1)
+        self.get('/pub/alice/followers/sync', host='remote0.test')
+        self.get('/pub/alice/outbox', page=1)
+
+    def test_tag_timeline(self):
+        self.get('/tags/art')
+        self.get('/tags/art', page=1)
@@ -0,0 +1,126 @@
+import unittest
+from asgiref.sync import async_to_sync, iscoroutinefunction
+from django.http import JsonResponse
+from django.test import RequestFactory, override_settings
+
+from django_activitypub.ratelimit import InboxRateLimiter, MemoryBackend, TokenBucket, admit_verified, throttle_inbox
+import django_activitypub.ratelimit as ratelimit
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_allows_burst_up_to_capacity(self):
+        bucket = TokenBucket(MemoryBackend(), 'test', rate=1, capacity=3)
+        self.assertEqual([bucket.take('a', now=100) for _ in range(3)], [0, 0, 0])
+        self.assertEqual(bucket.take('a', now=100), 1)
+
+    def test_refills_over_time(self):
+        bucket = TokenBucket(MemoryBackend(), 'test', rate=2, capacity=1)
+        self.assertEqual(bucket.take('a', now=100), 0)
+        self.assertEqual(bucket.take('a', now=100.25), 0.25)
+        self.assertEqual(bucket.take('a', now=100.5), 0)
+
+    def test_keys_are_independent(self):
+        bucket = TokenBucket(MemoryBackend(), 'test', rate=1, capacity=1)
+        self.assertEqual(bucket.take('a', now=100), 0)
+        self.assertEqual(bucket.take('b', now=100), 0)
+        self.assertGreater(bucket.take('a', now=100), 0)
+
+
+class TestThrottleInbox(unittest.TestCase):
+    signature = 'keyId="https://{domain}/users/{user}#main-key",algorithm="rsa-sha256",headers="date",signature="x"'
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.limiter = InboxRateLimiter(MemoryBackend())
+        self._original = ratelimit.inbox_limiter
+        ratelimit.inbox_limiter = self.limiter
+        # stands in for an inbox whose signature check passed
+        self.view = throttle_inbox(lambda request: admit_verified(request) or JsonResponse({'ok': True}))
+        self.unverified_view = throttle_inbox(lambda request: JsonResponse({'error': 'invalid signature'}, status=401))
+
+    def tearDown(self):
+        ratelimit.inbox_limiter = self._original
+
+    def post(self, domain='relay.example', user='relay', body='{}', address='192.0.2.1'):
+        return self.factory.post(
+            '/pub/foo/inbox', data=body, content_type='application/activity+json',
+            HTTP_SIGNATURE=self.signature.format(domain=domain, user=user), REMOTE_ADDR=address,
+        )
+
+    def test_identify_uses_key_id(self):
+        self.assertEqual(
+            self.limiter.identify(self.post(domain='Example.COM', user='foo')),
+            ('example.com', 'https://Example.COM/users/foo'),
+        )
+
+    def test_oversized_body_rejected(self):
+        with override_settings(ACTIVITYPUB_INBOX_MAX_BODY_SIZE=10):
+            resp = self.view(self.post(body='{"type": "Announce"}'))
+        self.assertEqual(resp.status_code, 413)
+
+    def test_abusive_domain_is_limited_without_blocking_others(self):
+        limits = {'domain': (1, 2), 'actor': (1, 100)}
+        with override_settings(ACTIVITYPUB_INBOX_RATE_LIMITS=limits):
+            statuses = [self.view(self.post()).status_code for _ in range(3)]
+            other = self.view(self.post(domain='mastodon.example', user='bar'))
+        self.assertEqual(statuses, [200, 200, 429])
+        self.assertEqual(other.status_code, 200)
+
+    def test_forged_key_ids_do_not_use_up_the_claimed_domain(self):
+        limits = {'address': (1, 3), 'domain': (1, 2), 'actor': (1, 100)}
+        with override_settings(ACTIVITYPUB_INBOX_RATE_LIMITS=limits):
+            forged = [self.unverified_view(self.post(address='198.51.100.7')).status_code for _ in range(4)]
+            real = [self.view(self.post()).status_code for _ in range(2)]
+        # the forger runs out of its own address's budget, the real server keeps its domain's
+        self.assertEqual(forged, [401, 401, 401, 429])
+        self.assertEqual(real, [200, 200])
+
+    def test_retry_after_header(self):
+        with override_settings(ACTIVITYPUB_INBOX_RATE_LIMITS={'actor': (0.1, 1)}):
+            self.view(self.post())
+            resp = self.view(self.post())
+        self.assertEqual(resp.status_code, 429)
+        self.assertEqual(resp['Retry-After'], '10')
+
+    def test_forwarded_for_is_only_read_behind_trusted_proxies(self):
+        request = self.post(address='10.0.0.2')
+        request.META['HTTP_X_FORWARDED_FOR'] = '203.0.113.9, 198.51.100.7, 10.0.0.1'
+        self.assertEqual(self.limiter.address(request), '10.0.0.2')
+        with override_settings(ACTIVITYPUB_TRUSTED_PROXIES=['10.0.0.0/8']):
+            # the hop in front of the proxies, not what the client claimed before it
+            self.assertEqual(self.limiter.address(request), '198.51.100.7')
+            self.assertEqual(self.limiter.address(self.post(address='192.0.2.1')), '192.0.2.1')
+            request.META['HTTP_X_FORWARDED_FOR'] = '10.0.0.1'
+            self.assertEqual(self.limiter.address(request), '10.0.0.1')
+
+    def test_clients_behind_a_proxy_get_their_own_budgets(self):
+        def post(client):
+            request = self.post(address='10.0.0.2')
+            request.META['HTTP_X_FORWARDED_FOR'] = client
+            return self.unverified_view(request).status_code
+
+        limits = {'address': (1, 1)}
+        with override_settings(ACTIVITYPUB_INBOX_RATE_LIMITS=limits, ACTIVITYPUB_TRUSTED_PROXIES=['10.0.0.2']):
+            self.assertEqual([post('198.51.100.7'), post('198.51.100.7'), post('198.51.100.8')], [401, 429, 401])
+
+    def test_concurrency_slots(self):
+        with override_settings(ACTIVITYPUB_INBOX_MAX_CONCURRENT_PER_ADDRESS=1):
+            with self.limiter.slot('192.0.2.1') as first:
+                with self.limiter.slot('192.0.2.1') as second:
+                    self.assertTrue(first)
+                    self.assertFalse(second)
+            with self.limiter.slot('192.0.2.1') as third:
+                self.assertTrue(third)
+
+    def test_async_view(self):
+        async def view(request):
+            return JsonResponse({'ok': True})
+
+        throttled = throttle_inbox(view)
+        self.assertTrue(iscoroutinefunction(throttled))
+        with override_settings(ACTIVITYPUB_INBOX_RATE_LIMITS={'address': (1, 1)}):
+            statuses = [async_to_sync(throttled)(self.post()).status_code for _ in range(2)]
+        self.assertEqual(statuses, [200, 429])
+        # the slot taken by the first request was given back
+        with self.limiter.slot('192.0.2.1') as acquired:
+            self.assertTrue(acquired)
@@ -0,0 +1,132 @@
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.db import transaction
+from django.test import TestCase, override_settings
+
+from django_activitypub.models import InboxItem, Note, RemoteObject
+from django_activitypub.retention import prune_inbox_items, prune_remote_notes, prune_remote_objects, take_level
+from django_activitypub.test_models import make_local_actor, make_remote_actor
+
+CUTOFF = datetime(2024, 1, 1, tzinfo=timezone.utc)
+OLD = CUTOFF - timedelta(days=30)
+NEW = CUTOFF + timedelta(days=1)
+
+
+def walk(roots, levels):
+    members = {root: [root] for root in roots}
+    root_of = {root: root for root in roots}
+    blocked = set()
+    frontier = list(roots)
+    for level in levels:
+        frontier = take_level([child for child in level if child[1] in frontier], CUTOFF, root_of, members, blocked)
+    return members, blocked
+
+
+class TestTakeLevel(unittest.TestCase):
+    def test_old_remote_subtree_is_collected(self):
+        members, blocked = walk([1], [
+            [(2, 1, None, OLD, OLD), (3, 1, None, OLD, OLD)],
+            [(4, 3, None, OLD, OLD)],
+        ])
+        self.assertEqual(blocked, set())
+        self.assertEqual(sorted(members[1]), [1, 2, 3, 4])
+
+    def test_local_reply_blocks_its_root(self):
+        members, blocked = walk([1, 10], [
+            [(2, 1, None, OLD, OLD), (11, 10, None, OLD, OLD)],
+            [(3, 2, 7, OLD, OLD)],
+        ])
+        self.assertEqual(blocked, {1})
+        self.assertEqual(members[10], [10, 11])
+
+    def test_recent_activity_blocks_its_root(self):
+        _, blocked = walk([1], [[(2, 1, None, OLD, NEW)]])
+        self.assertEqual(blocked, {1})
+
+    def test_blocked_subtrees_are_not_descended(self):
+        frontier = take_level(
+            [(2, 1, None, NEW, NEW), (3, 1, None, OLD, OLD)], CUTOFF, {1: 1}, {1: [1]}, set(),
+        )
+        self.assertEqual(frontier, [])
+
+
+class TestPruneRemoteNotes(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+        cls.remote = make_remote_actor()
+
+    def setUp(self):
+        self.local = self.note(local_actor=self.actor, remote_actor=None)
+        self.thread = self.note()
+        self.thread_reply = self.note(parent=self.thread)
+        self.reply_to_local = self.note(parent=self.local)
+        self.reply_to_reply = self.note(parent=self.reply_to_local)
+        old = datetime.now(timezone.utc) - timedelta(days=60)
+        Note.objects.update(published_at=old, updated_at=old)
+
+    def note(self, **kwargs):
+        kwargs.setdefault('remote_actor', self.remote)
+        count = Note.objects.count()
+        return Note.objects.create(content='old', content_url=f'https://remote.test/notes/{count}', **kwargs)
+
+    def remaining(self):
+        return set(Note.objects.values_list('id', flat=True))
+
+    def test_remote_threads_go(self):
+        self.assertEqual(prune_remote_notes(days=30, dry_run=True), (1, 2))
+        self.assertEqual(prune_remote_notes(days=30), (1, 2))
+        self.assertEqual(self.remaining(), {self.local.id, self.reply_to_local.id, self.reply_to_reply.id})
+
+    def test_replies_to_local_notes_are_pruned_on_request(self):
+        with override_settings(ACTIVITYPUB_PRUNE_REPLIES_TO_LOCAL=True):
+            self.assertEqual(prune_remote_notes(days=30), (2, 4))
+        self.assertEqual(self.remaining(), {self.local.id})
+
+    def test_roots_active_since_the_batch_was_listed_are_kept(self):
+        atomic = transaction.atomic
+
+        def touched(*args, **kwargs):
+            # another process updates the thread between listing the batch and locking it
+            Note.objects.filter(id=self.thread.id).update(updated_at=datetime.now(timezone.utc))
+            return atomic(*args, **kwargs)
+
+        with mock.patch('django_activitypub.retention.transaction.atomic', side_effect=touched):
+            self.assertEqual(prune_remote_notes(days=30), (0, 0))
+        self.assertIn(self.thread_reply.id, self.remaining())
+
+
+class TestPruneRemoteObjects(TestCase):
+    def setUp(self):
+        now = datetime.now(timezone.utc)
+        for i, age in enumerate([1, 6, 8, 30]):
+            RemoteObject.objects.create(url=f'https://remote.test/{i}', data={}, fetched_at=now - timedelta(days=age))
+
+    def test_dry_run(self):
+        self.assertEqual(prune_remote_objects(days=7, dry_run=True), 2)
+        self.assertEqual(RemoteObject.objects.count(), 4)
+
+    def test_old_objects_are_removed(self):
+        progress = []
+        self.assertEqual(prune_remote_objects(days=7, batch_size=1, progress=lambda *args: progress.append(args)), 2)
+        self.assertEqual(progress, [(1, 2), (2, 2)])
+        self.assertEqual(sorted(RemoteObject.objects.values_list('url', flat=True)), ['https://remote.test/0', 'https://remote.test/1'])
+
+    @override_settings(ACTIVITYPUB_REMOTE_OBJECT_RETENTION_DAYS=None)
+    def test_none_keeps_them(self):
+        self.assertEqual(prune_remote_objects(), 0)
+        self.assertEqual(RemoteObject.objects.count(), 4)
+
+
+class TestPruneInboxItems(TestCase):
+    def test_processed_items_are_removed(self):
+        actor = make_local_actor()
+        now = datetime.now(timezone.utc)
+        for processed_at in (None, now - timedelta(days=1), now - timedelta(days=8)):
+            InboxItem.objects.create(local_actor=actor, url='https://local.test/pub/alice/inbox', key_id='k', processed_at=processed_at)
+        self.assertEqual(prune_inbox_items(days=7, dry_run=True), 1)
+        self.assertEqual(prune_inbox_items(days=7), 1)
+        self.assertEqual(InboxItem.objects.filter(processed_at__isnull=True).count(), 1)
+        self.assertEqual(InboxItem.objects.count(), 2)
@@ -0,0 +1,219 @@
+import json
+import pickle
+import unittest
+from email.utils import formatdate
+from types import SimpleNamespace
+from urllib.parse import urlparse
+
+import responses
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+
+from django_activitypub import keys
+from django_activitypub.signed_requests import (
+    CAVAGE, RFC9421, PreparedSignature, ReplayCache, SignatureChecker, actor_signed_post, build_message_signature,
+    build_signature, content_digest_rfc9530, content_digest_sha256, get_gmt_now, replay_cache, replay_cache_backend,
+    signature_cache, signature_key_id, signature_scheme_key, verify_prepared,
+)
+
+INBOX = 'https://local.test/pub/alice/inbox'
+KEY_ID = 'https://remote.test/users/bob#main-key'
+BODY = json.dumps({'type': 'Follow', 'actor': 'https://remote.test/users/bob'}).encode('utf-8')
+
+
+class TestSignatureChecker(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.private_key, public_key = keys.generate_key_pair()
+        cls.checker_key = {'id': KEY_ID, 'owner': 'https://remote.test/users/bob', 'publicKeyPem': public_key}
+        cls.checker = SignatureChecker(cls.checker_key)
+
+    def setUp(self):
+        replay_cache.clear()
+        replay_cache_backend().clear()
+
+    def signed_headers(self, date=None, body=BODY):
+        path = urlparse(INBOX).path
+        headers = {
+            'host': 'local.test',
+            'date': date or get_gmt_now(),
+            'digest': content_digest_sha256(body),
+            'content-type': 'application/activity+json',
+        }
+        headers['signature'] = (
+            build_signature('local.test', 'post', path)
+            .with_field('host', headers['host'])
+            .with_field('date', headers['date'])
+            .with_field('digest', headers['digest'])
+            .build_signature(KEY_ID, self.private_key.encode('utf-8'))
+        )
+        return headers
+
+    def test_valid_signature(self):
+        result = self.checker.validate('post', INBOX, self.signed_headers(), BODY)
+        self.assertTrue(result.success, result.error)
+
+    def test_replay_is_rejected(self):
+        headers = self.signed_headers()
+        self.assertTrue(self.checker.validate('post', INBOX, headers, BODY).success)
+        result = self.checker.validate('post', INBOX, headers, BODY)
+        self.assertFalse(result.success)
+        self.assertEqual(result.error, 'Replayed signature')
+
+    def test_replay_to_another_process_is_rejected(self):
+        headers = self.signed_headers()
+        self.assertTrue(self.checker.validate('post', INBOX, headers, BODY).success)
+        # what another process knows: nothing locally, only the shared cache
+        replay_cache.clear()
+        result = self.checker.validate('post', INBOX, headers, BODY)
+        self.assertEqual(result.error, 'Replayed signature')
+
+    def test_replay_keys_are_recorded_once(self):
+        key = (KEY_ID, b'digest')
+        self.assertTrue(replay_cache.add(key, 1060, now=1000))
+        self.assertFalse(replay_cache.add(key, 1060, now=1000))
+        self.assertFalse(ReplayCache(10).add(key, 1060, now=1000))
+        self.assertTrue(ReplayCache(10).seen(key, 1000))
+
+    def test_stale_and_future_dates_are_rejected(self):
+        for date in (formatdate(0, usegmt=True), formatdate(4102444800, usegmt=True), 'not a date'):
+            result = self.checker.validate('post', INBOX, self.signed_headers(date=date), BODY)
+            self.assertFalse(result.success)
+            self.assertTrue(result.error.startswith('Date outside'), result.error)
+
+    def test_verify_prepared_jobs_can_be_sent_to_workers(self):
+        actor = {'id': 'https://remote.test/users/bob', 'publicKey': self.checker_key}
+        first = self.checker.prepare('post', INBOX, self.signed_headers(), BODY)
+        forged = PreparedSignature(KEY_ID, first.signature, first.message + b' ', first.signed_at)
+        self.assertIsInstance(first, PreparedSignature)
+        jobs = pickle.loads(pickle.dumps([(1, first), (2, forged)]))
+        results = dict(pickle.loads(pickle.dumps(verify_prepared(actor, jobs))))
+        self.assertTrue(results[1].success, results[1].error)
+        self.assertFalse(results[2].success)
+
+    def test_digest_is_checked_first(self):
+        headers = self.signed_headers()
+        headers['signature'] = 'garbage'
+        result = self.checker.validate('post', INBOX, headers, BODY + b' ')
+        self.assertTrue(result.error.startswith('Digest mismatch'), result.error)
+        self.assertEqual(self.checker.validate('post', INBOX, headers, BODY).error, 'Malformed signature header')
+
+
+class TestMessageSignatures(unittest.TestCase):
+    actor_url = 'https://remote.test/users/bob'
+
+    @classmethod
+    def setUpClass(cls):
+        rsa_private, rsa_public = keys.generate_key_pair()
+        cls.ed25519_private, ed25519_public = keys.generate_key_pair(keys.ED25519)
+        cls.actor = {
+            'id': cls.actor_url,
+            'publicKey': {'id': KEY_ID, 'owner': cls.actor_url, 'publicKeyPem': rsa_public},
+            'assertionMethod': [{
+                'id': f'{cls.actor_url}#ed25519-key',
+                'type': 'Multikey',
+                'controller': cls.actor_url,
+                'publicKeyMultibase': keys.ed25519_multibase(ed25519_public),
+            }],
+        }
+
+    def setUp(self):
+        replay_cache.clear()
+        replay_cache_backend().clear()
+
+    def signed_headers(self, private_key, key_id, body=BODY):
+        digest = content_digest_rfc9530(body)
+        headers = {'content-digest': digest, 'content-type': 'application/activity+json'}
+        headers.update(
+            build_message_signature('post', INBOX)
+            .with_component('content-digest', digest)
+            .with_component('content-type', headers['content-type'])
+            .build_headers(key_id, private_key)
+        )
+        return headers
+
+    def test_ed25519_multikey(self):
+        key_id = f'{self.actor_url}#ed25519-key'
+        headers = self.signed_headers(self.ed25519_private.encode('utf-8'), key_id)
+        self.assertEqual(signature_key_id(headers), key_id)
+        checker = SignatureChecker.for_actor(self.actor)
+        result = checker.validate('post', INBOX, headers, BODY)
+        self.assertTrue(result.success, result.error)
+        self.assertEqual(result.identity, self.actor_url)
+        self.assertEqual(checker.validate('post', INBOX, headers, BODY).error, 'Replayed signature')
+        self.assertFalse(SignatureChecker(self.actor['publicKey']).validate('post', INBOX, headers, BODY).success)
+
+    def test_ecdsa_key(self):
+        private_key = ec.generate_private_key(ec.SECP256R1())
+        private_pem = private_key.private_bytes(
+            serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption(),
+        )
+        public_pem = private_key.public_key().public_bytes(
+            serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode('utf-8')
+        checker = SignatureChecker({'id': KEY_ID, 'owner': self.actor_url, 'publicKeyPem': public_pem})
+        result = checker.validate('post', INBOX, self.signed_headers(private_pem, KEY_ID), BODY)
+        self.assertTrue(result.success, result.error)
+
+        headers = {'host': 'local.test', 'date': get_gmt_now(), 'digest': content_digest_sha256(BODY)}
+        headers['signature'] = (
+            build_signature('local.test', 'post', urlparse(INBOX).path)
+            .with_field('date', headers['date'])
+            .with_field('digest', headers['digest'])
+            .build_signature(KEY_ID, private_pem)
+        )
+        self.assertIn('algorithm="hs2019"', headers['signature'])
+        result = checker.validate('post', INBOX, headers, BODY)
+        self.assertTrue(result.success, result.error)
+
+    def test_tampered_body(self):
+        headers = self.signed_headers(self.ed25519_private.encode('utf-8'), f'{self.actor_url}#ed25519-key')
+        result = SignatureChecker.for_actor(self.actor).validate('post', INBOX, headers, BODY + b' ')
+        self.assertTrue(result.error.startswith('Content-Digest mismatch'), result.error)
+
+
+class TestSchemeNegotiation(unittest.TestCase):
+    inbox = 'https://negotiate.test/inbox'
+
+    @classmethod
+    def setUpClass(cls):
+        private_key, _ = keys.generate_key_pair()
+        ed25519_private_key, _ = keys.generate_key_pair(keys.ED25519)
+        cls.actor = SimpleNamespace(
+            private_key=private_key, ed25519_private_key=ed25519_private_key,
+            get_absolute_url=lambda: 'https://local.test/pub/alice',
+        )
+
+    def setUp(self):
+        signature_cache().delete(signature_scheme_key('negotiate.test'))
+
+    def test_double_knock_is_remembered(self):
+        def inbox(request):
+            return (401, {}, '') if 'signature-input' in request.headers else (202, {}, '')
+
+        with responses.RequestsMock() as rsps:
+            rsps.add_callback(responses.POST, self.inbox, callback=inbox)
+            self.assertEqual(actor_signed_post(self.actor, self.inbox, body=BODY).status_code, 202)
+            self.assertEqual(len(rsps.calls), 2)
+            self.assertEqual(signature_cache().get(signature_scheme_key('negotiate.test')), CAVAGE)
+
+            actor_signed_post(self.actor, self.inbox, body=BODY)
+            self.assertEqual(len(rsps.calls), 3)
+            self.assertNotIn('signature-input', rsps.calls[2].request.headers)
+
+    def test_extra_headers_are_signed(self):
+        signature_cache().set(signature_scheme_key('negotiate.test'), CAVAGE)
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, self.inbox, status=202)
+            actor_signed_post(self.actor, self.inbox, body=BODY, headers={'Collection-Synchronization': 'digest="00"'})
+            headers = rsps.calls[0].request.headers
+        self.assertEqual(headers['collection-synchronization'], 'digest="00"')
+        self.assertIn('content-type collection-synchronization"', headers['signature'])
+
+    def test_message_signature_accepted(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.POST, self.inbox, status=202)
+            actor_signed_post(self.actor, self.inbox, body=BODY)
+            self.assertEqual(len(rsps.calls), 1)
+            self.assertIn('keyid="https://local.test/pub/alice#ed25519-key"', rsps.calls[0].request.headers['signature-input'])
+        self.assertEqual(signature_cache().get(signature_scheme_key('negotiate.test')), RFC9421)
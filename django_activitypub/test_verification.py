@@ -0,0 +1,138 @@
+import json
+import time
+from datetime import datetime, timezone
+from email.utils import formatdate
+from unittest import mock
+
+import responses
+from django.test import TestCase, override_settings
+
+from django_activitypub import keys, views
+from django_activitypub.models import InboxItem
+from django_activitypub.signed_requests import (
+    build_signature, content_digest_sha256, replay_cache, replay_cache_backend,
+)
+from django_activitypub.test_models import make_local_actor
+from django_activitypub.verification import verify_batch
+from django_activitypub.webfinger import clear_remote_profile_cache
+
+INBOX = 'https://local.test/pub/alice/inbox'
+ACTOR = 'https://remote.test/users/bob'
+KEY_ID = f'{ACTOR}#main-key'
+
+
+@override_settings(ACTIVITYPUB_COLLECTION_SYNC=False)
+class TestVerifyBatch(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+        cls.private_key, cls.public_key = keys.generate_key_pair()
+
+    def setUp(self):
+        replay_cache.clear()
+        replay_cache_backend().clear()
+        clear_remote_profile_cache()
+        self.addCleanup(clear_remote_profile_cache)
+        responses.start()
+        self.addCleanup(responses.stop)
+        self.addCleanup(responses.reset)
+        responses.get(ACTOR, json={
+            'id': ACTOR, 'type': 'Person', 'inbox': f'{ACTOR}/inbox',
+            'publicKey': {'id': KEY_ID, 'owner': ACTOR, 'publicKeyPem': self.public_key},
+        })
+
+    def queue(self, actor=ACTOR, signed_at=None, received_at=None):
+        body = json.dumps({'type': 'Accept', 'actor': actor, 'object': f'{ACTOR}/follows/1'}).encode('utf-8')
+        headers = {
+            'host': 'local.test',
+            'date': formatdate(time.time() if signed_at is None else signed_at, usegmt=True),
+            'digest': content_digest_sha256(body),
+        }
+        headers['signature'] = (
+            build_signature('local.test', 'post', '/pub/alice/inbox')
+            .with_field('date', headers['date'])
+            .with_field('digest', headers['digest'])
+            .build_signature(KEY_ID, self.private_key.encode('utf-8'))
+        )
+        item = InboxItem.objects.create(local_actor=self.actor, url=INBOX, key_id=KEY_ID, headers=headers, body=body)
+        if received_at is not None:
+            InboxItem.objects.filter(id=item.id).update(received_at=datetime.fromtimestamp(received_at, timezone.utc))
+        return item
+
+    def copy(self, item):
+        return InboxItem.objects.create(
+            local_actor=self.actor, url=item.url, key_id=item.key_id, headers=item.headers, body=item.body,
+        )
+
+    def verify(self, *items):
+        items = list(InboxItem.objects.filter(id__in=[item.id for item in items]).select_related('local_actor').order_by('id'))
+        result = verify_batch(items)
+        return result, {item.id: (item.status, item.error) for item in items}
+
+    def test_signatures_are_checked_against_the_time_they_arrived(self):
+        two_hours_ago = time.time() - 2 * 60 * 60
+        queued = self.queue(signed_at=two_hours_ago, received_at=two_hours_ago + 5)
+        late = self.queue(signed_at=two_hours_ago)
+        (handled, rejected), outcomes = self.verify(queued, late)
+        self.assertEqual((handled, rejected), (1, 1))
+        self.assertEqual(outcomes[queued.id][0], 200)
+        self.assertEqual(outcomes[late.id][0], 401)
+        self.assertTrue(outcomes[late.id][1].startswith('Date outside'), outcomes[late.id][1])
+        self.assertIsNotNone(InboxItem.objects.get(id=queued.id).processed_at)
+
+    def test_key_is_only_accepted_for_its_own_actor(self):
+        own = self.queue()
+        other = self.queue(actor='https://remote.test/users/mallory')
+        _, outcomes = self.verify(own, other)
+        self.assertEqual(outcomes[own.id][0], 200)
+        self.assertEqual(outcomes[other.id], (401, f'{KEY_ID} does not belong to https://remote.test/users/mallory'))
+
+    def test_replays_are_rejected_within_a_batch(self):
+        item = self.queue()
+        _, outcomes = self.verify(item, self.copy(item))
+        self.assertEqual([status for status, _ in outcomes.values()], [200, 401])
+
+    def test_replays_are_rejected_across_batches(self):
+        item = self.queue()
+        replay = self.copy(item)
+        self.assertEqual(self.verify(item)[0], (1, 0))
+        # as a verifier in another process would see it, with only the shared cache
+        replay_cache.clear()
+        (handled, rejected), outcomes = self.verify(replay)
+        self.assertEqual((handled, rejected), (0, 1))
+        self.assertEqual(outcomes[replay.id], (401, 'Replayed signature'))
+
+    def test_late_items_are_remembered_for_as_long_as_they_waited(self):
+        # a copy received just before the window closed could still be waiting in the queue
+        two_hours_ago = time.time() - 2 * 60 * 60
+        item = self.queue(signed_at=two_hours_ago, received_at=two_hours_ago + 60)
+        with mock.patch.object(replay_cache, 'add', wraps=replay_cache.add) as add:
+            self.verify(item)
+        expires_at = add.call_args[0][1]
+        self.assertGreater(expires_at, time.time() + 50 * 60)
+
+    def test_an_error_with_one_signer_fails_only_its_items(self):
+        mallory = 'https://remote.test/users/mallory'
+        item = self.queue()
+        broken = self.queue(actor=mallory)
+        InboxItem.objects.filter(id=broken.id).update(key_id=f'{mallory}#main-key')
+        profile = views.signing_actor_profile
+
+        def signing_actor_profile(url, actor=None):
+            if url == mallory:
+                raise KeyError('publicKey')
+            return profile(url, actor)
+
+        with mock.patch('django_activitypub.views.signing_actor_profile', side_effect=signing_actor_profile):
+            (handled, rejected), outcomes = self.verify(item, broken)
+        self.assertEqual((handled, rejected), (1, 1))
+        self.assertEqual(outcomes[item.id][0], 200)
+        self.assertEqual(outcomes[broken.id], (401, "could not check the signature: 'publicKey'"))
+        self.assertFalse(InboxItem.objects.filter(processed_at__isnull=True).exists())
+
+    def test_a_failed_verification_is_recorded(self):
+        item = self.queue()
+        with mock.patch('django_activitypub.verification.verify_prepared', side_effect=ValueError('bad key')):
+            (handled, rejected), outcomes = self.verify(item)
+        self.assertEqual((handled, rejected), (0, 1))
+        self.assertEqual(outcomes[item.id], (401, 'could not verify: bad key'))
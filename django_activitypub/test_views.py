@@ -0,0 +1,141 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+import requests
+import responses
+from asgiref.sync import async_to_sync
+from django.test import RequestFactory, TestCase, override_settings
+
+from django_activitypub.async_views import off_thread, validate_post_request
+from django_activitypub.models import Delivery, DeliveryPriority, Follower, Note, RemoteActor
+from django_activitypub.test_models import make_local_actor, make_remote_actor
+from django_activitypub.views import handle_activity, signing_actor_profile
+from django_activitypub.webfinger import clear_remote_profile_cache
+
+PEM = '-----BEGIN PUBLIC KEY-----\nstored\n-----END PUBLIC KEY-----\n'
+
+
+@override_settings(ACTIVITYPUB_COLLECTION_SYNC=False)
+class TestHandleActivity(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.actor = make_local_actor()
+
+    def setUp(self):
+        self.remote = make_remote_actor()
+        self.note = Note.objects.create(
+            remote_actor=self.remote, content='hello #art', content_url=f'{self.remote.url}/statuses/1',
+        )
+
+    def handle(self, activity):
+        request = RequestFactory().post('/pub/alice/inbox')
+        return handle_activity(request, activity, self.actor)
+
+    @override_settings(ACTIVITYPUB_DELIVERY_WORKERS=True)
+    def test_follow_queues_the_accept_as_a_reply(self):
+        follow = {'type': 'Follow', 'actor': self.remote.url, 'object': 'https://local.test/pub/alice'}
+        response = self.handle(follow)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(Follower.objects.filter(remote_actor=self.remote, following=self.actor).exists())
+        accept = Delivery.objects.get()
+        self.assertEqual((accept.inbox, accept.priority), (self.remote.inbox_url, DeliveryPriority.REPLY))
+        self.assertIn('"type":"Accept"', accept.body)
+
+    @override_settings(ACTIVITYPUB_RUN_TASKS_INLINE=True, ACTIVITYPUB_SIGNATURE_SCHEMES=('cavage',))
+    def test_follow_sends_the_accept_before_the_backfill(self):
+        Note.objects.create(local_actor=self.actor, content='old', content_url='https://local.test/1')
+        follow = {'type': 'Follow', 'actor': self.remote.url, 'object': 'https://local.test/pub/alice'}
+        with responses.RequestsMock() as rsps:
+            rsps.post(self.remote.inbox_url, status=202)
+            with self.captureOnCommitCallbacks(execute=True):
+                self.handle(follow)
+            self.assertEqual([json.loads(call.request.body)['type'] for call in rsps.calls], ['Accept', 'Update'])
+
+    def test_delete_actor_keeps_the_row_for_its_notes(self):
+        response = self.handle({'type': 'Delete', 'actor': self.remote.url, 'object': self.remote.url})
+        self.assertEqual(response.status_code, 200)
+        self.remote.refresh_from_db()
+        self.assertEqual(self.remote.profile, {})
+        self.note.refresh_from_db()
+        self.assertTrue(self.note.tombstone)
+
+    def test_delete_actor_without_notes(self):
+        other = make_remote_actor('carol')
+        self.handle({'type': 'Delete', 'actor': other.url, 'object': other.url})
+        self.assertFalse(RemoteActor.objects.filter(url=other.url).exists())
+
+    def test_delete_note(self):
+        self.handle({'type': 'Delete', 'actor': self.remote.url, 'object': {'id': self.note.content_url, 'type': 'Tombstone'}})
+        self.note.refresh_from_db()
+        self.assertTrue(self.note.tombstone)
+        self.assertEqual(self.note.content, '')
+
+    def test_only_the_author_deletes_a_note(self):
+        other = make_remote_actor('carol')
+        self.handle({'type': 'Delete', 'actor': other.url, 'object': self.note.content_url})
+        self.note.refresh_from_db()
+        self.assertFalse(self.note.tombstone)
+
+    def test_update_actor(self):
+        profile = {'id': self.remote.url, 'type': 'Person', 'name': 'Bob B', 'inbox': f'{self.remote.url}/inbox2'}
+        response = self.handle({'type': 'Update', 'actor': self.remote.url, 'object': profile})
+        self.assertEqual(response.status_code, 200)
+        self.remote.refresh_from_db()
+        self.assertEqual(self.remote.name, 'Bob B')
+        self.assertEqual(self.remote.inbox_url, f'{self.remote.url}/inbox2')
+
+    def test_actors_only_update_themselves(self):
+        other = make_remote_actor('carol')
+        profile = {'id': self.remote.url, 'type': 'Person', 'name': 'Not Bob'}
+        response = self.handle({'type': 'Update', 'actor': other.url, 'object': profile})
+        self.assertEqual(response.status_code, 403)
+        self.remote.refresh_from_db()
+        self.assertNotEqual(self.remote.name, 'Not Bob')
+
+
+class TestSigningActorProfile(TestCase):
+    url = 'https://remote.test/users/bob'
+
+    def setUp(self):
+        clear_remote_profile_cache()
+        self.addCleanup(clear_remote_profile_cache)
+        RemoteActor.objects.create(username='bob', domain='remote.test', url=self.url, profile={
+            'id': self.url, 'publicKey': {'id': f'{self.url}#main-key', 'owner': self.url, 'publicKeyPem': PEM},
+        })
+
+    @responses.activate
+    def test_gone_actor_falls_back_to_the_stored_key(self):
+        for status in (404, 410):
+            with self.subTest(status=status):
+                clear_remote_profile_cache()
+                responses.get(self.url, json={}, status=status)
+                self.assertEqual(signing_actor_profile(self.url)['publicKey']['publicKeyPem'], PEM)
+
+    @responses.activate
+    def test_unreachable_actor_does_not(self):
+        responses.get(self.url, json={}, status=503)
+        self.assertIsNone(signing_actor_profile(self.url))
+        clear_remote_profile_cache()
+        responses.replace(responses.GET, self.url, body=requests.ConnectionError('refused'))
+        self.assertIsNone(signing_actor_profile(self.url))
+
+
+class TestOffThread(unittest.TestCase):
+    def test_connections_are_tidied_around_the_call(self):
+        calls = []
+        with mock.patch('django_activitypub.async_views.close_old_connections', lambda: calls.append('close')):
+            self.assertEqual(async_to_sync(off_thread(lambda value: calls.append(value) or value))('call'), 'call')
+        self.assertEqual(calls, ['close', 'call', 'close'])
+
+    def test_signatures_are_verified_off_the_event_loop(self):
+        def verify_signature(request, activity, actor_data):
+            with self.assertRaises(RuntimeError):
+                asyncio.get_running_loop()
+
+        activity = {'actor': 'https://remote.test/users/bob'}
+        with mock.patch('django_activitypub.async_views.afetch_remote_profile', mock.AsyncMock(return_value={})), \
+                mock.patch('django_activitypub.async_views.verify_signature', side_effect=verify_signature) as verify:
+            self.assertIsNone(async_to_sync(validate_post_request)(RequestFactory().post('/'), activity))
+        verify.assert_called_once()
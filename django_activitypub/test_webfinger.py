@@ -1,7 +1,11 @@
 import json
 import unittest
 import responses
-from django_activitypub.webfinger import finger, fetch_remote_profile, WebfingerException
+from django.test import RequestFactory, override_settings
+from django_activitypub.webfinger import (
+    clear_remote_profile_cache, evict_remote_profile, finger, fetch_remote_profile, invalidate_webfinger_cache,
+    webfinger_cache, webfinger_cache_key, webfinger_cache_timeout, WebfingerException, WEBFINGER_GENERATION_KEY,
+)
 
 
 class TestWebfinger(unittest.TestCase):
@@ -27,6 +31,10 @@ class TestWebfinger(unittest.TestCase):
     }
     '''
 
+    def setUp(self):
+        clear_remote_profile_cache()
+        self.addCleanup(clear_remote_profile_cache)
+
     def test_finger_bad_json_raises_webfinger_exception(self):
         with responses.RequestsMock() as rsps:
             rsps.add(responses.GET, 'https://example.com/.well-known/webfinger',
@@ -81,3 +89,41 @@ class TestWebfinger(unittest.TestCase):
                 'webfinger': json.loads(self.finger_resp),
             }
             self.assertEqual(data, expected)
+
+    def test_evict_remote_profile_drops_only_that_profile(self):
+        with responses.RequestsMock() as rsps:
+            rsps.add(responses.GET, 'https://example.com/profile', body=self.profile_resp, status=200)
+            rsps.add(responses.GET, 'https://example.com/other', json={'id': 'https://example.com/other'}, status=200)
+            fetch_remote_profile('https://example.com/profile')
+            fetch_remote_profile('https://example.com/other')
+            evict_remote_profile('https://example.com/profile')
+            fetch_remote_profile('https://example.com/profile')
+            fetch_remote_profile('https://example.com/other')
+            self.assertEqual(
+                [call.request.url for call in rsps.calls],
+                ['https://example.com/profile', 'https://example.com/other', 'https://example.com/profile'],
+            )
+
+
+class TestWebfingerCache(unittest.TestCase):
+    def test_cache_key(self):
+        factory = RequestFactory()
+        request = factory.get('/.well-known/webfinger', {'resource': 'acct:foo@example.com'})
+        secure = factory.get('/.well-known/webfinger', {'resource': 'acct:foo@example.com'}, secure=True)
+        other = factory.get('/.well-known/webfinger', {'resource': 'acct:bar@example.com'})
+        self.assertEqual(webfinger_cache_key(request, 0), webfinger_cache_key(request, 0))
+        self.assertNotEqual(webfinger_cache_key(request, 0), webfinger_cache_key(secure, 0))
+        self.assertNotEqual(webfinger_cache_key(request, 0), webfinger_cache_key(other, 0))
+        self.assertNotEqual(webfinger_cache_key(request, 0), webfinger_cache_key(request, 1))
+
+    def test_invalidate_bumps_generation(self):
+        cache = webfinger_cache()
+        cache.delete(WEBFINGER_GENERATION_KEY)
+        invalidate_webfinger_cache()
+        invalidate_webfinger_cache()
+        self.assertEqual(cache.get(WEBFINGER_GENERATION_KEY), 2)
+
+    def test_negative_responses_expire_sooner(self):
+        self.assertLess(webfinger_cache_timeout(404), webfinger_cache_timeout(200))
+        with override_settings(ACTIVITYPUB_WEBFINGER_NEGATIVE_CACHE_TIMEOUT=1):
+            self.assertEqual(webfinger_cache_timeout(404), 1)
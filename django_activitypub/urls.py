@@ -1,5 +1,5 @@
 from django.urls import path
-from django_activitypub.views import webfinger, profile, followers, inbox, outbox, hostmeta, nodeinfo, nodeinfo_links, notes, followings, remote_redirect
+from django_activitypub.views import webfinger, profile, followers, followers_sync, inbox, outbox, hostmeta, nodeinfo, nodeinfo_links, notes, followings, remote_redirect, metrics_view, media_proxy, tag_timeline
 
 urlpatterns = [
     path('.well-known/webfinger', webfinger, name='activitypub-webfinger'),
@@ -7,6 +7,9 @@ urlpatterns = [
     path('.well-known/nodeinfo', nodeinfo_links, name='activitypub-nodeinfo'),
     path('.well-known/redirect/<str:username>@<str:domain>', remote_redirect, name='activitypub-redirect'),
     path('nodeinfo/<str:version>', nodeinfo, name='activitypub-nodeinfo'),
+    path('activitypub/metrics', metrics_view, name='activitypub-metrics'),
+    path('activitypub/media/<str:token>', media_proxy, name='activitypub-media'),
+    path('tags/<str:tag>', tag_timeline, name='activitypub-tag'),
     path('pub/<slug:username>', profile, name='activitypub-profile'),
     path('@<slug:username>', profile, name='activitypub-profile-short'),
     path('pub/<slug:username>/statuses/<str:id>', notes, \
@@ -22,6 +25,7 @@ urlpatterns = [
     path('pub/<slug:username>/statuses/<str:id>/delete', notes, \
         kwargs={'mode': 'delete'}, name='activitypub-notes-delete'),
     path('pub/<slug:username>/followers', followers, name='activitypub-followers'),
+    path('pub/<slug:username>/followers/sync', followers_sync, name='activitypub-followers-sync'),
     path('pub/<slug:username>/following', followings, name='activitypub-following'),
     path('pub/<slug:username>/inbox', inbox, name='activitypub-inbox'),
     path('pub/<slug:username>/outbox', outbox, name='activitypub-outbox'),
@@ -0,0 +1,25 @@
+import bisect
+import hashlib
+
+DEFAULT_REPLICAS = 64
+
+
+def ring_point(value):
+    return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """
+    Consistent hashing of keys onto nodes. Each node is placed on the ring replicas times so keys spread evenly,
+    and adding or removing a node only moves the keys that hash next to it.
+    """
+    def __init__(self, nodes, replicas=DEFAULT_REPLICAS):
+        self.nodes = sorted(set(nodes))
+        self._ring = sorted((ring_point(f'{node}#{i}'), node) for node in self.nodes for i in range(replicas))
+        self._points = [point for point, _ in self._ring]
+
+    def owner(self, key):
+        if not self._ring:
+            return None
+        index = bisect.bisect(self._points, ring_point(key)) % len(self._ring)
+        return self._ring[index][1]
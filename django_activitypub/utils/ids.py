@@ -0,0 +1,151 @@
+import atexit
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+import zlib
+
+from django.conf import settings
+from django.core.cache import caches
+
+logger = logging.getLogger(__name__)
+
+# 2024-01-01T00:00:00Z in milliseconds
+EPOCH = 1704067200000
+WORKER_BITS = 10
+SEQUENCE_BITS = 8
+MAX_WORKER = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+ID_LENGTH = 18
+LEASE_KEY = 'ap-snowflake-worker:{}'
+WORKER_LEASE_TTL = 3600
+
+
+def worker_lease_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_WORKER_ID_CACHE', 'default')]
+
+
+def worker_lease_ttl():
+    return getattr(settings, 'ACTIVITYPUB_WORKER_ID_LEASE_TTL', WORKER_LEASE_TTL)
+
+
+class SnowflakeGenerator:
+    """
+    Time-ordered ids laid out as milliseconds since EPOCH (41 bits), worker id (10 bits) and a per-millisecond
+    sequence (8 bits). They fit in 18 decimal digits and are zero-padded, so string order is time order.
+
+    Ids are unique as long as no two running processes share a worker id. Each process leases a free one from
+    the ACTIVITYPUB_WORKER_ID_CACHE cache at first use, renews the lease while it generates ids and releases it
+    at exit. Leases only keep processes apart when that cache is shared between them. ACTIVITYPUB_WORKER_ID
+    pins the worker id instead, for deployments that run a single process per settings module.
+    """
+    def __init__(self, worker_id=None, clock=None):
+        self._worker_id = worker_id
+        self._clock = clock or (lambda: time.time_ns() // 1_000_000)
+        self._lock = threading.Lock()
+        self._pid = None
+        self._last = 0
+        self._sequence = 0
+        self._lease_pid = None
+        self._leased = None
+        self._lease_token = None
+        self._lease_renewed = 0.0
+
+    @property
+    def worker_id(self):
+        if self._worker_id is not None:
+            return self._worker_id & MAX_WORKER
+        configured = getattr(settings, 'ACTIVITYPUB_WORKER_ID', None)
+        if configured is not None:
+            return int(configured) & MAX_WORKER
+        return self.lease()
+
+    def lease(self):
+        """
+        The worker id leased by this process, taking or renewing the lease when needed.
+        """
+        if self._lease_pid != os.getpid():
+            # a forked child inherits the parent's lease, which it must not share
+            self._lease_pid = os.getpid()
+            self._leased = None
+            self._lease_token = f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}'
+            atexit.register(self.release)
+
+        ttl = worker_lease_ttl()
+        now = time.monotonic()
+        if self._leased is not None and now - self._lease_renewed < ttl / 2:
+            return self._leased
+
+        cache = worker_lease_cache()
+        if self._leased is not None:
+            key = LEASE_KEY.format(self._leased)
+            if cache.get(key) == self._lease_token:
+                cache.touch(key, ttl)
+                self._lease_renewed = now
+                return self._leased
+            # the lease expired; keep the id if nobody has taken it since
+            if cache.add(key, self._lease_token, ttl):
+                self._lease_renewed = now
+                return self._leased
+
+        start = zlib.crc32(self._lease_token.encode('utf-8')) & MAX_WORKER
+        for offset in range(MAX_WORKER + 1):
+            worker_id = (start + offset) & MAX_WORKER
+            if cache.add(LEASE_KEY.format(worker_id), self._lease_token, ttl):
+                self._leased = worker_id
+                self._lease_renewed = now
+                return worker_id
+
+        logger.warning('all %d snowflake worker ids are leased, using an unleased one', MAX_WORKER + 1)
+        # try again at the next renewal rather than scanning the cache for every id
+        self._leased = start
+        self._lease_renewed = now
+        return start
+
+    def release(self):
+        if self._leased is None or self._lease_pid != os.getpid():
+            return
+        cache = worker_lease_cache()
+        key = LEASE_KEY.format(self._leased)
+        if cache.get(key) == self._lease_token:
+            cache.delete(key)
+        self._leased = None
+
+    def next_int(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # forked: start a fresh sequence under the new process' worker id
+                self._pid = os.getpid()
+                self._last = 0
+                self._sequence = 0
+
+            now = self._clock() - EPOCH
+            if now > self._last:
+                self._sequence = 0
+            else:
+                # same millisecond, or the clock went backwards: keep counting from the last timestamp
+                now = self._last
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    now += 1
+            self._last = now
+            return (now << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    def next_id(self):
+        return f'{self.next_int():0{ID_LENGTH}d}'
+
+
+snowflake = SnowflakeGenerator()
+
+
+def snowflake_id():
+    return snowflake.next_id()
+
+
+def snowflake_timestamp(snowflake_id):
+    """
+    Returns the creation time of an id in milliseconds since the Unix epoch.
+    """
+    return (int(snowflake_id) >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH
@@ -0,0 +1,24 @@
+import unittest
+from collections import Counter
+
+from django_activitypub.utils.hashring import HashRing
+
+HOSTS = [f'host{i}.example' for i in range(2000)]
+
+
+class HashRingTests(unittest.TestCase):
+    def test_keys_spread_over_nodes(self):
+        ring = HashRing(['a', 'b', 'c', 'd'])
+        counts = Counter(ring.owner(host) for host in HOSTS)
+        self.assertEqual(set(counts), {'a', 'b', 'c', 'd'})
+        self.assertGreater(min(counts.values()), len(HOSTS) / 4 * 0.6)
+
+    def test_adding_a_node_moves_only_its_share(self):
+        before = HashRing(['a', 'b', 'c', 'd'])
+        after = HashRing(['a', 'b', 'c', 'd', 'e'])
+        moved = [host for host in HOSTS if before.owner(host) != after.owner(host)]
+        self.assertTrue(all(after.owner(host) == 'e' for host in moved))
+        self.assertLess(len(moved), len(HOSTS) / 5 * 1.5)
+
+    def test_empty_ring(self):
+        self.assertIsNone(HashRing([]).owner('host.example'))
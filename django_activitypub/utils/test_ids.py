@@ -0,0 +1,86 @@
+import unittest
+from unittest import mock
+
+from django.core.cache import cache
+from django.test import override_settings
+
+from .ids import SnowflakeGenerator, ID_LENGTH, EPOCH, LEASE_KEY, MAX_WORKER, WORKER_LEASE_TTL, snowflake_timestamp
+
+
+class SnowflakeTests(unittest.TestCase):
+    def test_ids_are_unique_and_ordered(self):
+        generator = SnowflakeGenerator(worker_id=1)
+        ids = [generator.next_id() for _ in range(2000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+        self.assertTrue(all(len(i) == ID_LENGTH and i.isdigit() for i in ids))
+
+    def test_sequence_overflow_borrows_next_millisecond(self):
+        generator = SnowflakeGenerator(worker_id=1, clock=lambda: EPOCH + 1000)
+        ids = [generator.next_id() for _ in range(300)]
+        self.assertEqual(len(set(ids)), 300)
+        self.assertEqual(snowflake_timestamp(ids[0]), EPOCH + 1000)
+        self.assertEqual(snowflake_timestamp(ids[-1]), EPOCH + 1001)
+
+    def test_clock_going_backwards(self):
+        times = iter([EPOCH + 1000, EPOCH + 500])
+        generator = SnowflakeGenerator(worker_id=1, clock=lambda: next(times))
+        first, second = generator.next_id(), generator.next_id()
+        self.assertLess(first, second)
+
+    def test_workers_do_not_collide(self):
+        clock = lambda: EPOCH + 1000
+        a = SnowflakeGenerator(worker_id=1, clock=clock)
+        b = SnowflakeGenerator(worker_id=2, clock=clock)
+        self.assertNotEqual(a.next_id(), b.next_id())
+
+    def test_largest_id_fits(self):
+        generator = SnowflakeGenerator(worker_id=1023, clock=lambda: EPOCH + (1 << 41) - 1)
+        self.assertEqual(len(generator.next_id()), ID_LENGTH)
+
+
+class WorkerLeaseTests(unittest.TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_processes_lease_distinct_worker_ids(self):
+        a, b = SnowflakeGenerator(), SnowflakeGenerator()
+        self.assertNotEqual(a.worker_id, b.worker_id)
+        self.assertEqual(a.worker_id, a.worker_id)
+
+    def test_configured_worker_id_skips_the_lease(self):
+        with override_settings(ACTIVITYPUB_WORKER_ID=7):
+            self.assertEqual(SnowflakeGenerator().worker_id, 7)
+        self.assertIsNone(cache.get(LEASE_KEY.format(7)))
+
+    def test_expired_lease_is_taken_again(self):
+        generator = SnowflakeGenerator()
+        worker_id = generator.worker_id
+        cache.delete(LEASE_KEY.format(worker_id))
+        generator._lease_renewed -= WORKER_LEASE_TTL
+        self.assertEqual(generator.worker_id, worker_id)
+        self.assertIsNotNone(cache.get(LEASE_KEY.format(worker_id)))
+
+        cache.set(LEASE_KEY.format(worker_id), 'another process')
+        generator._lease_renewed -= WORKER_LEASE_TTL
+        self.assertNotEqual(generator.worker_id, worker_id)
+
+    def test_release(self):
+        generator = SnowflakeGenerator()
+        worker_id = generator.worker_id
+        generator.release()
+        self.assertIsNone(cache.get(LEASE_KEY.format(worker_id)))
+
+    def test_falls_back_when_every_id_is_leased(self):
+        full = mock.Mock(**{'add.return_value': False})
+        with mock.patch('django_activitypub.utils.ids.worker_lease_cache', return_value=full):
+            with self.assertLogs('django_activitypub.utils.ids', 'WARNING'):
+                self.assertLessEqual(SnowflakeGenerator().worker_id, MAX_WORKER)
+        self.assertEqual(full.add.call_count, MAX_WORKER + 1)
+
+    def test_forked_child_leases_its_own_id(self):
+        generator = SnowflakeGenerator()
+        parent_id = generator.worker_id
+        with mock.patch('django_activitypub.utils.ids.os.getpid', return_value=-1):
+            self.assertNotEqual(generator.worker_id, parent_id)
@@ -0,0 +1,23 @@
+import unittest
+
+from django_activitypub.utils.lru import LRUCache
+
+
+class LRUCacheTests(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.get('b', 'missing'), 'missing')
+        self.assertEqual(len(cache), 2)
+
+    def test_falsy_values_are_cached(self):
+        cache = LRUCache(2)
+        cache.set('a', None)
+        self.assertIn('a', cache)
+        self.assertIsNone(cache.get('a', 'missing'))
+        self.assertIsNone(cache.pop('a'))
+        self.assertNotIn('a', cache)
@@ -0,0 +1,225 @@
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlparse
+
+from django.conf import settings
+from django.http import HttpRequest
+from django.utils import timezone
+
+from django_activitypub import metrics
+from django_activitypub.encoding import loads
+from django_activitypub.models import InboxItem
+from django_activitypub.signed_requests import (
+    ValidateResult, SignatureChecker, replay_cache, signature_key_id, signature_max_age, verify_prepared,
+)
+
+VERIFY_BATCH_SIZE = 200
+# signatures sent to a worker process at a time, so one busy key is still spread over every core
+VERIFY_CHUNK_SIZE = 25
+# request headers that never take part in a signature, and shouldn't sit in the database
+UNSTORED_HEADERS = ('cookie', 'authorization')
+
+logger = logging.getLogger('django_activitypub.inbox')
+
+
+def queue_inbox():
+    return getattr(settings, 'ACTIVITYPUB_QUEUE_INBOX', False)
+
+
+def inbox_item(request, actor):
+    """
+    An unsaved InboxItem holding what is needed to verify request's signature later.
+    """
+    headers = {
+        name.lower(): value for name, value in request.headers.items() if name.lower() not in UNSTORED_HEADERS
+    }
+    headers.setdefault('host', request.get_host())
+    return InboxItem(
+        local_actor=actor,
+        url=request.build_absolute_uri(),
+        key_id=signature_key_id(headers),
+        headers=headers,
+        body=request.body,
+    )
+
+
+class QueuedRequest(HttpRequest):
+    """
+    Stands in for the original request when a queued activity is handled.
+    """
+    def __init__(self, item):
+        super().__init__()
+        parsed = urlparse(item.url)
+        for name, value in item.headers.items():
+            self.META['HTTP_' + name.upper().replace('-', '_')] = value
+        self.method = 'POST'
+        self.path = self.path_info = parsed.path
+        self.META['HTTP_HOST'] = parsed.netloc
+        self.queued_scheme = parsed.scheme
+        self._body = bytes(item.body)
+
+    def _get_scheme(self):
+        return self.queued_scheme
+
+
+def pending():
+    return InboxItem.objects.filter(processed_at__isnull=True)
+
+
+def verify_processes():
+    return getattr(settings, 'ACTIVITYPUB_VERIFY_PROCESSES', None) or os.cpu_count() or 1
+
+
+def prepare_group(key_id, items, activities, results, prepared_items, now):
+    """
+    Resolve the actor signing with key_id once and run the cheap checks for each of its items, recording failures
+    in results and the rest in prepared_items. Returns (actor_data, [(item id, PreparedSignature)]) to verify.
+    """
+    from django_activitypub.views import signing_actor_profile
+
+    actor_url = activities[items[0].id].get('actor')
+    actor_data = signing_actor_profile(actor_url, items[0].local_actor) if actor_url else None
+    if actor_data is None:
+        for item in items:
+            results[item.id] = ValidateResult.fail(f'could not fetch the actor signing with {key_id}')
+        return None, []
+
+    checker = SignatureChecker.for_actor(actor_data)
+    seen = set()
+    jobs = []
+    for item in items:
+        if activities[item.id].get('actor') != actor_url:
+            results[item.id] = ValidateResult.fail(f'{key_id} does not belong to {activities[item.id].get("actor")}')
+            continue
+        # the signature was fresh or not when it arrived, however long it then waited in the queue
+        prepared = checker.prepare('post', item.url, item.headers, bytes(item.body), now=item.received_at.timestamp())
+        if isinstance(prepared, ValidateResult):
+            results[item.id] = prepared
+        elif prepared.replay_key in seen or replay_cache.seen(prepared.replay_key, now):
+            metrics.increment('activitypub_signature_replays_total')
+            results[item.id] = ValidateResult.fail('Replayed signature')
+        else:
+            seen.add(prepared.replay_key)
+            prepared_items[item.id] = prepared
+            jobs.append((item.id, prepared))
+    return actor_data, jobs
+
+
+def fail_items(item_ids, results, prepared_items, error):
+    for item_id in item_ids:
+        prepared_items.pop(item_id, None)
+        results[item_id] = ValidateResult.fail(error)
+
+
+def verify_batch(items, executor=None):
+    """
+    Verify the signatures of items, grouped by keyId so each key is resolved and parsed once, with the public key
+    operations spread over executor's processes. Verified activities are then handled in the order they arrived.
+    The outcome is saved on the items. Returns (handled, rejected).
+    """
+    from django_activitypub.views import handle_activity
+
+    results = {}
+    activities = {}
+    groups = defaultdict(list)
+    for item in items:
+        try:
+            activities[item.id] = loads(bytes(item.body))
+        except ValueError:
+            results[item.id] = ValidateResult.fail('invalid JSON')
+            continue
+        groups[item.key_id].append(item)
+
+    prepared_items = {}
+    futures = []
+    now = time.time()
+    # an error resolving or checking one signer's key fails that signer's items, not the rest of the batch
+    for key_id, group in groups.items():
+        try:
+            actor_data, jobs = prepare_group(key_id, group, activities, results, prepared_items, now)
+        except Exception as e:
+            logger.exception('could not check the signatures made with %s', key_id)
+            fail_items([item.id for item in group], results, prepared_items, f'could not check the signature: {e}')
+            continue
+        for start in range(0, len(jobs), VERIFY_CHUNK_SIZE):
+            chunk = jobs[start:start + VERIFY_CHUNK_SIZE]
+            if executor is None:
+                try:
+                    results.update(verify_prepared(actor_data, chunk))
+                except Exception as e:
+                    logger.exception('could not verify the signatures made with %s', key_id)
+                    fail_items([job_id for job_id, _ in chunk], results, prepared_items, f'could not verify: {e}')
+            else:
+                futures.append((key_id, chunk, executor.submit(verify_prepared, actor_data, chunk)))
+    for key_id, chunk, future in futures:
+        try:
+            results.update(future.result())
+        except Exception as e:
+            logger.exception('could not verify the signatures made with %s', key_id)
+            fail_items([job_id for job_id, _ in chunk], results, prepared_items, f'could not verify: {e}')
+
+    handled = rejected = 0
+    for item in items:
+        result = results[item.id]
+        item.processed_at = timezone.now()
+        if result.success:
+            prepared = prepared_items[item.id]
+            # a copy could be queued until the window closes and then wait as long as this one did
+            expires_at = prepared.signed_at + signature_max_age() + max(0, now - item.received_at.timestamp())
+            if not replay_cache.add(prepared.replay_key, expires_at, now):
+                metrics.increment('activitypub_signature_replays_total')
+                result = ValidateResult.fail('Replayed signature')
+        if not result.success:
+            logger.warning('invalid signature for %s: %s', item.key_id, result.error)
+            item.status, item.error = 401, result.error
+            rejected += 1
+            continue
+
+        try:
+            response = handle_activity(QueuedRequest(item), activities[item.id], item.local_actor)
+            item.status, item.error = response.status_code, ''
+            if response.status_code >= 400:
+                item.error = response.content.decode('utf-8', 'replace')
+        except Exception as e:
+            logger.exception('could not handle queued activity %s', item.id)
+            item.status, item.error = 500, str(e)
+        handled += 1
+
+    InboxItem.objects.bulk_update(items, ['processed_at', 'status', 'error'])
+    return handled, rejected
+
+
+def verify_pending(batch_size=VERIFY_BATCH_SIZE, processes=None, progress=None):
+    """
+    Verify and handle queued inbox items in batches of batch_size, using processes worker processes for the
+    signatures (one verifies in this process). Returns (handled, rejected).
+    """
+    processes = verify_processes() if processes is None else processes
+    executor = None
+    if processes > 1:
+        # spawned workers only import signed_requests, and don't share database connections with this process
+        executor = ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context('spawn'))
+
+    total = pending().count()
+    last_id = 0
+    handled = rejected = done = 0
+    try:
+        while True:
+            items = list(pending().filter(id__gt=last_id).select_related('local_actor').order_by('id')[:batch_size])
+            if not items:
+                break
+            batch_handled, batch_rejected = verify_batch(items, executor)
+            handled += batch_handled
+            rejected += batch_rejected
+            done += len(items)
+            last_id = items[-1].id
+            if progress:
+                progress(done, total)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return handled, rejected
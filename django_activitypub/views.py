@@ -1,4 +1,5 @@
 import json
+import logging
 import re
 import uuid, requests
 from urllib.parse import quote, urlparse
@@ -6,40 +7,62 @@ from urllib.parse import quote, urlparse
 from xml.etree.ElementTree import Element, SubElement, tostring
 from xml.dom.minidom import parseString
 
-from django.http import JsonResponse, HttpResponse, Http404
-from django.shortcuts import get_object_or_404
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, Http404
+from django.shortcuts import get_object_or_404, render
 from django.urls import reverse, resolve
 from django.core.paginator import Paginator
+from django.db.models import Prefetch
+from django.utils.cache import patch_vary_headers
 from django.views.decorators.csrf import csrf_exempt
-from django_activitypub.models import ActorChoices, LocalActor, RemoteActor, Follower, Following, Note, get_with_url, parse_hashtags
-from django_activitypub.signed_requests import signed_post, SignatureChecker
-from django_activitypub.webfinger import fetch_remote_profile, WebfingerException
+from django_activitypub.models import ActorChoices, DeliveryPriority, LocalActor, RemoteActor, RemoteObject, Follower, Following, Note, Hashtag, NoteHashtag, get_with_url, send_old_notes
+from django_activitypub import client, media, metrics
+from django_activitypub.collection_sync import check_synchronization, collection_sync_enabled, host_followers
+from django_activitypub.delivery import queue_delivery
+from django_activitypub.encoding import ActivityJsonResponse, cached_dumps, dumps, dumps_with_items
+from django_activitypub.hashtags import featured_tags, hashtag_key
+from django_activitypub.nodeinfo import get_usage, nodeinfo_document
+from django_activitypub.profiling import query_budget
+from django_activitypub.ratelimit import admit_verified, throttle_inbox
+from django_activitypub.signed_requests import SignatureChecker
+from django_activitypub.utils.lru import LRUCache
+from django_activitypub.verification import inbox_item, queue_inbox
+from django_activitypub.webfinger import (
+    WEBFINGER_GENERATION_KEY, WebfingerException, evict_remote_profile, fetch_remote_profile, webfinger_cache,
+    webfinger_cache_key, webfinger_cache_timeout,
+)
 from django.utils.safestring import mark_safe
 
+ACTOR_TYPES = ('Person', 'Service', 'Application', 'Group', 'Organization')
 
-def webfinger(request):
+logger = logging.getLogger('django_activitypub.inbox')
+
+HOST_DOCUMENT_CACHE_SIZE = 64
+TAG_PAGE_SIZE = 20
+host_documents = LRUCache(HOST_DOCUMENT_CACHE_SIZE)
+
+
+def webfinger_account(request):
+    """
+    Returns (username, domain) for the webfinger resource of request, or an error response.
+    """
     resource = request.GET.get('resource')
     acct_m = re.match(r'^acct:(?P<username>.+?)@(?P<domain>.+)$', resource)
     if acct_m:
-        username = acct_m.group('username')
-        domain = acct_m.group('domain')
+        return acct_m.group('username'), acct_m.group('domain')
     elif resource.startswith('http'):
         parsed = urlparse(resource)
         if parsed.scheme != request.scheme or parsed.netloc != request.get_host():
-            return JsonResponse({'error': 'invalid resource'}, status=404)
+            return ActivityJsonResponse({'error': 'invalid resource'}, status=404)
         url = resolve(parsed.path)
         if url.url_name != 'activitypub-profile':
-            return JsonResponse({'error': 'unknown resource'}, status=404)
-        username = url.kwargs.get('username')
-        domain = request.get_host()
+            return ActivityJsonResponse({'error': 'unknown resource'}, status=404)
+        return url.kwargs.get('username'), request.get_host()
     else:
-        return JsonResponse({'error': 'unsupported resource'}, status=404)
+        return ActivityJsonResponse({'error': 'unsupported resource'}, status=404)
 
-    try:
-        actor = LocalActor.objects.get(preferred_username=username, domain=domain)
-    except LocalActor.DoesNotExist:
-        return JsonResponse({'error': 'no actor by that name'}, status=404)
 
+def webfinger_response(request, actor):
     data = {
         'subject': f'acct:{actor.preferred_username}@{actor.domain}',
         'links': [
@@ -58,10 +81,60 @@ def webfinger(request):
             'href': request.build_absolute_uri(actor.icon.url),
         })
 
-    return JsonResponse(data, content_type="application/jrd+json")
+    return ActivityJsonResponse(data, content_type="application/jrd+json")
 
 
-def hostmeta(request):
+def cached_webfinger_response(cached):
+    status, content_type, content = cached
+    return ActivityJsonResponse(content, status=status, content_type=content_type)
+
+
+def webfinger_cache_entry(response):
+    return response.status_code, response['Content-Type'], response.content
+
+
+@query_budget(2)
+def webfinger(request):
+    cache = webfinger_cache()
+    key = webfinger_cache_key(request, cache.get(WEBFINGER_GENERATION_KEY, 0))
+    cached = cache.get(key)
+    metrics.cache_lookup('webfinger', cached is not None)
+    if cached is not None:
+        return cached_webfinger_response(cached)
+
+    response = find_actor(request)
+    if response.status_code in (200, 404):
+        cache.set(key, webfinger_cache_entry(response), webfinger_cache_timeout(response.status_code))
+    return response
+
+
+def find_actor(request):
+    account = webfinger_account(request)
+    if isinstance(account, HttpResponse):
+        return account
+    username, domain = account
+
+    try:
+        actor = LocalActor.objects.get(preferred_username=username, domain=domain)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({'error': 'no actor by that name'}, status=404)
+
+    return webfinger_response(request, actor)
+
+
+def host_document(request, name, render):
+    """
+    These documents only depend on the host they are served from, so each is rendered once per host.
+    """
+    key = (name, request.scheme, request.get_host())
+    content = host_documents.get(key)
+    if content is None:
+        content = render(request)
+        host_documents.set(key, content)
+    return content
+
+
+def render_hostmeta(request):
     data = {
         "Link": {
             "rel": "lrdd",
@@ -76,11 +149,14 @@ def hostmeta(request):
             element.set(attr, value)
             
     raw_xml = tostring(xrd, encoding="utf-8")
-    xml_content  = parseString(raw_xml).toprettyxml(indent="  ", encoding="utf-8")
-    return HttpResponse(xml_content, content_type="application/xml")
+    return parseString(raw_xml).toprettyxml(indent="  ", encoding="utf-8")
 
 
-def nodeinfo_links(request):
+def hostmeta(request):
+    return HttpResponse(host_document(request, 'host-meta', render_hostmeta), content_type="application/xml")
+
+
+def render_nodeinfo_links(request):
     base_url = request.build_absolute_uri('/')
     data = {
         "links": [
@@ -90,82 +166,31 @@ def nodeinfo_links(request):
             }
         ]
     }
-    return JsonResponse(data)
+    return dumps(data)
+
+
+def nodeinfo_links(request):
+    return ActivityJsonResponse(host_document(request, 'nodeinfo-links', render_nodeinfo_links))
 
 
-#TODO: Get settings from models
 def nodeinfo(request, version):
     if version == '2.0':
-        data = {
-                "version": "2.0",
-                "software": {
-                    "name": "finalboss",
-                    "version": "1.0",
-                    "homepage": "https://iamthefinalboss.com"
-                },
-                "protocols": ["activitypub"],
-                "services": {
-                    "inbound": [],
-                    "outbound": []
-                },
-                "openRegistrations": False,
-                "usage": {
-                    "users": {
-                    "total": 0,
-                    "activeHalfyear": 0,
-                    "activeMonth": 0
-                    },
-                    "localPosts": 0, #TO: get total posts and replies from Notes
-                    "localComments": 0
-                },
-                "metadata": {
-                    "nodeName": "I am the Final Boss",
-                    "nodeDescription": "Just another #webcomic site #webtoon #漫画"
-                },
-                "nodeAdmins": [
-                    {
-                        "name": "rensensei",
-                        "email": "rensensei@outlook.com"
-                    }
-                ],
-                "maintainer": [
-                    {
-                        "name": "rensensei",
-                        "email": "rensensei@outlook.com"
-                    }
-                ],
-                "langs": [],
-                "tosUrl": "https://iamthefinalboss.com/terms/",
-                "privacyPolicyUrl": None,
-                "inquiryUrl": None,
-                "impressumUrl": None,
-                "repositoryUrl": None,
-                "feedbackUrl": None,
-                "disableRegistration": True,
-                "disableLocalTimeline": False,
-                "disableGlobalTimeline": True,
-                "emailRequiredForSignup": True,
-                "enableHcaptcha": False,
-                "enableRecaptcha": False,
-                "enableMcaptcha": False,
-                "enableTurnstile": False,
-                "maxNoteTextLength": 3000,
-                "enableEmail": False,
-                "enableServiceWorker": False,
-                "proxyAccountName": "proxy",
-                "themeColor": "#000000"
-        }
-        return JsonResponse(data)
+        return ActivityJsonResponse(nodeinfo_document(get_usage()))
     else:
-        return JsonResponse({'error': 'Unsupported version'}, status=404)
+        return ActivityJsonResponse({'error': 'Unsupported version'}, status=404)
 
 
+@query_budget(3)
 def profile(request, username):
     try:
         actor = LocalActor.objects.get(preferred_username=username)
     except LocalActor.DoesNotExist:
-        return JsonResponse({}, status=404)
+        return ActivityJsonResponse({}, status=404)
+
+    return profile_response(request, actor, list(featured_tags(actor)))
+
 
+def profile_response(request, actor, featured):
     data = {
         '@context': [
             'https://www.w3.org/ns/activitystreams',
@@ -173,23 +198,17 @@ def profile(request, username):
             "https://join-lemmy.org/context.json",
         ]
     }
-    data.update(actor.as_json())
-
-    # TODO: featuredTags is in collection pagination
-    url_pattern = re.compile(r'(https?://www\.|https?://)([^\s]+?\.[^\s]+?\b)')
-    domain = url_pattern.findall(request.headers.get("User-Agent", '')) or url_pattern.findall(request.headers.get("Signature", ''))
-    if domain and type(domain) is list and type(domain[0]) is tuple and len(domain[0]) > 1:
-        data['featuredTags'] = list(parse_hashtags('#IndieComics #Gamer #DigitalArt #ArtistOnMastodon', domain[0][1]))
-
-    return JsonResponse(data, content_type="application/activity+json")
+    data.update(actor.as_json(featured=featured))
+    return ActivityJsonResponse(data, content_type="application/activity+json")
 
 
+@query_budget(5)
 def notes(request, username, id, mode = 'statuses'):
     data = {"@context": "https://www.w3.org/ns/activitystreams"}
     try:
-        note = Note.objects.get(content_id=id)
+        note = Note.objects.select_related('local_actor', 'remote_actor', 'parent').get(content_id=id)
     except:
-        return JsonResponse({'error': 'Not Found'}, status=404)
+        return ActivityJsonResponse({'error': 'Not Found'}, status=404)
     if mode == 'statuses':
         data.update(note.as_json(mode='statuses'))
     elif mode == 'activity':
@@ -238,8 +257,8 @@ def notes(request, username, id, mode = 'statuses'):
                 data['partOf'] = replies_url
                 data['items'] = [note.get_absolute_url() for note in page.object_list]
             else:
-                return JsonResponse({'error': f'invalid page number {page_num}'}, status=404)
-    return JsonResponse(data, content_type="application/activity+json")
+                return ActivityJsonResponse({'error': f'invalid page number {page_num}'}, status=404)
+    return ActivityJsonResponse(data, content_type="application/activity+json")
 
 
 @csrf_exempt
@@ -253,7 +272,7 @@ def remote_redirect(request, username, domain):
         RemoteActor.objects.get_or_create_with_username_domain(username, domain)
         uri = request.GET.get('uri', handle)
         # Request WebFinger data
-        response = requests.get(webfinger_url, params=params, timeout=5)
+        response = client.get_json(webfinger_url, kind='webfinger', params=params, headers={'Accept': 'application/jrd+json'})
         response.raise_for_status()  # Raise error for non-200 responses
         data = response.json()
 
@@ -264,16 +283,16 @@ def remote_redirect(request, username, domain):
                 subscribe_template = link.get('template')
                 break
         if not subscribe_template:
-            return JsonResponse({'error': 'Subscribe template not found'}, status=404)
+            return ActivityJsonResponse({'error': 'Subscribe template not found'}, status=404)
 
         # Format the subscribe URL for the given user
         subscribe_url = subscribe_template.replace('{uri}', uri)
 
-        return JsonResponse({'url': subscribe_url})
+        return ActivityJsonResponse({'url': subscribe_url})
     except Http404:
-        return JsonResponse({'error': 'Invalid server domain'}, status=404)
+        return ActivityJsonResponse({'error': 'Invalid server domain'}, status=404)
     except requests.RequestException as e:
-        return JsonResponse({'error': str(e)}, status=500)
+        return ActivityJsonResponse({'error': str(e)}, status=500)
     
 
 @csrf_exempt
@@ -290,20 +309,21 @@ def remote_handle_redirect(request):
                     domain = handle_m.group('domain')
                     remote_actor = RemoteActor.objects.get_or_create_with_username_domain(username, domain)
                     parse = urlparse(remote_actor.get_absolute_url())
-                    return JsonResponse({'redirect': f'{parse.scheme}://{parse.netloc}/@{actor.handle}'}, content_type="application/activity+json")
+                    return ActivityJsonResponse({'redirect': f'{parse.scheme}://{parse.netloc}/@{actor.handle}'}, content_type="application/activity+json")
         except Exception as e:
             # with open('/var/www/static/debug.html', 'w') as f:
             #     f.write(request.body.decode('utf-8'))
-            return JsonResponse({'error': str(e), 'attributed': request.POST.get('attributed', ''), 'handle': request.POST.get('handle', '')}, status=500)
-    return JsonResponse({}, status=405)
+            return ActivityJsonResponse({'error': str(e), 'attributed': request.POST.get('attributed', ''), 'handle': request.POST.get('handle', '')}, status=500)
+    return ActivityJsonResponse({}, status=405)
 
+@query_budget(3)
 def followers(request, username):
     try:
         actor = LocalActor.objects.get(preferred_username=username)
     except LocalActor.DoesNotExist:
-        return JsonResponse({}, status=404)
+        return ActivityJsonResponse({}, status=404)
 
-    query = Follower.objects.order_by('-follow_date').select_related('remote_actor').filter(following=actor)
+    query = Follower.objects.order_by('-follow_date').filter(following=actor).values_list('remote_actor__url', flat=True)
     paginator = Paginator(query, 10)
     page_num_arg = request.GET.get('page', None)
     followers_url = request.build_absolute_uri(reverse('activitypub-followers', kwargs={'username': actor.preferred_username}))
@@ -316,7 +336,7 @@ def followers(request, username):
 
     if page_num_arg is None:
         data['first'] = followers_url + '?page=1'
-        return JsonResponse(data, content_type="application/activity+json")
+        return ActivityJsonResponse(data, content_type="application/activity+json")
 
     page_num = int(page_num_arg)
 
@@ -326,20 +346,21 @@ def followers(request, username):
             data['next'] = followers_url + f'?page={page.next_page_number()}'
         data['id'] = followers_url + f'?page={page_num}'
         data['type'] = 'OrderedCollectionPage'
-        data['orderedItems'] = [follower.remote_actor.url for follower in page.object_list]
+        data['orderedItems'] = list(page.object_list)
         data['partOf'] = followers_url
-        return JsonResponse(data, content_type="application/activity+json")
+        return ActivityJsonResponse(data, content_type="application/activity+json")
     else:
-        return JsonResponse({'error': f'invalid page number {page_num}'}, status=404)
+        return ActivityJsonResponse({'error': f'invalid page number {page_num}'}, status=404)
 
 
+@query_budget(3)
 def followings(request, username):
     try:
         actor = LocalActor.objects.get(preferred_username=username)
     except LocalActor.DoesNotExist:
-        return JsonResponse({}, status=404)
+        return ActivityJsonResponse({}, status=404)
 
-    query = Following.objects.order_by('-follow_date').select_related('remote_actor').filter(following=actor)
+    query = Following.objects.order_by('-follow_date').filter(following=actor).values_list('remote_actor__url', flat=True)
     paginator = Paginator(query, 10)
     page_num_arg = request.GET.get('page', None)
     followers_url = request.build_absolute_uri(reverse('activitypub-following', kwargs={'username': actor.preferred_username}))
@@ -352,7 +373,7 @@ def followings(request, username):
 
     if page_num_arg is None:
         data['first'] = followers_url + '?page=1'
-        return JsonResponse(data, content_type="application/activity+json")
+        return ActivityJsonResponse(data, content_type="application/activity+json")
 
     page_num = int(page_num_arg)
 
@@ -362,183 +383,270 @@ def followings(request, username):
             data['next'] = followers_url + f'?page={page.next_page_number()}'
         data['id'] = followers_url + f'?page={page_num}'
         data['type'] = 'OrderedCollectionPage'
-        data['orderedItems'] = [follower.remote_actor.url for follower in page.object_list]
+        data['orderedItems'] = list(page.object_list)
         data['partOf'] = followers_url
-        return JsonResponse(data, content_type="application/activity+json")
+        return ActivityJsonResponse(data, content_type="application/activity+json")
     else:
-        return JsonResponse({'error': f'invalid page number {page_num}'}, status=404)
+        return ActivityJsonResponse({'error': f'invalid page number {page_num}'}, status=404)
+
+
+@query_budget(2)
+def followers_sync(request, username):
+    """
+    The FEP-8fcf partial followers collection: the actor's followers on the server given by the host parameter.
+    """
+    host = request.GET.get('host', '').lower()
+    if not host:
+        return ActivityJsonResponse({'error': 'missing host parameter'}, status=400)
+    try:
+        actor = LocalActor.objects.get(preferred_username=username)
+    except LocalActor.DoesNotExist:
+        return ActivityJsonResponse({}, status=404)
+
+    items = host_followers(actor, host)
+    data = {
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        'id': request.build_absolute_uri(),
+        'type': 'OrderedCollection',
+        'totalItems': len(items),
+        'orderedItems': items,
+    }
+    return ActivityJsonResponse(data, content_type="application/activity+json")
 
 
 @csrf_exempt
+@metrics.instrument_inbox
+@throttle_inbox
 def inbox(request, username):
-    response = {}
-
     if request.method == 'POST':
-        base_url = f'{request.scheme}://{request.get_host()}'
         activity = json.loads(request.body)
+        request.activitypub_activity_type = activity.get('type', 'unknown')
 
         try:
             actor = LocalActor.objects.get(preferred_username=username)
         except LocalActor.DoesNotExist:
-            return JsonResponse({}, status=404)
+            return ActivityJsonResponse({}, status=404)
+
+        if queue_inbox():
+            item = inbox_item(request, actor)
+            if not item.key_id:
+                return ActivityJsonResponse({'error': 'missing signature'}, status=401)
+            item.save()
+            return ActivityJsonResponse({}, status=202)
 
         if validate_resp := validate_post_request(request, activity, actor):
             return validate_resp
+        if rejection := admit_verified(request):
+            return rejection
 
-        if activity['type'] == 'Follow':
-            # validate the 'object' is the actor
-            local_actor = LocalActor.objects.get_by_url(activity['object'])
-            if local_actor.id != actor.id:
-                return JsonResponse({'error': f'follow object does not match actor: {activity["object"]}'}, status=400)
-
-            # find or create a remote actor
-            remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
-
-            Follower.objects.get_or_create(
-                remote_actor=remote_actor,
-                following=actor,
-            )
-
-            # send an Accept activity
-            accept_data = {
-                '@context': [
-                    'https://www.w3.org/ns/activitystreams',
-                    'https://w3id.org/security/v1',
-                ],
-                'id': request.build_absolute_uri(f'/{uuid.uuid4()}'),
-                'type': 'Accept',
-                'actor': request.build_absolute_uri(reverse('activitypub-profile', kwargs={'username': actor.preferred_username})),
-                'object': activity,
-            }
+        return handle_activity(request, activity, actor)
+    else:
+        return ActivityJsonResponse({}, status=405)
 
-            sign_resp = signed_post(
-                url=remote_actor.profile.get('inbox'),
-                private_key=actor.private_key.encode('utf-8'),
-                public_key_url=accept_data['actor'] + '#main-key',
-                body=json.dumps(accept_data),
-            )
-            sign_resp.raise_for_status()
 
-            response['ok'] = True
+def handle_activity(request, activity, actor):
+    """
+    Apply an activity delivered to actor's inbox. The request signature must already have been verified.
+    """
+    response = {}
+    base_url = f'{request.scheme}://{request.get_host()}'
+
+    if collection_sync_enabled() and (sync_header := request.headers.get('Collection-Synchronization')):
+        check_synchronization(activity.get('actor', ''), sync_header, request.get_host())
+
+    if activity['type'] == 'Follow':
+        # validate the 'object' is the actor
+        local_actor = LocalActor.objects.get_by_url(activity['object'])
+        if local_actor.id != actor.id:
+            return ActivityJsonResponse({'error': f'follow object does not match actor: {activity["object"]}'}, status=400)
+
+        # find or create a remote actor
+        remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
+
+        _, created = Follower.objects.get_or_create(
+            remote_actor=remote_actor,
+            following=actor,
+        )
+
+        # send an Accept activity
+        accept_data = {
+            '@context': [
+                'https://www.w3.org/ns/activitystreams',
+                'https://w3id.org/security/v1',
+            ],
+            'id': request.build_absolute_uri(f'/{uuid.uuid4()}'),
+            'type': 'Accept',
+            'actor': request.build_absolute_uri(reverse('activitypub-profile', kwargs={'username': actor.preferred_username})),
+            'object': activity,
+        }
 
-        elif activity['type'] == 'Like':
-            note = None
-            if type(activity['object']) is not dict: 
-                if activity['object'].startswith(base_url):
-                    note = get_with_url(activity['object'])
-                else:
-                    try:
-                        note = get_object_or_404(Note, content_url=activity['object'])
-                    except Http404:
-                        pass
-            if not note:
-                return JsonResponse({'error': f'like object is not a note: {activity["object"]}'}, status=400)
+        # replies go in the most urgent lane, ahead of fan-outs and bulk deliveries
+        accept, = queue_delivery(
+            actor, dumps(accept_data).decode('utf-8'), [remote_actor.inbox], priority=DeliveryPriority.REPLY,
+        )
 
-            remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
-            note.likes.add(remote_actor)
+        # deliver older notes to the new follower in the background, once it has the Accept
+        if created:
+            send_old_notes(actor, remote_actor, after=accept.id)
 
-            response['ok'] = True
+        response['ok'] = True
 
-        elif activity['type'] == 'Announce':
-            note = None
-            if type(activity['object']) is not dict:
-                if activity['object'].startswith(base_url):
-                    note = get_with_url(activity['object'])
-                else:
-                    try:
-                        note = get_object_or_404(Note, content_url=activity['object'])
-                    except Http404:
-                        pass
-            if not note:
-                return JsonResponse({'error': f'announce object is not a note: {activity["object"]}'}, status=400)
+    elif activity['type'] == 'Like':
+        note = None
+        if type(activity['object']) is not dict: 
+            if activity['object'].startswith(base_url):
+                note = get_with_url(activity['object'])
+            else:
+                try:
+                    note = get_object_or_404(Note, content_url=activity['object'])
+                except Http404:
+                    pass
+        if not note:
+            return ActivityJsonResponse({'error': f'like object is not a note: {activity["object"]}'}, status=400)
+
+        remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
+        note.likes.add(remote_actor)
+
+        response['ok'] = True
+
+    elif activity['type'] == 'Announce':
+        note = None
+        if type(activity['object']) is not dict:
+            if activity['object'].startswith(base_url):
+                note = get_with_url(activity['object'])
+            else:
+                try:
+                    note = get_object_or_404(Note, content_url=activity['object'])
+                except Http404:
+                    pass
+        if not note:
+            return ActivityJsonResponse({'error': f'announce object is not a note: {activity["object"]}'}, status=400)
+
+        remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
+        note.announces.add(remote_actor)
+
+        response['ok'] = True
+
+    elif activity['type'] == 'Create':
+        if activity['object']['id'].startswith(base_url):
+            pass  # there is nothing to do, this is our note
+        else:
+            # TODO: only record in db if the notes are replies
+            Note.objects.upsert_remote(base_url, activity['object'])
+        response['ok'] = True
+
+    elif activity['type'] == 'Undo':
+        to_undo = activity['object']
+        if to_undo['type'] == 'Follow':
+            # validate the 'object' is the actor
+            local_actor = LocalActor.objects.get_by_url(to_undo['object'])
+            if local_actor.id != actor.id:
+                return ActivityJsonResponse({'error': f'undo follow object does not match actor: {to_undo["object"]}'}, status=400)
+
+            remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
 
-            remote_actor = RemoteActor.objects.get_or_create_with_url(url=activity['actor'], actor=actor)
-            note.announces.add(remote_actor)
+            local_actor.followers.remove(remote_actor)
 
             response['ok'] = True
 
-        elif activity['type'] == 'Create':
-            if activity['object']['id'].startswith(base_url):
-                pass  # there is nothing to do, this is our note
+        elif to_undo['type'] == 'Like':
+            if to_undo['object'].startswith(base_url):
+                note = get_with_url(to_undo['object'])
             else:
-                # TODO: only record in db if the notes are replies
-                Note.objects.upsert_remote(base_url, activity['object'])
-            response['ok'] = True
+                try:
+                    note = get_object_or_404(Note, content_url=activity['object'])
+                except Http404:
+                    note = None
+            if not note:
+                return ActivityJsonResponse({'error': f'undo like object is not a note: {to_undo["object"]}'}, status=400)
 
-        elif activity['type'] == 'Undo':
-            to_undo = activity['object']
-            if to_undo['type'] == 'Follow':
-                # validate the 'object' is the actor
-                local_actor = LocalActor.objects.get_by_url(to_undo['object'])
-                if local_actor.id != actor.id:
-                    return JsonResponse({'error': f'undo follow object does not match actor: {to_undo["object"]}'}, status=400)
+            remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
+            note.likes.remove(remote_actor)
 
-                remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
+            response['ok'] = True
 
-                local_actor.followers.remove(remote_actor)
+        elif to_undo['type'] == 'Announce':
+            if to_undo['object'].startswith(base_url):
+                note = get_with_url(to_undo['object'])
+            else:
+                try:
+                    note = get_object_or_404(Note, content_url=activity['object'])
+                except Http404:
+                    note = None
+            if not note:
+                return ActivityJsonResponse({'error': f'undo announce object is not a note: {to_undo["object"]}'}, status=400)
 
-                response['ok'] = True
+            remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
+            note.announces.remove(remote_actor)
 
-            elif to_undo['type'] == 'Like':
-                if to_undo['object'].startswith(base_url):
-                    note = get_with_url(to_undo['object'])
-                else:
-                    try:
-                        note = get_object_or_404(Note, content_url=activity['object'])
-                    except Http404:
-                        note = None
-                if not note:
-                    return JsonResponse({'error': f'undo like object is not a note: {to_undo["object"]}'}, status=400)
+            response['ok'] = True
 
-                remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
-                note.likes.remove(remote_actor)
+        else:
+            return ActivityJsonResponse({'error': f'unsupported undo type: {to_undo["type"]}'}, status=400)
+
+    elif activity['type'] == 'Delete':
+        to_delete = activity['object']
+        object_id = to_delete.get('id') if type(to_delete) is dict else to_delete
+        if object_id == activity['actor']:
+            RemoteActor.objects.delete_remote(object_id)
+        elif object_id and not object_id.startswith(base_url):
+            # only the author of a note may delete it
+            Note.objects.filter(content_url=object_id, remote_actor__url=activity['actor']).tombstone_remote()
+            RemoteObject.objects.invalidate(object_id)
+        response['ok'] = True
+
+    elif activity['type'] == 'Accept':
+        response['ok'] = True  
+
+    elif activity['type'] == 'Update':
+        to_update = activity['object']
+        if type(to_update) is dict and to_update.get('type') in ACTOR_TYPES:
+            if to_update.get('id') != activity['actor']:
+                return ActivityJsonResponse({'error': f'actors can only update themselves: {to_update.get("id")}'}, status=403)
+            RemoteActor.objects.update_profile(to_update)
+            evict_remote_profile(to_update['id'])
+        response['ok'] = True 
 
-                response['ok'] = True
+    else:
+        return ActivityJsonResponse({'error': f'unsupported activity type: {activity["type"]}'}, status=400)
 
-            elif to_undo['type'] == 'Announce':
-                if to_undo['object'].startswith(base_url):
-                    note = get_with_url(to_undo['object'])
-                else:
-                    try:
-                        note = get_object_or_404(Note, content_url=activity['object'])
-                    except Http404:
-                        note = None
-                if not note:
-                    return JsonResponse({'error': f'undo announce object is not a note: {to_undo["object"]}'}, status=400)
 
-                remote_actor = get_object_or_404(RemoteActor, url=to_undo['actor'])
-                note.announces.remove(remote_actor)
+    return ActivityJsonResponse(response, content_type="application/activity+json")
 
-                response['ok'] = True
 
-            else:
-                return JsonResponse({'error': f'unsupported undo type: {to_undo["type"]}'}, status=400)
+def outbox_item_key(note):
+    """
+    Everything an outbox item is rendered from, so its encoded bytes can be reused until one of them changes.
+    """
+    return (
+        'outbox', note.id, note.updated_at, note.published_at, note.local_actor.domain,
+        note.local_actor.preferred_username, len(note.likes.all()), len(note.announces.all()),
+        tuple((a.id, a.attachment.name, a.caption) for a in note.attachments.all()),
+    )
 
-        elif activity['type'] == 'Delete':
-            response['ok'] = True  # TODO: support deletes for notes and actors
 
-        elif activity['type'] == 'Accept':
-            response['ok'] = True  
+def outbox_items(notes):
+    return [cached_dumps(outbox_item_key(note), lambda note=note: note.as_json(mode='activity')) for note in notes]
 
-        elif activity['type'] == 'Update':
-            response['ok'] = True 
 
-        else:
-            return JsonResponse({'error': f'unsupported activity type: {activity["type"]}'}, status=400)
-
-        return JsonResponse(response, content_type="application/activity+json")
-    else:
-        return JsonResponse({}, status=405)
+def outbox_queryset(actor):
+    return Note.objects.order_by('-published_at').filter(local_actor=actor, tombstone=False) \
+        .select_related('local_actor', 'parent') \
+        .prefetch_related(
+            Prefetch('likes', queryset=RemoteActor.objects.only('id')),
+            Prefetch('announces', queryset=RemoteActor.objects.only('id')),
+            'attachments',
+        )
 
 
+@query_budget(6)
 def outbox(request, username):
     try:
         actor = LocalActor.objects.get(preferred_username=username)
     except LocalActor.DoesNotExist:
-        return JsonResponse({}, status=404)
-
-    query = Note.objects.order_by('-published_at').filter(local_actor=actor, tombstone=False)
+        return ActivityJsonResponse({}, status=404)
 
+    query = outbox_queryset(actor)
     paginator = Paginator(query, 10)
     page_num_arg = request.GET.get('page', None)
     outbox_url = request.build_absolute_uri(reverse('activitypub-outbox', kwargs={'username': actor.preferred_username}))
@@ -551,7 +659,7 @@ def outbox(request, username):
 
     if page_num_arg is None:
         data['first'] = outbox_url + '?page=1'
-        return JsonResponse(data, content_type="application/activity+json")
+        return ActivityJsonResponse(data, content_type="application/activity+json")
 
     page_num = int(page_num_arg)
 
@@ -562,11 +670,118 @@ def outbox(request, username):
             data['next'] = outbox_url + f'?page={page.next_page_number()}'
         data['id'] = outbox_url + f'?page={page_num}'
         data['type'] = 'OrderedCollectionPage'
-        data['orderedItems'] = [note.as_json(mode='activity') for note in page.object_list]
         data['partOf'] = outbox_url
-        return JsonResponse(data, content_type="application/activity+json")
+        items = outbox_items(page.object_list)
+        return ActivityJsonResponse(dumps_with_items(data, 'orderedItems', items), content_type="application/activity+json")
+    else:
+        return ActivityJsonResponse({'error': f'invalid page number: {page_num}'}, status=404)
+
+
+def wants_activity_json(request):
+    accept = request.headers.get('Accept', '')
+    return 'application/activity+json' in accept or 'application/ld+json' in accept
+
+
+def tag_queryset(hashtag):
+    return NoteHashtag.objects.filter(hashtag=hashtag).order_by('-published_at', '-note_id') \
+        .select_related('note__local_actor__user', 'note__remote_actor') \
+        .defer('note__remote_actor__profile')
+
+
+@query_budget(3)
+def tag_timeline(request, tag):
+    """
+    The notes using a hashtag, newest first: an OrderedCollection for ActivityPub clients and a page for browsers.
+    """
+    activity_json = wants_activity_json(request)
+    hashtag = Hashtag.objects.filter(name=hashtag_key(tag)).first()
+    if hashtag is None:
+        if activity_json:
+            return ActivityJsonResponse({'error': 'unknown tag'}, status=404)
+        raise Http404('unknown tag')
+
+    paginator = Paginator(tag_queryset(hashtag), TAG_PAGE_SIZE)
+    if activity_json:
+        response = tag_collection(request, hashtag, paginator)
     else:
-        return JsonResponse({'error': f'invalid page number: {page_num}'}, status=404)
+        page = paginator.get_page(request.GET.get('page'))
+        response = render(request, 'pub/tag.html', {
+            'hashtag': hashtag,
+            'page': page,
+            'notes': [row.note for row in page.object_list],
+            'base_url': f'{request.scheme}://{request.get_host()}',
+        })
+    patch_vary_headers(response, ['Accept'])
+    return response
+
+
+def tag_collection(request, hashtag, paginator):
+    tag_url = request.build_absolute_uri(reverse('activitypub-tag', kwargs={'tag': hashtag.name}))
+    data = {
+        '@context': 'https://www.w3.org/ns/activitystreams',
+        'type': 'OrderedCollection',
+        'totalItems': paginator.count,
+        'id': tag_url,
+    }
+    page_num_arg = request.GET.get('page', None)
+    if page_num_arg is None:
+        data['first'] = tag_url + '?page=1'
+        return ActivityJsonResponse(data, content_type="application/activity+json")
+
+    page_num = int(page_num_arg) if page_num_arg.isdigit() else 0
+    if not 1 <= page_num <= paginator.num_pages:
+        return ActivityJsonResponse({'error': f'invalid page number: {page_num_arg}'}, status=404)
+    page = paginator.page(page_num)
+    if page.has_next():
+        data['next'] = tag_url + f'?page={page.next_page_number()}'
+    data['id'] = tag_url + f'?page={page_num}'
+    data['type'] = 'OrderedCollectionPage'
+    data['partOf'] = tag_url
+    data['orderedItems'] = [row.note.get_absolute_url() for row in page.object_list]
+    return ActivityJsonResponse(data, content_type="application/activity+json")
+
+
+def metrics_view(request):
+    if not getattr(settings, 'ACTIVITYPUB_METRICS_ENABLED', False):
+        raise Http404
+    token = getattr(settings, 'ACTIVITYPUB_METRICS_TOKEN', None)
+    if token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponse(status=403)
+
+    backend = metrics.get_backend()
+    if not hasattr(backend, 'render'):
+        raise Http404
+    metrics.collect()
+    return HttpResponse(backend.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
+def media_proxy(request, token):
+    """
+    Serve remote media through our cache, so pages don't wait on remote servers or reveal readers to them.
+    """
+    try:
+        url, variant = media.unsign(token)
+    except media.MediaError:
+        return HttpResponse(status=400)
+    try:
+        content_type, digest = media.get(url, variant)
+        blob = open(media.blob_path(digest), 'rb')
+    except (media.MediaError, OSError):
+        response = HttpResponse(status=404)
+        response['Cache-Control'] = f'public, max-age={media.FAILURE_TIMEOUT}'
+        return response
+
+    etag = f'"{digest}"'
+    if request.headers.get('If-None-Match') == etag:
+        blob.close()
+        response = HttpResponse(status=304)
+    else:
+        response = FileResponse(blob, content_type=content_type)
+    response['ETag'] = etag
+    response['Cache-Control'] = f'public, max-age={media.max_age()}, immutable'
+    response['X-Content-Type-Options'] = 'nosniff'
+    response['Content-Security-Policy'] = "default-src 'none'"
+    return response
 
 
 def validate_post_request(request, activity, actor = None):
@@ -574,14 +789,33 @@ def validate_post_request(request, activity, actor = None):
         raise Exception('Invalid method')
 
     if 'actor' not in activity:
-        return JsonResponse({'error': f'no actor in activity: {activity}'}, status=400)
+        return ActivityJsonResponse({'error': f'no actor in activity: {activity}'}, status=400)
 
-    try:
-        actor_data = fetch_remote_profile(activity['actor'], actor)
-    except WebfingerException:
-        return JsonResponse({'error': 'validate - error fetching remote profile'}, status=400)
+    actor_data = signing_actor_profile(activity['actor'], actor)
+    if actor_data is None:
+        return ActivityJsonResponse({'error': 'validate - error fetching remote profile'}, status=400)
 
-    checker = SignatureChecker(actor_data.get('publicKey'))
+    return verify_signature(request, activity, actor_data)
+
+
+def signing_actor_profile(actor_url, actor=None):
+    """
+    The profile holding the keys actor_url signs with, or None if it can't be found.
+    """
+    try:
+        return fetch_remote_profile(actor_url, actor)
+    except WebfingerException as e:
+        logger.info('could not fetch actor %s: %s', actor_url, e.error)
+        # deleted actors can no longer be fetched, but their Delete is signed with the key we already know. Only an
+        # actor that is gone may fall back to it: after a timeout or server error it may have rotated its key
+        if not e.gone:
+            return None
+        remote_actor = RemoteActor.objects.filter(url=actor_url).first()
+        return remote_actor.key_document() if remote_actor else None
+
+
+def verify_signature(request, activity, actor_data):
+    checker = SignatureChecker.for_actor(actor_data)
     result = checker.validate(
         method=request.method.lower(),
         url=request.build_absolute_uri(),
@@ -590,6 +824,7 @@ def validate_post_request(request, activity, actor = None):
     )
 
     if not result.success:
-        return JsonResponse({'error': 'invalid signature'}, status=401)
+        logger.warning('invalid signature for %s: %s', activity['actor'], result.error)
+        return ActivityJsonResponse({'error': 'invalid signature'}, status=401)
 
     return None
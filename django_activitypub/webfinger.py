@@ -1,9 +1,25 @@
-from django_activitypub.signed_requests import signed_post
-from functools import lru_cache
+from django_activitypub import client, metrics
+from django_activitypub.signed_requests import actor_signed_post
+from django_activitypub.utils.lru import LRUCache
+import hashlib
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
 import requests
 
-WEBFINGER_TIMEOUT = 10
+PROFILE_CACHE_SIZE = 256
+# seconds our own webfinger responses are cached for, unless a LocalActor changes first
+WEBFINGER_CACHE_TIMEOUT = 60 * 60
+WEBFINGER_NEGATIVE_CACHE_TIMEOUT = 5 * 60
+WEBFINGER_GENERATION_KEY = 'ap-webfinger:generation'
+
+# remote actor profiles by URL, so an Update from one actor only drops that actor's profile
+_profiles = LRUCache(PROFILE_CACHE_SIZE)
+
+
+# statuses meaning a remote actor or object is gone for good, rather than unreachable for now
+GONE_STATUSES = (404, 410)
 
 
 class WebfingerException(Exception):
@@ -11,19 +27,32 @@ class WebfingerException(Exception):
         super().__init__()
         self.error = error
 
+    @property
+    def status_code(self):
+        """
+        The HTTP status of the failed request, or None for timeouts and other transport errors.
+        """
+        status = getattr(self.error, 'status_code', None)
+        if status is None and getattr(self.error, 'response', None) is not None:
+            status = self.error.response.status_code
+        return status
+
+    @property
+    def gone(self):
+        return self.status_code in GONE_STATUSES
+
 
 def finger(username, domain):
     try:
-        res = requests.get(
+        res = client.get_json(
             f'https://{domain}/.well-known/webfinger',
+            kind='webfinger',
             params={
                 'resource': f'acct:{username}@{domain}',
             },
             headers={
                 'Accept': 'application/jrd+json',
             },
-            timeout=WEBFINGER_TIMEOUT,
-            verify=True
         )
         res.raise_for_status()
         webfinger_data = res.json()
@@ -45,20 +74,106 @@ def finger(username, domain):
     return data
 
 
-@lru_cache(maxsize=256)
+def requires_signature(res, actor):
+    return actor is not None and isinstance(res.data, dict) and res.data.get('error') == 'Request not signed'
+
+
+def signed_fetch(url, actor):
+    res = actor_signed_post(actor, url, method='get')
+    res.raise_for_status()
+    data = client.parse(res.content)
+    if data is None:
+        raise client.FetchError(f'response from {url} is not JSON', res.status_code)
+    return data
+
+
 def fetch_remote_profile(url, actor=None):
+    data = _profiles.get(url)
+    metrics.cache_lookup('remote_profile', data is not None)
+    if data is not None:
+        return data
+
     try:
-        res = requests.get(url, headers={'Accept': 'application/activity+json'})
+        res = client.get_json(url, kind='profile')
         # signed_post if profile is needs signing
-        if 'error' in res.json() and res.json()['error'] == 'Request not signed' and actor:
-            res = signed_post(
-                url, 
-                actor.private_key.encode('utf-8'), 
-                f'{actor.account_url}#main-key', 
-                method='get'
-            )
+        if requires_signature(res, actor):
+            data = signed_fetch(url, actor)
+        else:
+            res.raise_for_status()
+            data = res.json()
+    except requests.RequestException as e:
+        raise WebfingerException(e)
 
-        res.raise_for_status()
-        return res.json()
+    _profiles.set(url, data)
+    return data
+
+
+async def afetch_remote_profile(url, actor=None):
+    """
+    Async fetch_remote_profile. Without httpx installed this runs fetch_remote_profile in a worker thread.
+    """
+    if client.httpx is None:
+        return await sync_to_async(fetch_remote_profile, thread_sensitive=False)(url, actor)
+
+    data = _profiles.get(url)
+    metrics.cache_lookup('remote_profile', data is not None)
+    if data is not None:
+        return data
+
+    try:
+        res = await client.aget_json(url, kind='profile')
+        if requires_signature(res, actor):
+            data = await sync_to_async(signed_fetch, thread_sensitive=False)(url, actor)
+        else:
+            res.raise_for_status()
+            data = res.json()
     except requests.RequestException as e:
         raise WebfingerException(e)
+
+    _profiles.set(url, data)
+    return data
+
+
+def evict_remote_profile(url):
+    """
+    Drop the cached profile of the remote actor at url, e.g. once it has sent an Update.
+    """
+    _profiles.pop(url)
+
+
+def clear_remote_profile_cache():
+    _profiles.clear()
+
+
+def webfinger_cache():
+    return caches[getattr(settings, 'ACTIVITYPUB_WEBFINGER_CACHE', 'default')]
+
+
+def webfinger_cache_key(request, generation):
+    """
+    Responses depend on the resource and the host they were requested from. generation changes whenever a
+    LocalActor does, which invalidates every cached response at once.
+    """
+    resource = request.GET.get('resource', '')
+    digest = hashlib.sha256(f'{request.scheme}://{request.get_host()} {resource}'.encode('utf-8')).hexdigest()
+    return f'ap-webfinger:{generation}:{digest}'
+
+
+def webfinger_cache_timeout(status):
+    if status == 200:
+        return getattr(settings, 'ACTIVITYPUB_WEBFINGER_CACHE_TIMEOUT', WEBFINGER_CACHE_TIMEOUT)
+    return getattr(settings, 'ACTIVITYPUB_WEBFINGER_NEGATIVE_CACHE_TIMEOUT', WEBFINGER_NEGATIVE_CACHE_TIMEOUT)
+
+
+def invalidate_webfinger_cache():
+    """
+    Drop every cached webfinger response by moving to a new generation. This only reaches other processes when
+    ACTIVITYPUB_WEBFINGER_CACHE is a cache they share, not a per-process LocMemCache.
+    """
+    cache = webfinger_cache()
+    cache.add(WEBFINGER_GENERATION_KEY, 0, None)
+    try:
+        cache.incr(WEBFINGER_GENERATION_KEY)
+    except ValueError:
+        # evicted between add and incr
+        cache.set(WEBFINGER_GENERATION_KEY, 1, None)
@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import django
+from django.conf import settings
+
+project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, project_dir)
+
+BENCHMARK_MODULES = [
+    'benchmarks.bench_signatures',
+    'benchmarks.bench_serialization',
+    'benchmarks.bench_collections',
+    'benchmarks.bench_inbox',
+    'benchmarks.bench_fanout',
+]
+
+
+def setup():
+    settings.configure(
+        DEBUG=False,
+        DATABASES={
+            'default': {
+                'ENGINE': 'django.db.backends.sqlite3',
+                'NAME': ':memory:',
+            }
+        },
+        INSTALLED_APPS=[
+            'django.contrib.auth',
+            'django.contrib.contenttypes',
+            'django_activitypub',
+        ],
+        # build the tables straight from the models
+        MIGRATION_MODULES={'activitypub': None},
+        ROOT_URLCONF='django_activitypub.urls',
+        ALLOWED_HOSTS=['*'],
+        MEDIA_ROOT=tempfile.mkdtemp(prefix='activitypub-bench-'),
+        TIME_ZONE='UTC',
+        USE_TZ=True,
+        ACTIVITYPUB_RUN_TASKS_INLINE=True,
+        ACTIVITYPUB_INBOX_RATE_LIMITS={'address': (1e9, 1e9), 'domain': (1e9, 1e9), 'actor': (1e9, 1e9)},
+    )
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', run_syncdb=True, verbosity=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the federation hot paths')
+    parser.add_argument('select', nargs='*', help='only run benchmarks whose name contains one of these')
+    parser.add_argument('--sizes', default='10,1000,100000', help='row counts for the collection benchmarks')
+    parser.add_argument('--fanout-sizes', default='10,100,1000', help='follower counts for the fan-out benchmarks')
+    parser.add_argument('--output', help='write the results as JSON to this file')
+    parser.add_argument('--compare', help='compare against the results in this JSON file')
+    args = parser.parse_args()
+
+    setup()
+
+    import importlib
+    from benchmarks import runner
+    from benchmarks.fixtures import remote_servers
+
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(module)
+
+    options = {
+        'sizes': [int(s) for s in args.sizes.split(',')],
+        'fanout_sizes': [int(s) for s in args.fanout_sizes.split(',')],
+    }
+    with remote_servers():
+        results = runner.run(args.select, options)
+
+    if args.output:
+        runner.write(results, args.output)
+    if args.compare:
+        with open(args.compare) as f:
+            runner.compare(results, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ from django.conf import settings
 from django.core.management import call_command
 
 
-def setup_and_call_command(*args, **kwargs):
+def setup_and_call_command(*args, extra_settings=None, **kwargs):
     project_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
 
     sys.path.insert(0, project_dir)
@@ -25,6 +25,7 @@ def setup_and_call_command(*args, **kwargs):
         ],
         TIME_ZONE="UTC",
         USE_TZ=True,
+        **(extra_settings or {}),
     )
 
     django.setup()
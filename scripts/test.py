@@ -1,4 +1,12 @@
 from setup import setup_and_call_command
 
 
-setup_and_call_command('test', 'django_activitypub', '--debug-mode', '--verbosity=2')
+setup_and_call_command(
+    'test', 'django_activitypub', '--debug-mode', '--verbosity=2',
+    extra_settings={
+        # the test database is built straight from the models
+        'MIGRATION_MODULES': {'activitypub': None},
+        'ROOT_URLCONF': 'django_activitypub.urls',
+        'ALLOWED_HOSTS': ['*'],
+    },
+)